@@ -0,0 +1,87 @@
+"""
+Per-request instrumentation: a span and a request id for every API request,
+latency histogram and route name on the span for every route.
+"""
+import time
+from http import HTTPStatus
+from typing import Callable
+
+from fastapi import HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+from opentelemetry import propagate, trace
+from opentelemetry.trace import SpanKind
+
+from core.metrics import REQUEST_LATENCY
+from core.tracing import REQUEST_ID_HEADER, new_request_id, request_id, tracer
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware starting the span of an HTTP request.
+    The incoming W3C trace context becomes its parent, the incoming X-Request-Id
+    (or a new one) is kept for outgoing calls and returned in the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        current_id = headers.get(REQUEST_ID_HEADER.lower()) or new_request_id()
+        token = request_id.set(current_id)
+        attributes = {
+            "http.method": scope["method"],
+            "http.target": scope["path"],
+            "http.request_id": current_id,
+        }
+        with tracer.start_as_current_span(f"HTTP {scope['method']}", context=propagate.extract(headers),
+                                          kind=SpanKind.SERVER, attributes=attributes) as span:
+
+            async def send_with_request_id(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                    message["headers"] = [*message.get("headers", []),
+                                          (REQUEST_ID_HEADER.lower().encode(), current_id.encode("latin-1"))]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_request_id)
+            finally:
+                request_id.reset(token)
+
+
+class InstrumentedRoute(APIRoute):
+    """
+    Route that records its latency to REQUEST_LATENCY and names the request span,
+    both with the route path template (/api/v1/film/{film_id}),
+    so the number of series does not depend on ids.
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        route = self.path
+
+        async def instrumented_handler(request: Request) -> Response:
+            span = trace.get_current_span()
+            span.update_name(f"{request.method} {route}")
+            span.set_attribute("http.route", route)
+            start = time.perf_counter()
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            except HTTPException as error:
+                status = error.status_code
+                raise
+            except RequestValidationError:
+                status = HTTPStatus.UNPROCESSABLE_ENTITY
+                raise
+            finally:
+                REQUEST_LATENCY.labels(request.method, route, int(status)).observe(time.perf_counter() - start)
+
+        return instrumented_handler
@@ -0,0 +1,25 @@
+"""
+Prometheus metrics endpoint. Request latency is recorded by api.instrumentation.InstrumentedRoute.
+"""
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from core.metrics import register_stats
+from core.scheduler import scheduler
+from db.redis_cache import codec
+from db.slow_log import slow_log
+from db.tiered_cache import local_cache
+from services.auth import auth_stats
+
+router = APIRouter()
+
+register_stats("background_tasks", scheduler.stats, "Background revalidation tasks")
+register_stats("local_cache", local_cache.stats, "Per-worker cache of the tiered cache backend")
+register_stats("cache_codec", codec.stats, "Compression of cache values")
+register_stats("auth", auth_stats, "Auth service checks and their cache")
+register_stats("es_slow_queries", slow_log.stats, "Slow and profiled Elasticsearch queries")
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
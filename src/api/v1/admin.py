@@ -0,0 +1,38 @@
+from http import HTTPStatus
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query, Response
+
+from api.instrumentation import InstrumentedRoute
+from core.config import ADMIN_ROLES
+from db.slow_log import slow_log
+from services.auth import role_validator_factory
+
+router = APIRouter(route_class=InstrumentedRoute,
+                   dependencies=[Depends(role_validator_factory(roles=ADMIN_ROLES))])
+
+
+@router.get("/slow-queries",
+            description="Последние медленные и профилированные запросы к Elasticsearch этого воркера",
+            )
+async def slow_queries(
+        limit: int = Query(50, ge=1, description="Сколько последних запросов вернуть."),
+        fingerprint: Optional[str] = Query(None, description="Только запросы этой формы."),
+        slow_only: bool = Query(False, description="Без быстрых запросов, попавших в выборку профилирования."),
+) -> dict:
+    return {
+        "threshold_seconds": slow_log.threshold,
+        "profile_sample_rate": slow_log.profile_rate,
+        "stats": slow_log.stats(),
+        "shapes": slow_log.shapes(),
+        "queries": slow_log.recent(limit, fingerprint, slow_only),
+    }
+
+
+@router.delete("/slow-queries",
+               status_code=HTTPStatus.NO_CONTENT,
+               description="Очистка журнала медленных запросов этого воркера",
+               )
+async def clear_slow_queries() -> Response:
+    slow_log.clear()
+    return Response(status_code=HTTPStatus.NO_CONTENT)
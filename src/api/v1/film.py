@@ -1,14 +1,53 @@
 from http import HTTPStatus
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 
-from core.config import FILM_PAGE_NUMBER, FILM_PAGE_SIZE
+from api.instrumentation import InstrumentedRoute
+from api.v1.params import CURSOR_DESCRIPTION, batch_ids
+from api.v1.responses import cached_json_response, json_response
+from api.v1.routing import static_get
+from core.config import EXPORT_ROLES, FILM_PAGE_NUMBER, FILM_PAGE_SIZE
 from models.film import Film, FilmPreview
 from services.auth import role_validator_factory
 from services.film import FilmService, get_film_service
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
+
+
+@static_get(router, "/batch/",
+            response_model=List[Film],
+            description="Подробная информация о нескольких фильмах за один запрос",
+            dependencies=[Depends(role_validator_factory(roles=("user", "subscriber", "admin")))],
+            )
+async def films_batch(ids: List[str] = Depends(batch_ids),
+                      film_service: FilmService = Depends(get_film_service)
+                      ) -> List[Film]:
+    return await film_service.get_many(ids)
+
+
+@static_get(router, "/export/",
+            response_class=StreamingResponse,
+            description="Выгрузка всего каталога фильмов в формате NDJSON",
+            dependencies=[Depends(role_validator_factory(roles=EXPORT_ROLES))],
+            )
+async def films_export(
+        fields: Optional[List[str]] = Query(None,
+                                            description="Поля фильма в выгрузке. По умолчанию поля краткой информации."),
+        full: bool = Query(False, description="Выгружать все поля фильма."),
+        genre: Optional[str] = Query(None, alias="filter[genre]",
+                                     description="Фильтрация фильмов по определенному жанру."),
+        film_service: FilmService = Depends(get_film_service)
+) -> StreamingResponse:
+    if fields:
+        unknown = set(fields) - set(Film.__fields__)
+        if unknown:
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
+                                detail=f"unknown fields: {', '.join(sorted(unknown))}")
+    else:
+        fields = list((Film if full else FilmPreview).__fields__)
+    return StreamingResponse(film_service.export(fields, genre), media_type="application/x-ndjson")
 
 
 @router.get("/{film_id}",
@@ -18,11 +57,11 @@ router = APIRouter()
             )
 async def film_details(film_id: str = Query(None, description="Идентификатор"),
                        film_service: FilmService = Depends(get_film_service)
-                       ) -> Film:
-    film = await film_service.get_by_id(film_id)
+                       ) -> Response:
+    film = await film_service.get_by_id_raw(film_id)
     if not film:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="film not found")
-    return film
+    return json_response(film)
 
 
 @router.get("/",
@@ -39,9 +78,14 @@ async def films_index(
                                     description="Порядковый номер страницы"),
         genre: Optional[str] = Query(None, alias="filter[genre]",
                                      description="Фильтрация фильмов по определенному жанру."),
+        cursor: Optional[str] = Query(None, alias="page[cursor]", description=CURSOR_DESCRIPTION),
         film_service: FilmService = Depends(get_film_service)
-) -> List[FilmPreview]:
-    return await film_service.get_by_search(page=page, size=size, genre=genre, sort=sort)
+) -> Response:
+    if cursor is not None:
+        films = await film_service.get_by_cursor_raw(cursor=cursor, size=size, genre=genre, sort=sort)
+        return cached_json_response(films)
+    films = await film_service.get_by_search_raw(page=page, size=size, genre=genre, sort=sort)
+    return cached_json_response(films, size)
 
 
 @router.get("/search/",
@@ -60,6 +104,11 @@ async def films_index(
                                     description="Порядковый номер страницы."),
         genre: Optional[str] = Query(None, alias="filter[genre]",
                                      description="Фильтрация фильмов по определенному жанру."),
+        cursor: Optional[str] = Query(None, alias="page[cursor]", description=CURSOR_DESCRIPTION),
         film_service: FilmService = Depends(get_film_service)
-) -> List[FilmPreview]:
-    return await film_service.get_by_search(query=query, page=page, size=size, genre=genre, sort=sort)
+) -> Response:
+    if cursor is not None:
+        films = await film_service.get_by_cursor_raw(query=query, cursor=cursor, size=size, genre=genre, sort=sort)
+        return cached_json_response(films)
+    films = await film_service.get_by_search_raw(query=query, page=page, size=size, genre=genre, sort=sort)
+    return cached_json_response(films, size)
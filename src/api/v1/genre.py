@@ -1,14 +1,19 @@
 from http import HTTPStatus
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel, Field
 
+from api.instrumentation import InstrumentedRoute
+from api.v1.params import CURSOR_DESCRIPTION, batch_ids
+from api.v1.responses import page_headers
+from api.v1.routing import static_get
 from core.config import GENRE_PAGE_NUMBER, GENRE_PAGE_SIZE
+from models.genre import Genre as GenreModel
 from services.auth import role_validator_factory
 from services.genre import GenreService, get_genre_service
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
 
 
 class Genre(BaseModel):
@@ -17,16 +22,32 @@ class Genre(BaseModel):
     popularity: int = Field("Популярность: в скольких фильмах был указан жанр")
 
 
+async def with_popularity(genres: List[GenreModel], genre_service: GenreService) -> List[Genre]:
+    popularity = await genre_service.get_genres_popularity([genre.id for genre in genres])
+    return [Genre(id=genre.id, name=genre.name, popularity=popularity[genre.id]) for genre in genres]
+
+
+@static_get(router, "/batch/", response_model=List[Genre],
+            description="Вывод нескольких жанров за один запрос.",
+            dependencies=[Depends(role_validator_factory(roles=("guest", "user", "subscriber", "admin")))],
+            )
+async def genre_batch(
+        ids: List[str] = Depends(batch_ids),
+        genre_service: GenreService = Depends(get_genre_service)
+) -> List[Genre]:
+    return await with_popularity(await genre_service.get_many(ids), genre_service)
+
+
 @router.get("/{genre_id}", response_model=Genre,
             description="Вывод жанра с указанным ID",
             dependencies=[Depends(role_validator_factory(roles=("guest", "user", "subscriber", "admin")))],
             )
 async def genre_details(genre_id: str = Query(None, description="Идентификатор"), genre_service: GenreService = Depends(get_genre_service)) -> Genre:
-    genre = await genre_service.get_by_id(genre_id)
+    genre, popularity = await genre_service.get_with_popularity(genre_id)
     if not genre:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="genre not found")
 
-    return Genre(id=genre.id, name=genre.name, popularity=await genre_service.get_genre_popularity(genre.id))
+    return Genre(id=genre.id, name=genre.name, popularity=popularity)
 
 
 @router.get("/", response_model=List[Genre],
@@ -38,11 +59,17 @@ async def genre_index(
                                     description="Положительное число, указывающее размер страницы."),
         page: Optional[int] = Query(GENRE_PAGE_NUMBER, ge=1,
                                     description="Положительное число, указывающее номер страницы."),
+        cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+        response: Response = None,
         genre_service: GenreService = Depends(get_genre_service)
 ) -> List[Genre]:
-    return [Genre(id=genre.id, name=genre.name, popularity=await genre_service.get_genre_popularity(str(genre.id)))
-            for genre in await genre_service.get_by_search(
-        query=None, page=page, size=size, sort=None)]
+    if cursor is not None:
+        genres = await genre_service.get_by_cursor_raw(query=None, cursor=cursor, size=size, sort=None)
+        response.headers.update(page_headers(genres))
+    else:
+        genres = await genre_service.get_by_search_raw(query=None, page=page, size=size, sort=None)
+        response.headers.update(page_headers(genres, size))
+    return await with_popularity(genres.records(GenreModel), genre_service)
 
 
 @router.get("/search/", response_model=List[Genre],
@@ -55,8 +82,14 @@ async def genre_search(
                                     description="Положительное число, указывающее размер страницы."),
         page: Optional[int] = Query(GENRE_PAGE_NUMBER, ge=1,
                                     description="Положительное число, указывающее номер страницы."),
+        cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+        response: Response = None,
         genre_service: GenreService = Depends(get_genre_service)
 ) -> List[Genre]:
-    return [Genre(id=genre.id, name=genre.name, popularity=await genre_service.get_genre_popularity(str(genre.id)))
-            for genre in await genre_service.get_by_search(
-        query=query, page=page, size=size, sort=None)]
+    if cursor is not None:
+        genres = await genre_service.get_by_cursor_raw(query=query, cursor=cursor, size=size, sort=None)
+        response.headers.update(page_headers(genres))
+    else:
+        genres = await genre_service.get_by_search_raw(query=query, page=page, size=size, sort=None)
+        response.headers.update(page_headers(genres, size))
+    return await with_popularity(genres.records(GenreModel), genre_service)
@@ -0,0 +1,22 @@
+from http import HTTPStatus
+from typing import List
+
+from fastapi import HTTPException, Query
+
+from core.config import BATCH_MAX_SIZE
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# Общее количество найденных, "eq" или "gte" (не меньше, если найдено больше ES_TRACK_TOTAL_HITS)
+# и количество страниц, доступных по номеру
+TOTAL_COUNT_HEADER = "X-Total-Count"
+TOTAL_RELATION_HEADER = "X-Total-Relation"
+PAGE_COUNT_HEADER = "X-Page-Count"
+CURSOR_DESCRIPTION = (f"Курсорная пагинация: пустая строка для первой страницы, далее значение "
+                      f"заголовка {NEXT_CURSOR_HEADER} предыдущего ответа. Номер страницы при этом игнорируется.")
+
+
+def batch_ids(ids: List[str] = Query(..., description=f"Идентификаторы, не более {BATCH_MAX_SIZE}")) -> List[str]:
+    if len(ids) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
+                            detail=f"too many ids, max {BATCH_MAX_SIZE}")
+    return ids
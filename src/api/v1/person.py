@@ -1,8 +1,12 @@
 from http import HTTPStatus
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 
+from api.instrumentation import InstrumentedRoute
+from api.v1.params import CURSOR_DESCRIPTION, batch_ids
+from api.v1.responses import cached_json_response, json_response
+from api.v1.routing import static_get
 from models.film import FilmPreview
 from models.person import Person
 from services.auth import role_validator_factory
@@ -10,7 +14,18 @@ from services.person import PersonService, get_person_service
 
 PERSONS_PAGE_SIZE = 5
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
+
+
+@static_get(router, "/batch/",
+            response_model=List[Person],
+            description="Подробная информация о нескольких участниках кинопроизведений за один запрос.",
+            dependencies=[Depends(role_validator_factory(roles=("user", "subscriber", "admin")))],
+            )
+async def persons_batch(ids: List[str] = Depends(batch_ids),
+                        person_service: PersonService = Depends(get_person_service)
+                        ) -> List[Person]:
+    return await person_service.get_many(ids)
 
 
 @router.get("/{person_id}",
@@ -20,11 +35,11 @@ router = APIRouter()
             )
 async def person_details(person_id: str = Query(None, description="Идентификатор"),
                          person_service: PersonService = Depends(get_person_service)
-                         ) -> Person:
-    person = await person_service.get_by_id(person_id)
+                         ) -> Response:
+    person = await person_service.get_by_id_raw(person_id)
     if not person:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="person not found")
-    return person
+    return json_response(person)
 
 
 @router.get("/search/",
@@ -37,10 +52,14 @@ async def person_search(query: str = Query("", description="Полнотекст
                                                     description="Порядковый номер страницы."),
                         page_size: Optional[int] = Query(PERSONS_PAGE_SIZE, alias="page[size]", ge=1,
                                                          description="Количество персон на запрашиваемой странице."),
+                        cursor: Optional[str] = Query(None, alias="page[cursor]", description=CURSOR_DESCRIPTION),
                         person_service: PersonService = Depends(get_person_service)
-                        ) -> List[Person]:
-    persons = await person_service.search(query, page, page_size)
-    return persons
+                        ) -> Response:
+    if cursor is not None:
+        persons = await person_service.search_by_cursor_raw(query, cursor, page_size)
+        return cached_json_response(persons)
+    persons = await person_service.search_raw(query, page, page_size)
+    return cached_json_response(persons, page_size)
 
 
 @router.get("/{person_id}/film",
@@ -50,8 +69,8 @@ async def person_search(query: str = Query("", description="Полнотекст
             )
 async def person_films(person_id: str,
                        person_service: PersonService = Depends(get_person_service)
-                       ) -> List[FilmPreview]:
-    films = await person_service.get_films_by_person(person_id)
-    if not films:
+                       ) -> Response:
+    films = await person_service.get_films_by_person_raw(person_id)
+    if not films.count:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="person not found")
-    return films
+    return cached_json_response(films)
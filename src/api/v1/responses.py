@@ -0,0 +1,36 @@
+from typing import Dict
+
+from fastapi import Response
+
+from api.v1.params import NEXT_CURSOR_HEADER, PAGE_COUNT_HEADER, TOTAL_COUNT_HEADER, TOTAL_RELATION_HEADER
+from services.basic import CachedResponse
+from services.pagination import page_count
+
+
+def json_response(body: bytes) -> Response:
+    """
+    Ответ с уже сериализованным JSON: FastAPI не валидирует его по response_model.
+    """
+    return Response(content=body, media_type="application/json")
+
+
+def page_headers(response: CachedResponse, size: int = None) -> Dict[str, str]:
+    """
+    Заголовки с метаданными списка: курсор следующей страницы, общее количество найденных
+    и, для пагинации по номеру страницы размером size, количество страниц.
+    """
+    headers = {}
+    if response.next_cursor:
+        headers[NEXT_CURSOR_HEADER] = response.next_cursor
+    if response.total is not None:
+        headers[TOTAL_COUNT_HEADER] = str(response.total)
+        headers[TOTAL_RELATION_HEADER] = "eq" if response.total_exact else "gte"
+        if size:
+            headers[PAGE_COUNT_HEADER] = str(page_count(response.total, size))
+    return headers
+
+
+def cached_json_response(response: CachedResponse, size: int = None) -> Response:
+    result = json_response(response.body)
+    result.headers.update(page_headers(response, size))
+    return result
@@ -0,0 +1,15 @@
+from typing import Callable
+
+from fastapi import APIRouter
+
+
+def static_get(router: APIRouter, path: str, **kwargs) -> Callable:
+    """
+    Регистрирует GET `path` (со слешем в конце) и тот же путь без слеша, скрытый из документации.
+    Объявляется до маршрутов вида "/{id}": иначе "/batch" без слеша совпадает с ними как id "batch"
+    и до перенаправления на "/batch/" дело не доходит.
+    """
+    def decorator(func: Callable) -> Callable:
+        router.get(path.rstrip("/"), include_in_schema=False, **kwargs)(func)
+        return router.get(path, **kwargs)(func)
+    return decorator
@@ -0,0 +1,146 @@
+"""
+Circuit breakers for the backends (Elasticsearch, Redis).
+
+While a backend keeps failing, calls to it are rejected at once instead of waiting
+for timeouts and retries: requests do not pile up, and the backend gets time to recover.
+"""
+import logging
+import math
+import time
+from collections import deque
+from http import HTTPStatus
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+
+from core.config import (CIRCUIT_BREAKER_ERROR_RATE, CIRCUIT_BREAKER_MIN_CALLS, CIRCUIT_BREAKER_OPEN_TIME,
+                         CIRCUIT_BREAKER_PROBES, CIRCUIT_BREAKER_WINDOW)
+from core.metrics import BREAKER_REJECTED, BREAKER_STATE, BREAKER_TRANSITIONS
+
+logger = logging.getLogger(__name__)
+
+
+class BackendUnavailable(HTTPException):
+    """The backend is down: the API answers 503, callers with a fallback may catch it."""
+
+    def __init__(self, backend: str, retry_after: float = None):
+        headers = {"Retry-After": str(math.ceil(retry_after))} if retry_after else None
+        super().__init__(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail=f"{backend} is unavailable",
+                         headers=headers)
+        self.backend = backend
+
+
+class CircuitOpenError(BackendUnavailable):
+    """The call was not made: the circuit breaker of the backend is open."""
+
+
+class CircuitBreaker:
+    """
+    Used as a context manager around a single backend call:
+
+        with breaker:
+            await client.get(...)
+
+    closed - calls pass, their outcomes are counted in a rolling window of `window` one-second buckets.
+        Once the window has at least `min_calls` calls and `error_rate` of them failed, the breaker opens.
+    open - calls raise CircuitOpenError for `open_time` seconds, then the breaker is half-open.
+    half_open - up to `probes` calls pass at once. A successful one closes the breaker, a failed one opens it again.
+
+    Only exceptions accepted by `is_failure` count as failures, e.g. a missing document does not.
+    """
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, backend: str, is_failure: Callable[[BaseException], bool],
+                 window: int = CIRCUIT_BREAKER_WINDOW,
+                 min_calls: int = CIRCUIT_BREAKER_MIN_CALLS,
+                 error_rate: float = CIRCUIT_BREAKER_ERROR_RATE,
+                 open_time: float = CIRCUIT_BREAKER_OPEN_TIME,
+                 probes: int = CIRCUIT_BREAKER_PROBES,
+                 clock: Callable[[], float] = time.monotonic):
+        self.backend = backend
+        self.is_failure = is_failure
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.open_time = open_time
+        self.probes = probes
+        self.clock = clock
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._probing = 0
+        # [second, successes, failures], oldest first.
+        self._buckets = deque()
+        BREAKER_STATE.labels(backend).set(self.STATE_VALUES[self.state])
+
+    @property
+    def retry_after(self) -> Optional[float]:
+        """Seconds until the open breaker lets a probe call through."""
+        if self.state != self.OPEN:
+            return None
+        return max(0.0, self.opened_at + self.open_time - self.clock())
+
+    def __enter__(self):
+        if self.state != self.CLOSED:
+            self._admit()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc is None:
+            self._succeeded()
+        elif self.is_failure(exc):
+            self._failed()
+        elif self.state == self.HALF_OPEN:
+            # The probe says nothing about the backend (e.g. it was cancelled): let another one through.
+            self._probing = max(0, self._probing - 1)
+        return False
+
+    def _admit(self):
+        if self.state == self.OPEN:
+            if self.clock() - self.opened_at < self.open_time:
+                self._reject()
+            self._transition(self.HALF_OPEN)
+            self._probing = 0
+        if self._probing >= self.probes:
+            self._reject()
+        self._probing += 1
+
+    def _reject(self):
+        BREAKER_REJECTED.labels(self.backend).inc()
+        raise CircuitOpenError(self.backend, self.retry_after or self.open_time)
+
+    def _succeeded(self):
+        if self.state == self.HALF_OPEN:
+            self._transition(self.CLOSED)
+        elif self.state == self.CLOSED:
+            self._bucket()[1] += 1
+
+    def _failed(self):
+        if self.state == self.HALF_OPEN:
+            self._open()
+        elif self.state == self.CLOSED:
+            self._bucket()[2] += 1
+            successes = sum(bucket[1] for bucket in self._buckets)
+            failures = sum(bucket[2] for bucket in self._buckets)
+            calls = successes + failures
+            if calls >= self.min_calls and failures >= calls * self.error_rate:
+                self._open()
+
+    def _bucket(self) -> list:
+        second = int(self.clock())
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+            while self._buckets[0][0] <= second - self.window:
+                self._buckets.popleft()
+        return self._buckets[-1]
+
+    def _open(self):
+        self.opened_at = self.clock()
+        self._transition(self.OPEN)
+
+    def _transition(self, state: str):
+        logger.warning("Circuit breaker of %s: %s -> %s", self.backend, self.state, state)
+        self.state = state
+        self._buckets.clear()
+        BREAKER_STATE.labels(self.backend).set(self.STATE_VALUES[state])
+        BREAKER_TRANSITIONS.labels(self.backend, state).inc()
@@ -12,24 +12,84 @@ PROJECT_NAME = os.getenv("PROJECT_NAME", "Movies API")
 # Тип окружения (development при True, production при False)
 DEV = os.getenv("DEV") or False
 
+# Экспорт трейсов запросов: "console" - в stdout, "memory" - в память процесса (для тестов),
+# пустая строка - трейсы не собираются
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "")
+
 #
 AUTH_HOST = os.getenv("AUTH_HOST", "auth-api")
 AUTH_PORT = os.getenv("AUTH_PORT", "5000")
 AUTH_ENDPOINT = os.getenv("AUTH_ENDPOINT", "api/v1/auth/check")
 AUTH_URL = f"http://{AUTH_HOST}:{AUTH_PORT}/{AUTH_ENDPOINT}"
 AUTH_BACKOFF_TIME = int(os.getenv("AUTH_BACKOFF_TIME", 10))
+AUTH_TIMEOUT = float(os.getenv("AUTH_TIMEOUT", 5))
+# Пул соединений к сервису авторизации
+AUTH_POOL_SIZE = int(os.getenv("AUTH_POOL_SIZE", 100))
+AUTH_KEEPALIVE_TIMEOUT = float(os.getenv("AUTH_KEEPALIVE_TIMEOUT", 30))
+# Кэш ответов сервиса авторизации: время жизни разрешений и отказов, в секундах
+AUTH_CACHE_EXPIRE = int(os.getenv("AUTH_CACHE_EXPIRE", 30))
+AUTH_NEGATIVE_CACHE_EXPIRE = int(os.getenv("AUTH_NEGATIVE_CACHE_EXPIRE", 10))
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", 10000))
+# Режим проверки токена: "remote" - запрос в сервис авторизации, "local" - проверка подписи JWT на месте
+AUTH_MODE = os.getenv("AUTH_MODE", "remote")
+# В режиме "local" обращаться в сервис авторизации, если токен нечем проверить
+AUTH_REMOTE_FALLBACK = os.getenv("AUTH_REMOTE_FALLBACK", "false").lower() in ("1", "true", "yes")
+# Публичный ключ (PEM) или JWKS в файле, либо адрес JWKS сервиса авторизации
+AUTH_JWT_KEY_FILE = os.getenv("AUTH_JWT_KEY_FILE")
+AUTH_JWKS_URL = os.getenv("AUTH_JWKS_URL")
+AUTH_JWKS_REFRESH = int(os.getenv("AUTH_JWKS_REFRESH", 3600))
+AUTH_JWT_ALGORITHMS = os.getenv("AUTH_JWT_ALGORITHMS", "RS256").split(",")
+AUTH_JWT_AUDIENCE = os.getenv("AUTH_JWT_AUDIENCE")
+# Путь к списку ролей в claims токена, вложенные поля через точку
+AUTH_JWT_ROLES_CLAIM = os.getenv("AUTH_JWT_ROLES_CLAIM", "roles")
 
 # Настройки Redis
 REDIS_HOST = os.getenv("REDIS_HOST", "127.0.0.1")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 CACHE_BACKOFF_TIME = int(os.getenv("CACHE_BACKOFF_TIME", 10))
 
+# Реализация кэша: "redis" или "tiered" (локальный LRU воркера поверх Redis)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "redis")
+# Максимальное число объектов в локальном кэше воркера
+LOCAL_CACHE_MAX_SIZE = int(os.getenv("LOCAL_CACHE_MAX_SIZE", 1000))
+# Канал Redis, в который ETL публикует события об изменении фильмов, персон и жанров
+# (пустая строка - не подписываться, данные устаревают только по TTL)
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+# Сколько секунд повторять обработку события инвалидации, пока Redis недоступен; потом событие теряется
+CACHE_INVALIDATION_RETRY_TIME = int(os.getenv("CACHE_INVALIDATION_RETRY_TIME", 60))
+# Время жизни индекса тегов кэша, должно быть не меньше самого долгого TTL значений
+CACHE_TAG_EXPIRE = int(os.getenv("CACHE_TAG_EXPIRE", 24 * 60 * 60))
+# Максимальное число ключей в одном теге кэша: при переполнении лишние значения удаляются из кэша
+CACHE_TAG_MAX_KEYS = int(os.getenv("CACHE_TAG_MAX_KEYS", 10000))
+# Сколько секунд помнить инвалидацию тега: значения, загруженные из хранилища раньше неё, не попадают в кэш
+# (должно быть не меньше самой долгой загрузки)
+CACHE_TAG_TOMBSTONE_TTL = int(os.getenv("CACHE_TAG_TOMBSTONE_TTL", 5 * 60))
+# Значения кэша больше этого размера в байтах сжимаются (0 - не сжимать)
+CACHE_COMPRESS_MIN_SIZE = int(os.getenv("CACHE_COMPRESS_MIN_SIZE", 1024))
+# Уровень сжатия zlib: 1 - быстрее, 9 - меньше
+CACHE_COMPRESS_LEVEL = int(os.getenv("CACHE_COMPRESS_LEVEL", 6))
+# Версия схемы ключей кэша: при смене формата данных увеличивается, старые ключи перестают читаться
+CACHE_KEY_VERSION = os.getenv("CACHE_KEY_VERSION", "1")
+
 # Настройки Elasticsearch
 ELASTIC_HOST = os.getenv("ELASTIC_HOST", "127.0.0.1")
 ELASTIC_PORT = int(os.getenv("ELASTIC_PORT", 9200))
+# Таймаут одного обращения к Elasticsearch в секундах
+ES_TIMEOUT = float(os.getenv("ES_TIMEOUT", 10))
 STORAGE_BACKOFF_TIME = int(os.getenv("STORAGE_BACKOFF_TIME", 10))
 
 BACKOFF_FACTOR = float(os.getenv("BACKOFF_FACTOR", 0.5))
+# Сколько секунд есть у запроса к API на все обращения к хранилищу, после - 504 (0 - без ограничения)
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", 0))
+# Автоматический выключатель (circuit breaker) для Elasticsearch и Redis: если за последние
+# CIRCUIT_BREAKER_WINDOW секунд было не меньше CIRCUIT_BREAKER_MIN_CALLS обращений и доля ошибок
+# не ниже CIRCUIT_BREAKER_ERROR_RATE, обращения к сервису не выполняются CIRCUIT_BREAKER_OPEN_TIME секунд,
+# затем пропускаются CIRCUIT_BREAKER_PROBES пробных обращений
+CIRCUIT_BREAKER_WINDOW = int(os.getenv("CIRCUIT_BREAKER_WINDOW", 10))
+CIRCUIT_BREAKER_MIN_CALLS = int(os.getenv("CIRCUIT_BREAKER_MIN_CALLS", 20))
+CIRCUIT_BREAKER_ERROR_RATE = float(os.getenv("CIRCUIT_BREAKER_ERROR_RATE", 0.5))
+CIRCUIT_BREAKER_OPEN_TIME = float(os.getenv("CIRCUIT_BREAKER_OPEN_TIME", 5))
+CIRCUIT_BREAKER_PROBES = int(os.getenv("CIRCUIT_BREAKER_PROBES", 1))
 
 # Корень проекта
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -41,12 +101,63 @@ FILM_CACHE_EXPIRE = int(os.getenv("FILM_CACHE_EXPIRE", DEFAULT_CACHE_EXPIRE))
 PERSON_CACHE_EXPIRE = int(os.getenv("PERSON_CACHE_EXPIRE", DEFAULT_CACHE_EXPIRE))
 GENRE_CACHE_EXPIRE = int(os.getenv("GENRE_CACHE_EXPIRE", DEFAULT_CACHE_EXPIRE))
 GENRE_POPULARITY_CACHE_EXPIRE = int(os.getenv("GENRE_POPULARITY_CACHE_EXPIRE", DEFAULT_CACHE_EXPIRE))
+# Сколько секунд после истечения TTL списков отдавать устаревшее значение, обновляя его в фоне (0 - не отдавать)
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", minute))
+# Сколько ещё секунд хранить списки после этого, чтобы отдавать их, пока хранилище недоступно (0 - не хранить)
+CACHE_STALE_IF_ERROR_TTL = int(os.getenv("CACHE_STALE_IF_ERROR_TTL", 10 * minute))
+# Ограничения фоновых задач: одновременно выполняемых и всего ожидающих
+BACKGROUND_MAX_CONCURRENCY = int(os.getenv("BACKGROUND_MAX_CONCURRENCY", 4))
+BACKGROUND_MAX_PENDING = int(os.getenv("BACKGROUND_MAX_PENDING", 100))
+# Период пересчёта популярности всех жанров в фоне, в секундах (0 - не пересчитывать)
+GENRE_POPULARITY_REFRESH_INTERVAL = int(os.getenv("GENRE_POPULARITY_REFRESH_INTERVAL", 0))
+# Максимальное количество жанров в одной агрегации
+GENRES_MAX_COUNT = int(os.getenv("GENRES_MAX_COUNT", 1000))
 
 FILM_WORKS_INDEX = os.getenv("FILM_WORKS_INDEX", "movies")
 PERSONS_INDEX = os.getenv("PERSONS_INDEX", "persons")
 GENRES_INDEX = os.getenv("GENRES_INDEX", "genres")
+# Ограничение ES на from + size (index.max_result_window)
+ES_MAX_RESULT_WINDOW = int(os.getenv("ES_MAX_RESULT_WINDOW", 10000))
+# До скольких документов ES точно считает общее количество найденных (track_total_hits),
+# больше - возвращает нижнюю границу
+ES_TRACK_TOTAL_HITS = int(os.getenv("ES_TRACK_TOTAL_HITS", 10000))
+# Запросы к ES дольше этого времени в секундах попадают в журнал медленных запросов (0 - не записывать)
+ES_SLOW_QUERY_THRESHOLD = float(os.getenv("ES_SLOW_QUERY_THRESHOLD", 1))
+# Сколько последних записей журнала хранится в памяти воркера
+ES_SLOW_QUERY_LOG_SIZE = int(os.getenv("ES_SLOW_QUERY_LOG_SIZE", 100))
+# Доля поисковых запросов, выполняемых с profile: true; их разбивка по шардам тоже попадает в журнал (0 - не профилировать)
+ES_PROFILE_SAMPLE_RATE = float(os.getenv("ES_PROFILE_SAMPLE_RATE", 0))
+# Сколько фильмов одной персоны выбирается при поиске её ролей
+PERSON_FILMS_LIMIT = int(os.getenv("PERSON_FILMS_LIMIT", 100))
 
 FILM_PAGE_SIZE = 10
 FILM_PAGE_NUMBER = 1
 GENRE_PAGE_SIZE = 10
-GENRE_PAGE_NUMBER = 1
\ No newline at end of file
+GENRE_PAGE_NUMBER = 1
+
+# Максимальное количество идентификаторов в одном batch-запросе
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 100))
+
+# Выгрузка каталога фильмов
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+# Сколько ES держит point-in-time между пачками
+EXPORT_KEEP_ALIVE = os.getenv("EXPORT_KEEP_ALIVE", "1m")
+EXPORT_ROLES = tuple(os.getenv("EXPORT_ROLES", "admin").split(","))
+
+# Роли, которым доступны служебные эндпоинты /api/v1/admin/
+ADMIN_ROLES = tuple(os.getenv("ADMIN_ROLES", "admin").split(","))
+
+# Прогрев кэша при старте приложения (python -m services.warmup - то же самое вручную)
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true"
+# Сколько первых страниц /api/v1/film/ прогревать для каждой сортировки и жанра
+WARMUP_FILM_PAGES = int(os.getenv("WARMUP_FILM_PAGES", 3))
+# Сортировки списка фильмов через запятую, пустой элемент - без сортировки
+WARMUP_FILM_SORTS = tuple(sort or None for sort in os.getenv("WARMUP_FILM_SORTS", ",-imdb_rating").split(","))
+# Популярные фильмы и персоны, идентификаторы через запятую
+WARMUP_FILM_IDS = [film_id for film_id in os.getenv("WARMUP_FILM_IDS", "").split(",") if film_id]
+WARMUP_PERSON_IDS = [person_id for person_id in os.getenv("WARMUP_PERSON_IDS", "").split(",") if person_id]
+# Сколько запросов к ES прогрев выполняет одновременно
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", 8))
+# Сколько секунд прогрев может задерживать старт приложения, после этого оно стартует с холодным кэшем
+# (0 - без ограничения)
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", 60))
@@ -0,0 +1,68 @@
+"""
+Time budget of the current request.
+
+`deadline` sets it in a context variable, so it follows the request into every task it starts.
+Backend calls take their timeout from `request_timeout` and give up with 504 when the budget is spent.
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http import HTTPStatus
+from typing import Awaitable, Optional
+
+from fastapi import HTTPException
+
+# time.monotonic() by which the current request must be answered
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: Optional[float]):
+    """
+    Limits the rest of the current request to `seconds` (None or 0 - no limit).
+    A nested deadline can only make the budget shorter.
+    """
+    if not seconds:
+        yield
+        return
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current request, None if it has no deadline."""
+    at = _deadline.get()
+    if at is None:
+        return None
+    return at - time.monotonic()
+
+
+def deadline_exceeded() -> HTTPException:
+    return HTTPException(status_code=HTTPStatus.GATEWAY_TIMEOUT, detail="deadline exceeded")
+
+
+def request_timeout() -> Optional[float]:
+    """
+    Timeout for a backend call made now.
+    :raise HTTPException: 504 if the budget is already spent
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise deadline_exceeded()
+    return left
+
+
+async def with_deadline(aw: Awaitable):
+    left = request_timeout()
+    if left is None:
+        return await aw
+    try:
+        return await asyncio.wait_for(aw, left)
+    except asyncio.TimeoutError:
+        raise deadline_exceeded()
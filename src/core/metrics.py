@@ -0,0 +1,123 @@
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from opentelemetry.trace import SpanKind
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+
+from core.tracing import tracer
+
+
+class LatencyStats:
+    """Call counter with total and max latency, cheap enough for the hot path."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float, error: bool = False):
+        self.count += 1
+        self.errors += error
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(time.perf_counter() - start, error)
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_seconds": self.total / self.count if self.count else 0.0,
+            "max_seconds": self.max,
+        }
+
+
+# Prometheus metrics, exposed at /metrics.
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "API request latency",
+                            ["method", "route", "status"])
+BACKEND_LATENCY = Histogram("backend_call_duration_seconds", "Latency of a single call to a backend",
+                            ["backend", "operation"])
+BACKEND_ERRORS = Counter("backend_call_errors_total", "Failed backend calls",
+                         ["backend", "operation", "error"])
+BACKEND_RETRIES = Counter("backend_call_retries_total", "Backend calls retried by backoff",
+                          ["backend", "operation"])
+BACKEND_PAYLOAD = Histogram("backend_payload_bytes", "Size of values read from and written to the cache",
+                            ["backend", "operation"], buckets=[2 ** power for power in range(6, 24, 2)])
+STORAGE_DOCUMENTS = Histogram("storage_documents", "Documents returned by a storage call",
+                              ["operation"], buckets=[0, 1, 5, 10, 20, 50, 100, 500, 1000])
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Service cache lookups", ["prefix", "result"])
+CACHE_BYPASS = Counter("cache_bypass_total", "Cache calls skipped because the cache backend is unavailable",
+                       ["operation"])
+BREAKER_STATE = Gauge("circuit_breaker_state", "Circuit breaker state: 0 - closed, 1 - half-open, 2 - open",
+                      ["backend"])
+BREAKER_TRANSITIONS = Counter("circuit_breaker_transitions_total", "Circuit breaker state changes",
+                              ["backend", "state"])
+BREAKER_REJECTED = Counter("circuit_breaker_rejected_total", "Calls rejected by an open circuit breaker",
+                           ["backend"])
+
+
+@contextmanager
+def observe_call(backend: str, operation: str, attributes: dict = None):
+    """
+    Records latency of the call and, if it fails, the type of the error.
+    The call is traced as a `<backend>.<operation>` span with the given attributes.
+    """
+    start = time.perf_counter()
+    with tracer.start_as_current_span(f"{backend}.{operation}", kind=SpanKind.CLIENT,
+                                      attributes={"backend": backend, **(attributes or {})}):
+        try:
+            yield
+        except Exception as error:
+            BACKEND_ERRORS.labels(backend, operation, type(error).__name__).inc()
+            raise
+        finally:
+            BACKEND_LATENCY.labels(backend, operation).observe(time.perf_counter() - start)
+
+
+def count_retry(backend: str, operation: str) -> Callable[[dict], None]:
+    """`on_backoff` handler for backoff decorators."""
+    counter = BACKEND_RETRIES.labels(backend, operation)
+
+    def on_backoff(details: dict):
+        counter.inc()
+    return on_backoff
+
+
+class StatsCollector:
+    """
+    Exposes numbers from a `stats()` dict of an in-process component as gauges
+    named `<name>_<key>`, nested dicts are flattened the same way.
+    """
+
+    def __init__(self, name: str, stats: Callable[[], dict], description: str):
+        self.name = name
+        self.stats = stats
+        self.description = description
+
+    def collect(self):
+        for key, value in self._flatten(self.stats(), self.name):
+            yield GaugeMetricFamily(key, self.description, value=value)
+
+    def _flatten(self, stats: dict, prefix: str):
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                yield from self._flatten(value, f"{prefix}_{key}")
+            elif isinstance(value, (int, float)):
+                yield f"{prefix}_{key}", value
+
+
+def register_stats(name: str, stats: Callable[[], dict], description: str):
+    REGISTRY.register(StatsCollector(name, stats, description))
@@ -0,0 +1,107 @@
+import asyncio
+import contextvars
+import logging
+from functools import partial
+from typing import Awaitable, Callable, Dict, Optional
+
+from core.config import BACKGROUND_MAX_CONCURRENCY, BACKGROUND_MAX_PENDING
+
+logger = logging.getLogger(__name__)
+
+
+def _detached(coro: Awaitable) -> asyncio.Task:
+    """
+    Wraps `coro` in a task with an empty context. A task copies the context of its creator,
+    so otherwise a job scheduled by a request would run under the request deadline,
+    `load_started` and tracing span, which are over by the time the job runs.
+    """
+    return contextvars.Context().run(asyncio.ensure_future, coro)
+
+
+class BackgroundScheduler:
+    """
+    Fire-and-forget tasks that must not pile up: at most `max_concurrency` run at once,
+    at most `max_pending` exist at all (the rest are dropped), one task per key.
+
+    Long-running tasks of the app (consumers, periodic jobs) are started with `start`:
+    they are not limited, but are stopped by `close` together with the rest.
+    Tasks do not see context variables of their caller.
+    """
+
+    def __init__(self, max_concurrency: int, max_pending: int):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._long_running: Dict[str, asyncio.Task] = {}
+        # Created lazily: before python 3.10 a semaphore is bound to the loop it was created in.
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def schedule(self, key: str, func: Callable[..., Awaitable], *args) -> bool:
+        """
+        Starts `func(*args)` in the background unless a task with the same key is pending.
+        :return: True if the task was scheduled
+        """
+        if key in self._tasks:
+            return False
+        if len(self._tasks) >= self.max_pending:
+            self.dropped += 1
+            return False
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        task = _detached(self._run(key, func, *args))
+        self._tasks[key] = task
+        task.add_done_callback(partial(self._forget, key))
+        return True
+
+    def start(self, name: str, func: Callable[..., Awaitable], *args):
+        """
+        Runs `func(*args)` until it returns or the scheduler is closed.
+        """
+        if name in self._long_running:
+            raise ValueError(f"background task {name} is already running")
+        task = _detached(func(*args))
+        self._long_running[name] = task
+        task.add_done_callback(partial(self._stopped, name))
+
+    def _stopped(self, name: str, task: asyncio.Task):
+        if self._long_running.get(name) is task:
+            del self._long_running[name]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Background task %s stopped", name, exc_info=task.exception())
+
+    async def _run(self, key: str, func: Callable[..., Awaitable], *args):
+        async with self._semaphore:
+            try:
+                await func(*args)
+                self.completed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Background task %s failed", key)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    async def close(self):
+        tasks = list(self._long_running.values()) + list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._semaphore = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._tasks),
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+
+scheduler = BackgroundScheduler(BACKGROUND_MAX_CONCURRENCY, BACKGROUND_MAX_PENDING)
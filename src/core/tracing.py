@@ -0,0 +1,60 @@
+"""
+Request tracing with OpenTelemetry.
+
+Every API request gets a span, I/O inside it (cache lookups, ES queries, auth checks)
+gets child spans. Spans are exported only if TRACING_EXPORTER is set,
+otherwise the API tracer is a no-op.
+"""
+import uuid
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import ConsoleSpanExporter, SimpleSpanProcessor, SpanExporter
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from core.config import PROJECT_NAME
+
+REQUEST_ID_HEADER = "X-Request-Id"
+
+EXPORTERS = {
+    "console": ConsoleSpanExporter,
+    "memory": InMemorySpanExporter,
+}
+
+# Id of the API request being handled, taken from X-Request-Id or generated.
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+tracer = trace.get_tracer("movies_api")
+
+
+def setup_tracing(exporter: str) -> Optional[SpanExporter]:
+    """
+    Installs the tracer provider exporting spans with `exporter`, see EXPORTERS.
+    :return: the span exporter, None if tracing is off
+    """
+    if not exporter:
+        return None
+    if exporter not in EXPORTERS:
+        raise ValueError(f"Unknown tracing exporter: {exporter}")
+    span_exporter = EXPORTERS[exporter]()
+    provider = TracerProvider(resource=Resource.create({"service.name": PROJECT_NAME}))
+    provider.add_span_processor(SimpleSpanProcessor(span_exporter))
+    trace.set_tracer_provider(provider)
+    return span_exporter
+
+
+def new_request_id() -> str:
+    return str(uuid.uuid4())
+
+
+def outgoing_headers() -> Dict[str, str]:
+    """
+    Headers for a call to another service: id of the current request and
+    the W3C trace context of the current span.
+    """
+    headers = {REQUEST_ID_HEADER: request_id.get() or new_request_id()}
+    propagate.inject(headers)
+    return headers
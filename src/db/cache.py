@@ -1,5 +1,6 @@
 import abc
 import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional
 
 
 logger = logging.getLogger(__name__)
@@ -20,3 +21,50 @@ class Cache(abc.ABC):
     @abc.abstractmethod
     async def set(self, key: str, value: str, expire: int):
         pass
+
+    @abc.abstractmethod
+    async def get_many(self, keys: List[str]) -> list:
+        pass
+
+    @abc.abstractmethod
+    async def set_many(self, values: Dict[str, str], expire: int):
+        pass
+
+    @abc.abstractmethod
+    async def add_tags(self, tags: Dict[str, Iterable[str]], expire: int, since: float = None):
+        """
+        Remembers tags of cached values: `tags` maps a key to the tags of its value.
+        :param since: when the values were read from the storage. A value is deleted instead
+            if any of its tags has been invalidated since then: it may be older than the invalidation.
+        """
+        pass
+
+    @abc.abstractmethod
+    async def invalidate_tags(self, tags: Iterable[str]) -> List[str]:
+        """
+        Deletes all values tagged with any of `tags` and returns their keys.
+        """
+        pass
+
+    def evict_local(self, key: str):
+        """
+        Drops the copy of `key` kept in this process, if the cache keeps any.
+        """
+        pass
+
+    async def get_object(self, key: str, loads: Callable[[bytes], Any], expire: int = None) -> Optional[Any]:
+        """
+        Returns value deserialized with `loads` or None if key is missing.
+        Caches that keep deserialized objects use `expire` as a TTL for them.
+        """
+        data = await self.get(key)
+        if not data:
+            return None
+        return loads(data)
+
+    async def get_many_objects(self, keys: List[str], loads: Callable[[bytes], Any],
+                               expire: int = None) -> List[Optional[Any]]:
+        """
+        Batch version of `get_object`: one round trip for all keys, None for missing ones.
+        """
+        return [loads(data) if data else None for data in await self.get_many(keys)]
@@ -1,6 +1,10 @@
+from core.config import CACHE_BACKEND
 from db.cache import Cache
 from db.redis_cache import RedisCache
+from db.tiered_cache import TieredCache
 
 
 def get_current_cache(**kwargs) -> Cache:
+    if CACHE_BACKEND == "tiered":
+        return TieredCache(**kwargs)
     return RedisCache(**kwargs)
@@ -1,16 +1,73 @@
+import logging
+import time
+from contextlib import contextmanager
 from http import HTTPStatus
-from typing import ClassVar
+from typing import AsyncIterator, ClassVar, Iterator, List, Optional, Union
 
 import backoff
 import elasticsearch
 from elasticsearch import AsyncElasticsearch
 from fastapi import HTTPException
 
-from core.config import BACKOFF_FACTOR, STORAGE_BACKOFF_TIME
-from db.storage import Storage
+from core.circuit_breaker import BackendUnavailable, CircuitBreaker
+from core.config import BACKOFF_FACTOR, ES_TIMEOUT, ES_TRACK_TOTAL_HITS, EXPORT_KEEP_ALIVE, STORAGE_BACKOFF_TIME
+from core.deadline import deadline_exceeded, request_timeout
+from core.metrics import STORAGE_DOCUMENTS, count_retry, observe_call
+from db.slow_log import slow_log
+from db.storage import SearchError, SearchPage, Storage, source_fields
+
+logger = logging.getLogger(__name__)
 
 es: AsyncElasticsearch = None
 
+# Коды ответа ES, которые говорят о его перегрузке или недоступности, а не об ошибке в запросе.
+UNAVAILABLE_STATUSES = (HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.INTERNAL_SERVER_ERROR, HTTPStatus.BAD_GATEWAY,
+                        HTTPStatus.SERVICE_UNAVAILABLE, HTTPStatus.GATEWAY_TIMEOUT)
+
+
+def is_failure(error: BaseException) -> bool:
+    """Ошибки, после которых обращение к ES считается неудачным для circuit breaker."""
+    if isinstance(error, elasticsearch.ConnectionError):
+        return True
+    return isinstance(error, elasticsearch.TransportError) and error.status_code in UNAVAILABLE_STATUSES
+
+
+def storage_unavailable(details: dict):
+    """on_giveup для backoff: ES так и не ответил, API отвечает 503."""
+    raise BackendUnavailable("elasticsearch")
+
+
+# Один выключатель на воркер для всех индексов: они живут в одном кластере.
+breaker = CircuitBreaker("elasticsearch", is_failure)
+
+
+@contextmanager
+def backend_timeout() -> Iterator[Optional[float]]:
+    """
+    Таймаут вызова ES: ES_TIMEOUT или остаток бюджета запроса, если он меньше.
+    Если ES не ответил за укороченный дедлайном таймаут, это исчерпанный бюджет запроса (504),
+    а не отказ ES: такая ошибка не учитывается выключателем и не повторяется.
+    """
+    left = request_timeout()
+    truncated = left is not None and left < ES_TIMEOUT
+    try:
+        yield left if truncated else ES_TIMEOUT
+    except elasticsearch.ConnectionTimeout:
+        if truncated:
+            raise deadline_exceeded()
+        raise
+
+
+def query_type(query: dict) -> str:
+    """
+    Тип запроса для трейсов: тип корневого запроса и, если есть, агрегации и search_after.
+    """
+    kind = next(iter(query.get("query") or {}), "match_all")
+    for extra in ("aggs", "search_after"):
+        if extra in query:
+            kind += f"+{extra}"
+    return kind
+
 
 class AsyncElasticsearchStorage(Storage):
 
@@ -26,44 +83,140 @@ class AsyncElasticsearchStorage(Storage):
     @backoff.on_exception(backoff.expo,
                           elasticsearch.ConnectionError,
                           max_time=STORAGE_BACKOFF_TIME,
-                          factor=BACKOFF_FACTOR)
+                          factor=BACKOFF_FACTOR,
+                          on_backoff=count_retry("elasticsearch", "get"),
+                          on_giveup=storage_unavailable)
     async def get(self, doc_id: str):
-        try:
-            document = await self.client.get(self.index, doc_id)
-
-        except elasticsearch.exceptions.NotFoundError:
-            return None
-        return self.model(**document["_source"])
+        with slow_log.timed("get", self.index, {"ids": [doc_id]}), \
+                breaker, observe_call("elasticsearch", "get", self._span_attributes()), \
+                backend_timeout() as timeout:
+            try:
+                document = await self.client.get(self.index, doc_id, request_timeout=timeout)
+            except elasticsearch.exceptions.NotFoundError:
+                document = None
+        return self.model(**document["_source"]) if document else None
 
     @backoff.on_exception(backoff.expo,
                           elasticsearch.ConnectionError,
                           max_time=STORAGE_BACKOFF_TIME,
-                          factor=BACKOFF_FACTOR)
-    async def get_many(self, **kwargs):
-        pass
+                          factor=BACKOFF_FACTOR,
+                          on_backoff=count_retry("elasticsearch", "get_many"),
+                          on_giveup=storage_unavailable)
+    async def get_many(self, doc_ids: List[str]) -> list:
+        """
+        Возвращает документы по списку идентификаторов за один запрос (mget).
+        :param doc_ids: идентификаторы документов.
+        :return: список той же длины, что и doc_ids; на месте ненайденных документов None.
+        """
+        if not doc_ids:
+            return []
+        with slow_log.timed("get_many", self.index, {"ids": doc_ids}), \
+                breaker, observe_call("elasticsearch", "get_many", self._span_attributes(documents=len(doc_ids))), \
+                backend_timeout() as timeout:
+            result = await self.client.mget(body={"ids": doc_ids}, index=self.index, request_timeout=timeout)
+        STORAGE_DOCUMENTS.labels("get_many").observe(len(result["docs"]))
+        return [self.model(**doc["_source"]) if doc.get("found") else None for doc in result["docs"]]
+
+    async def search(self, query: dict, model: ClassVar = None):
+        page = await self.search_page(query, model)
+        return page.items
 
     @backoff.on_exception(backoff.expo,
                           elasticsearch.ConnectionError,
                           max_time=STORAGE_BACKOFF_TIME,
-                          factor=BACKOFF_FACTOR)
-    async def search(self, query: dict):
+                          factor=BACKOFF_FACTOR,
+                          on_backoff=count_retry("elasticsearch", "search"),
+                          on_giveup=storage_unavailable)
+    async def search_page(self, query: dict, model: ClassVar = None) -> SearchPage:
+        """
+        Поиск, который кроме документов возвращает общее количество найденных
+        и значения сортировки последнего документа для search_after.
+        :param query: словарь с параметрами запроса согласно ES DSL.
+        :param model: модель документов результата; ES возвращает только её поля (_source includes).
+        """
+        body = self._prepare(query, model)
         try:
-            result = await self.client.search(index=self.index, body=query)
+            with slow_log.timed("search", self.index, body) as call, \
+                    breaker, observe_call("elasticsearch", "search", self._span_attributes(query)), \
+                    backend_timeout() as timeout:
+                result = call.result = await self.client.search(index=self.index, body=body, request_timeout=timeout)
         except elasticsearch.exceptions.RequestError as re:
             if re.error == "search_phase_execution_exception":
                 raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Malformed request")
             raise re
+        STORAGE_DOCUMENTS.labels("search").observe(len(result["hits"]["hits"]))
+        return self._parse_page(result, model)
 
-        if not result["hits"]["total"]["value"]:
+    @backoff.on_exception(backoff.expo,
+                          elasticsearch.ConnectionError,
+                          max_time=STORAGE_BACKOFF_TIME,
+                          factor=BACKOFF_FACTOR,
+                          on_backoff=count_retry("elasticsearch", "multi_search"),
+                          on_giveup=storage_unavailable)
+    async def multi_search(self, queries: List[dict], model: ClassVar = None) -> List[Union[SearchPage, SearchError]]:
+        """
+        Выполняет несколько поисковых запросов одним обращением к ES (_msearch).
+        :param queries: словари с параметрами запросов согласно ES DSL.
+        :param model: модель документов результата, как в search_page.
+        :return: результаты в порядке запросов; ошибка одного запроса возвращается на его месте SearchError.
+        """
+        if not queries:
             return []
+        body = []
+        for query in queries:
+            body.extend(({}, self._prepare(query, model)))
+        start = time.perf_counter()
+        try:
+            with breaker, observe_call("elasticsearch", "multi_search", self._span_attributes(queries=len(queries))), \
+                    backend_timeout() as timeout:
+                result = await self.client.msearch(body=body, index=self.index, request_timeout=timeout)
+        except BaseException as error:
+            for query in body[1::2]:
+                slow_log.record("multi_search", self.index, query, time.perf_counter() - start, error=error)
+            raise
+        wall = time.perf_counter() - start
+        for query, response in zip(body[1::2], result["responses"]):
+            slow_log.record("multi_search", self.index, query, wall, response, batched=True)
+        return [
+            SearchError(type=response["error"].get("type", ""),
+                        reason=response["error"].get("reason", ""),
+                        status=response.get("status", HTTPStatus.INTERNAL_SERVER_ERROR))
+            if "error" in response else self._parse_page(response, model)
+            for response in result["responses"]
+        ]
 
-        items = [self.model(**hit["_source"]) for hit in result["hits"]["hits"]]
-        return items
+    def _span_attributes(self, query: dict = None, **attributes) -> dict:
+        attributes = {f"elasticsearch.{name}": value for name, value in attributes.items()}
+        attributes["elasticsearch.index"] = self.index
+        if query is not None:
+            attributes["elasticsearch.query_type"] = query_type(query)
+        return attributes
+
+    def _prepare(self, query: dict, model: ClassVar = None) -> dict:
+        # Точное количество найденных считается только до ES_TRACK_TOTAL_HITS.
+        query = {"track_total_hits": ES_TRACK_TOTAL_HITS, **query}
+        # Для другой модели из ES читаются только её поля.
+        if model is not None and model is not self.model and "_source" not in query:
+            query["_source"] = source_fields(model)
+        # Часть запросов выполняется с профилированием для журнала медленных запросов.
+        return slow_log.sampled(query)
+
+    def _parse_page(self, result: dict, model: ClassVar = None) -> SearchPage:
+        model = model or self.model
+        total = result["hits"].get("total", {})
+        page = SearchPage(total=total.get("value", 0), total_exact=total.get("relation", "eq") == "eq")
+        hits = result["hits"]["hits"]
+        if hits:
+            page.items = [model(**hit["_source"]) for hit in hits]
+            page.last_sort = hits[-1].get("sort")
+        return page
 
     @backoff.on_exception(backoff.expo,
                           elasticsearch.ConnectionError,
                           max_time=STORAGE_BACKOFF_TIME,
-                          factor=BACKOFF_FACTOR)
+                          factor=BACKOFF_FACTOR,
+                          on_backoff=count_retry("elasticsearch", "count"),
+                          on_giveup=storage_unavailable)
     async def count(self, query: dict) -> int:
         """
         Возвращает количество элементов, найденных по запросу. Работает быстрее, чем search.
@@ -71,9 +224,110 @@ class AsyncElasticsearchStorage(Storage):
         :return: количество найденных элементов.
         """
         try:
-            result = await self.client.count(index=self.index, body=query)
+            with slow_log.timed("count", self.index, query) as call, \
+                    breaker, observe_call("elasticsearch", "count", self._span_attributes(query)), \
+                    backend_timeout() as timeout:
+                result = call.result = await self.client.count(index=self.index, body=query, request_timeout=timeout)
         except elasticsearch.exceptions.RequestError as re:
             if re.error == "count_phase_execution_exception":
                 raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Malformed request")
             raise re
         return result["count"]
+
+    async def scan(self, query: dict, size: int, source: List[str] = None) -> AsyncIterator[List[dict]]:
+        """
+        Обходит все документы, найденные по запросу, пачками по size штук.
+        Использует point-in-time и search_after, поэтому не зависит от max_result_window
+        и видит индекс на момент начала обхода.
+        :param query: словарь с параметрами запроса согласно ES DSL, без сортировки и пагинации.
+        :param size: размер пачки.
+        :param source: поля документа, которые нужно вернуть; по умолчанию все.
+        :return: асинхронный итератор по спискам _source документов, без построения моделей.
+        """
+        pit_id = None
+        try:
+            pit_id = await self._open_point_in_time()
+            body = {
+                **query,
+                "size": size,
+                "sort": ["_shard_doc"],
+                "track_total_hits": False,
+                "pit": {"id": pit_id, "keep_alive": EXPORT_KEEP_ALIVE},
+            }
+            if source is not None:
+                body["_source"] = source
+            while True:
+                result = await self._scan_page(body)
+                hits = result["hits"]["hits"]
+                if hits:
+                    yield [hit["_source"] for hit in hits]
+                if len(hits) < size:
+                    break
+                pit_id = body["pit"]["id"] = result.get("pit_id", pit_id)
+                body["search_after"] = hits[-1]["sort"]
+        finally:
+            if pit_id is not None:
+                await self._close_point_in_time(pit_id)
+
+    @backoff.on_exception(backoff.expo,
+                          elasticsearch.ConnectionError,
+                          max_time=STORAGE_BACKOFF_TIME,
+                          factor=BACKOFF_FACTOR,
+                          on_backoff=count_retry("elasticsearch", "open_point_in_time"),
+                          on_giveup=storage_unavailable)
+    async def _open_point_in_time(self) -> str:
+        with slow_log.timed("open_point_in_time", self.index, {}), \
+                breaker, observe_call("elasticsearch", "open_point_in_time", self._span_attributes()), \
+                backend_timeout() as timeout:
+            result = await self.client.open_point_in_time(index=self.index, keep_alive=EXPORT_KEEP_ALIVE,
+                                                          request_timeout=timeout)
+        return result["id"]
+
+    @backoff.on_exception(backoff.expo,
+                          elasticsearch.ConnectionError,
+                          max_time=STORAGE_BACKOFF_TIME,
+                          factor=BACKOFF_FACTOR,
+                          on_backoff=count_retry("elasticsearch", "scan"),
+                          on_giveup=storage_unavailable)
+    async def _scan_page(self, body: dict) -> dict:
+        """Одна пачка обхода scan; запрос с тем же point-in-time и search_after можно повторить."""
+        with slow_log.timed("scan", self.index, body) as call, \
+                breaker, observe_call("elasticsearch", "scan", self._span_attributes(body)), \
+                backend_timeout() as timeout:
+            result = call.result = await self.client.search(body=body, request_timeout=timeout)
+        STORAGE_DOCUMENTS.labels("scan").observe(len(result["hits"]["hits"]))
+        return result
+
+    async def _close_point_in_time(self, pit_id: str):
+        # Ошибка закрытия не должна подменять ошибку обхода: point-in-time и так истечёт через EXPORT_KEEP_ALIVE.
+        try:
+            with breaker, observe_call("elasticsearch", "close_point_in_time", self._span_attributes()), \
+                    backend_timeout() as timeout:
+                await self.client.close_point_in_time(body={"id": pit_id}, request_timeout=timeout)
+        except (elasticsearch.TransportError, BackendUnavailable) as error:
+            logger.warning("Point in time of %s was not closed: %r", self.index, error)
+
+    @backoff.on_exception(backoff.expo,
+                          elasticsearch.ConnectionError,
+                          max_time=STORAGE_BACKOFF_TIME,
+                          factor=BACKOFF_FACTOR,
+                          on_backoff=count_retry("elasticsearch", "aggregate"),
+                          on_giveup=storage_unavailable)
+    async def aggregate(self, query: dict) -> dict:
+        """
+        Выполняет запрос с агрегациями и возвращает только их результат, без документов.
+        :param query: словарь с параметрами запроса согласно ES DSL, должен содержать aggs.
+        :return: словарь aggregations из ответа ES.
+        """
+        body = slow_log.sampled(query)
+        try:
+            with slow_log.timed("aggregate", self.index, body) as call, \
+                    breaker, observe_call("elasticsearch", "aggregate", self._span_attributes(query)), \
+                    backend_timeout() as timeout:
+                result = call.result = await self.client.search(index=self.index, body=body, size=0,
+                                                                request_timeout=timeout)
+        except elasticsearch.exceptions.RequestError as re:
+            if re.error == "search_phase_execution_exception":
+                raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Malformed request")
+            raise re
+        return result.get("aggregations", {})
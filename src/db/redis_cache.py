@@ -1,15 +1,108 @@
+import logging
 import socket
+import time
+import zlib
 from asyncio import TimeoutError
-from typing import Optional
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
 
 import backoff
-from aioredis import Redis
+from aioredis import ConnectionClosedError, PoolClosedError, Redis
 
-from core.config import BACKOFF_FACTOR, CACHE_BACKOFF_TIME
+from core.circuit_breaker import BackendUnavailable, CircuitBreaker
+from core.config import (BACKOFF_FACTOR, CACHE_BACKOFF_TIME, CACHE_COMPRESS_LEVEL, CACHE_COMPRESS_MIN_SIZE,
+                         CACHE_TAG_EXPIRE, CACHE_TAG_MAX_KEYS, CACHE_TAG_TOMBSTONE_TTL)
+from core.metrics import BACKEND_PAYLOAD, CACHE_BYPASS, count_retry, observe_call
 from db.cache import Cache
 
+logger = logging.getLogger(__name__)
+
 redis: Redis = None
 
+# Errors meaning Redis is unreachable. socket.gaierror and connection errors are OSError.
+UNAVAILABLE_ERRORS = (OSError, TimeoutError, ConnectionClosedError, PoolClosedError)
+
+breaker = CircuitBreaker("redis", lambda error: isinstance(error, UNAVAILABLE_ERRORS))
+
+# Tag -> set of keys of the values tagged with it.
+TAG_PREFIX = "tags:"
+# Tag -> time of its last invalidation, kept for CACHE_TAG_TOMBSTONE_TTL.
+TOMBSTONE_PREFIX = "invalidated:"
+# Workers compare their own clocks: an invalidation this much earlier than a load still drops its values.
+CLOCK_SKEW = 1
+DELETE_BATCH_SIZE = 500
+
+
+class ValueCodec:
+    """
+    Compresses large values on the way to Redis and restores them on the way back.
+
+    A compressed value starts with a NUL byte and a format byte. Plain values are JSON
+    or numbers, they never start with NUL, so values written before compression
+    was enabled (or below the size threshold) are returned as is.
+    """
+    MARKER = b"\x00"
+    ZLIB = b"z"
+
+    def __init__(self, min_size: int, level: int):
+        self.min_size = min_size
+        self.level = level
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.compressed = 0
+        self.plain = 0
+
+    def encode(self, value: Union[str, bytes]) -> bytes:
+        if isinstance(value, str):
+            value = value.encode()
+        stored = value
+        if self.min_size and len(value) >= self.min_size:
+            compressed = self.MARKER + self.ZLIB + zlib.compress(value, self.level)
+            if len(compressed) < len(value):
+                stored = compressed
+        self.compressed += stored is not value
+        self.plain += stored is value
+        self.raw_bytes += len(value)
+        self.stored_bytes += len(stored)
+        return stored
+
+    def decode(self, data: Optional[bytes]) -> Optional[bytes]:
+        if not data or data[:1] != self.MARKER:
+            return data
+        if data[1:2] == self.ZLIB:
+            return zlib.decompress(data[2:])
+        raise ValueError(f"unknown cache value format: {data[1:2]!r}")
+
+    def stats(self) -> dict:
+        return {
+            "compressed": self.compressed,
+            "plain": self.plain,
+            "raw_bytes": self.raw_bytes,
+            "stored_bytes": self.stored_bytes,
+            "ratio": self.stored_bytes / self.raw_bytes if self.raw_bytes else 1.0,
+        }
+
+
+codec = ValueCodec(CACHE_COMPRESS_MIN_SIZE, CACHE_COMPRESS_LEVEL)
+
+
+def bypass_on_failure(miss: Callable[..., Any] = lambda *args, **kwargs: None):
+    """
+    While Redis is unavailable the cache is bypassed: reads miss, writes are dropped.
+    :param miss: returns the result of the call on a miss, gets the same arguments.
+    """
+    def decorator(method):
+        @wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            try:
+                return await method(self, *args, **kwargs)
+            except (BackendUnavailable,) + UNAVAILABLE_ERRORS as error:
+                CACHE_BYPASS.labels(method.__name__).inc()
+                logger.debug("Cache %s bypassed: %r", method.__name__, error)
+                return miss(*args, **kwargs)
+        return wrapper
+    return decorator
+
 
 class RedisCache(Cache):
     def __init__(self):
@@ -26,16 +119,142 @@ class RedisCache(Cache):
     # (timeout kwarg in `create_redis_pool`). It triggers `aioredis.exceptions.TimeoutError` if
     # `open_connection` is not awaited (or raised error) within timeout limits.
     # It is not obvious, whichever exception will trigger first.
+    @bypass_on_failure()
     @backoff.on_exception(backoff.expo,
                           (socket.gaierror, TimeoutError),
                           max_time=CACHE_BACKOFF_TIME,
-                          factor=BACKOFF_FACTOR)
-    async def get(self, key: str) -> Optional[list]:
-        return await self.client.get(key)
+                          factor=BACKOFF_FACTOR,
+                          on_backoff=count_retry("redis", "get"))
+    async def get(self, key: str) -> Optional[bytes]:
+        with breaker, observe_call("redis", "get"):
+            data = await self.client.get(key)
+        if data is not None:
+            BACKEND_PAYLOAD.labels("redis", "get").observe(len(data))
+        return codec.decode(data)
 
+    @bypass_on_failure()
     @backoff.on_exception(backoff.expo,
                           (socket.gaierror, TimeoutError),
                           max_time=CACHE_BACKOFF_TIME,
-                          factor=BACKOFF_FACTOR)
+                          factor=BACKOFF_FACTOR,
+                          on_backoff=count_retry("redis", "set"))
     async def set(self, key: str, value: str, expire: int):
-        await self.client.set(key, value, expire=expire)
+        data = codec.encode(value)
+        BACKEND_PAYLOAD.labels("redis", "set").observe(len(data))
+        with breaker, observe_call("redis", "set"):
+            await self.client.set(key, data, expire=expire)
+
+    @bypass_on_failure(lambda keys: [None] * len(keys))
+    @backoff.on_exception(backoff.expo,
+                          (socket.gaierror, TimeoutError),
+                          max_time=CACHE_BACKOFF_TIME,
+                          factor=BACKOFF_FACTOR,
+                          on_backoff=count_retry("redis", "get_many"))
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        if not keys:
+            return []
+        with breaker, observe_call("redis", "get_many", {"redis.keys": len(keys)}):
+            values = await self.client.mget(*keys)
+        BACKEND_PAYLOAD.labels("redis", "get_many").observe(sum(len(data) for data in values if data))
+        return [codec.decode(data) for data in values]
+
+    @bypass_on_failure()
+    @backoff.on_exception(backoff.expo,
+                          (socket.gaierror, TimeoutError),
+                          max_time=CACHE_BACKOFF_TIME,
+                          factor=BACKOFF_FACTOR,
+                          on_backoff=count_retry("redis", "set_many"))
+    async def set_many(self, values: Dict[str, str], expire: int):
+        # MSET has no expiry, so SET commands are pipelined into a single round trip instead.
+        if not values:
+            return
+        pipe, size = self.client.pipeline(), 0
+        for key, value in values.items():
+            data = codec.encode(value)
+            size += len(data)
+            pipe.set(key, data, expire=expire)
+        BACKEND_PAYLOAD.labels("redis", "set_many").observe(size)
+        with breaker, observe_call("redis", "set_many", {"redis.keys": len(values)}):
+            await pipe.execute()
+
+    @bypass_on_failure()
+    @backoff.on_exception(backoff.expo,
+                          (socket.gaierror, TimeoutError),
+                          max_time=CACHE_BACKOFF_TIME,
+                          factor=BACKOFF_FACTOR,
+                          on_backoff=count_retry("redis", "add_tags"))
+    async def add_tags(self, tags: Dict[str, Iterable[str]], expire: int, since: float = None):
+        # A tag set outlives every value in it, otherwise a value could miss its invalidation.
+        # Stale keys in the set are harmless: deleting a missing key is a no-op.
+        expire = max(expire, CACHE_TAG_EXPIRE)
+        tag_names = sorted({tag for key_tags in tags.values() for tag in key_tags})
+        if not tag_names:
+            return
+        names = [TAG_PREFIX + tag for tag in tag_names]
+        pipe = self.client.pipeline()
+        for key, key_tags in tags.items():
+            for tag in key_tags:
+                pipe.sadd(TAG_PREFIX + tag, key)
+                pipe.expire(TAG_PREFIX + tag, expire)
+        for name in names:
+            pipe.scard(name)
+        # Tombstones are read after the keys are added to the tag sets, and `invalidate_tags` writes them
+        # before reading the sets: either the invalidation finds the key, or the key sees the tombstone.
+        if since is not None:
+            pipe.mget(*(TOMBSTONE_PREFIX + tag for tag in tag_names))
+        with breaker:
+            results = await pipe.execute()
+            if since is not None:
+                invalidated = {tag for tag, value in zip(tag_names, results.pop())
+                               if value is not None and float(value) >= since - CLOCK_SKEW}
+                stale = [key for key, key_tags in tags.items() if invalidated.intersection(key_tags)]
+                if stale:
+                    await self.client.delete(*stale)
+                    logger.debug("Dropped %d cache keys loaded before invalidation of %s", len(stale), invalidated)
+            sizes = results[-len(names):]
+            overflow = {name: size - CACHE_TAG_MAX_KEYS for name, size in zip(names, sizes)
+                        if size > CACHE_TAG_MAX_KEYS}
+            if overflow:
+                await self._evict_overflow(overflow)
+
+    async def _evict_overflow(self, overflow: Dict[str, int]):
+        # Keys of expired values pile up in a tag set until the tag is invalidated.
+        # Random keys over the limit leave the set, and their values leave the cache:
+        # dropping a value is always safe, keeping it without its tag is not.
+        pipe = self.client.pipeline()
+        for name, count in overflow.items():
+            pipe.spop(name, count)
+        keys = sorted({key for popped in await pipe.execute() for key in popped})
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            await self.client.delete(*keys[start:start + DELETE_BATCH_SIZE])
+        logger.debug("Evicted %d cache keys over the tag limit of %s", len(keys), sorted(overflow))
+
+    @backoff.on_exception(backoff.expo,
+                          (socket.gaierror, TimeoutError),
+                          max_time=CACHE_BACKOFF_TIME,
+                          factor=BACKOFF_FACTOR,
+                          on_backoff=count_retry("redis", "invalidate_tags"))
+    async def invalidate_tags(self, tags: Iterable[str]) -> List[str]:
+        # Deleted keys leave the tag sets, so only the first worker to handle the event gets them:
+        # it tells the others to drop their local copies, see services.invalidation.
+        # Keys are removed from the sets after their values, so a retry finds them again.
+        tags = list(tags)
+        names = [TAG_PREFIX + tag for tag in tags]
+        pipe = self.client.pipeline()
+        invalidated_at = str(time.time())
+        for tag in tags:
+            pipe.set(TOMBSTONE_PREFIX + tag, invalidated_at, expire=CACHE_TAG_TOMBSTONE_TTL)
+        for name in names:
+            pipe.smembers(name)
+        with breaker:
+            members = (await pipe.execute())[len(tags):]
+            keys = sorted({key.decode() for tag_keys in members for key in tag_keys})
+            for start in range(0, len(keys), DELETE_BATCH_SIZE):
+                await self.client.delete(*keys[start:start + DELETE_BATCH_SIZE])
+            if keys:
+                pipe = self.client.pipeline()
+                for name, tag_keys in zip(names, members):
+                    if tag_keys:
+                        pipe.srem(name, *tag_keys)
+                await pipe.execute()
+        return keys
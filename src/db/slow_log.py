@@ -0,0 +1,201 @@
+"""
+Журнал медленных запросов к Elasticsearch.
+
+Запросы дольше ES_SLOW_QUERY_THRESHOLD записываются в лог и в кольцевой буфер воркера,
+который отдаёт /api/v1/admin/slow-queries. Доля ES_PROFILE_SAMPLE_RATE поисковых запросов
+выполняется с `profile: true`, их разбивка времени по шардам тоже попадает в буфер.
+"""
+import hashlib
+import logging
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import orjson
+
+from core.config import ES_PROFILE_SAMPLE_RATE, ES_SLOW_QUERY_LOG_SIZE, ES_SLOW_QUERY_THRESHOLD
+from core.tracing import request_id
+
+logger = logging.getLogger(__name__)
+
+# Значения этих ключей описывают структуру запроса, а не данные пользователя, и сохраняются в форме запроса.
+STRUCTURAL_KEYS = {"fields", "path", "_source", "sort", "field", "order", "operator", "type", "size",
+                   "track_total_hits", "profile"}
+
+
+def query_shape(query):
+    """
+    Форма запроса: структура DSL, в которой значения пользователя (текст поиска, идентификаторы,
+    смещения) заменены на "?". Запросы одной формы отличаются только параметрами.
+    """
+    if isinstance(query, dict):
+        return {key: value if key in STRUCTURAL_KEYS else query_shape(value) for key, value in query.items()}
+    if isinstance(query, list) and query and all(isinstance(item, dict) for item in query):
+        return [query_shape(item) for item in query]
+    return "?"
+
+
+def fingerprint(shape) -> str:
+    return hashlib.md5(orjson.dumps(shape, option=orjson.OPT_SORT_KEYS)).hexdigest()[:12]
+
+
+def nanos_to_ms(nanos: int) -> float:
+    return round(nanos / 1_000_000, 3)
+
+
+def profile_tree(node: dict) -> dict:
+    return {
+        "type": node.get("type"),
+        "description": node.get("description"),
+        "time_ms": nanos_to_ms(node.get("time_in_nanos", 0)),
+        "children": [profile_tree(child) for child in node.get("children", [])],
+    }
+
+
+def profile_summary(profile: dict) -> List[dict]:
+    """
+    Разбивка времени запроса по шардам из ответа ES с `profile: true`, самый медленный шард первый.
+    """
+    shards = []
+    for shard in profile.get("shards", []):
+        searches = shard.get("searches", [])
+        queries = [query for search in searches for query in search.get("query", [])]
+        shards.append({
+            "id": shard.get("id"),
+            "query_ms": nanos_to_ms(sum(query.get("time_in_nanos", 0) for query in queries)),
+            "rewrite_ms": nanos_to_ms(sum(search.get("rewrite_time", 0) for search in searches)),
+            "collector_ms": nanos_to_ms(sum(collector.get("time_in_nanos", 0)
+                                            for search in searches for collector in search.get("collector", []))),
+            "aggregations_ms": nanos_to_ms(sum(aggregation.get("time_in_nanos", 0)
+                                               for aggregation in shard.get("aggregations", []))),
+            "queries": [profile_tree(query) for query in queries],
+        })
+    return sorted(shards, key=lambda shard: shard["query_ms"] + shard["aggregations_ms"], reverse=True)
+
+
+class SlowLogCall:
+    """Вызов ES внутри `SlowQueryLog.timed`: блок сохраняет в `result` ответ ES."""
+
+    def __init__(self):
+        self.result: Optional[dict] = None
+
+
+class SlowQueryLog:
+
+    def __init__(self, threshold: float, size: int, profile_rate: float = 0.0):
+        """
+        :param threshold: время запроса в секундах, начиная с которого он считается медленным; 0 - не записывать.
+        :param size: сколько последних записей хранить.
+        :param profile_rate: доля поисковых запросов, выполняемых с профилированием.
+        """
+        self.threshold = threshold
+        self.profile_rate = profile_rate
+        self.entries = deque(maxlen=size)
+        self.slow = 0
+        self.profiled = 0
+
+    def sampled(self, query: dict) -> dict:
+        """Запрос с `profile: true`, если он попал в выборку профилирования, иначе сам запрос."""
+        if self.profile_rate and random.random() < self.profile_rate:
+            return {**query, "profile": True}
+        return query
+
+    @contextmanager
+    def timed(self, operation: str, index: str, query: Optional[dict]) -> Iterator[SlowLogCall]:
+        """
+        Измеряет вызов ES внутри блока и записывает его, в том числе если он завершился ошибкой.
+        """
+        call, error = SlowLogCall(), None
+        start = time.perf_counter()
+        try:
+            yield call
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.record(operation, index, query, time.perf_counter() - start, call.result, error=error)
+
+    def record(self, operation: str, index: str, query: Optional[dict], wall: float, result: dict = None,
+               batched: bool = False, error: BaseException = None):
+        """
+        Записывает вызов ES, если он медленный или профилированный.
+        :param wall: время вызова на стороне клиента, в секундах.
+        :param result: ответ ES; из него берутся took, количество найденных и профиль.
+        :param batched: запрос выполнялся в составе _msearch; медленным он считается по своему took,
+            а не по общему времени вызова.
+        :param error: исключение, которым завершился вызов; такой вызов записывается, если он медленный.
+        """
+        result = result or {}
+        took = result.get("took")
+        elapsed = took / 1000 if batched and took is not None else wall
+        slow = bool(self.threshold) and elapsed >= self.threshold
+        profile = result.get("profile")
+        if not slow and profile is None:
+            return
+
+        shape = query_shape(query or {})
+        hits = result.get("hits", {})
+        entry = {
+            "time": round(time.time(), 3),
+            "operation": operation,
+            "index": index,
+            "fingerprint": fingerprint(shape),
+            "shape": shape,
+            "took_ms": took,
+            "wall_ms": round(wall * 1000, 3),
+            "hits": len(hits["hits"]) if "hits" in hits else None,
+            "total": hits.get("total", {}).get("value") if hits else result.get("count"),
+            "timed_out": result.get("timed_out", False),
+            "request_id": request_id.get(),
+            "error": type(error).__name__ if error is not None else None,
+            "slow": slow,
+        }
+        if slow:
+            self.slow += 1
+            logger.warning("Slow Elasticsearch query: %s", orjson.dumps(entry).decode())
+        if profile is not None:
+            self.profiled += 1
+            entry["profile"] = profile_summary(profile)
+        self.entries.appendleft(entry)
+
+    def recent(self, limit: int = None, fingerprint: str = None, slow_only: bool = False) -> List[dict]:
+        """Последние записи, новые первыми."""
+        entries = (entry for entry in self.entries
+                   if (fingerprint is None or entry["fingerprint"] == fingerprint)
+                   and (not slow_only or entry["slow"]))
+        return list(entries)[:limit]
+
+    def shapes(self) -> List[dict]:
+        """
+        Медленные запросы из буфера, сгруппированные по форме: самые частые первыми.
+        """
+        groups: Dict[str, dict] = {}
+        for entry in self.entries:
+            if not entry["slow"]:
+                continue
+            group = groups.setdefault(entry["fingerprint"], {
+                "fingerprint": entry["fingerprint"],
+                "operation": entry["operation"],
+                "index": entry["index"],
+                "shape": entry["shape"],
+                "count": 0,
+                "max_wall_ms": 0.0,
+                "max_took_ms": None,
+            })
+            group["count"] += 1
+            group["max_wall_ms"] = max(group["max_wall_ms"], entry["wall_ms"])
+            if entry["took_ms"] is not None:
+                group["max_took_ms"] = max(group["max_took_ms"] or 0, entry["took_ms"])
+        return sorted(groups.values(), key=lambda group: (group["count"], group["max_wall_ms"]), reverse=True)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        return {"slow": self.slow, "profiled": self.profiled, "entries": len(self.entries)}
+
+
+# Один журнал на воркер, общий для всех хранилищ.
+slow_log = SlowQueryLog(ES_SLOW_QUERY_THRESHOLD, ES_SLOW_QUERY_LOG_SIZE, ES_PROFILE_SAMPLE_RATE)
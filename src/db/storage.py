@@ -1,9 +1,47 @@
 import abc
 import logging
+from dataclasses import dataclass, field
+from typing import AsyncIterator, ClassVar, List, Optional, Union
+
+from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class SearchPage:
+    items: list = field(default_factory=list)
+    # Всего найдено документов (hits.total)
+    total: int = 0
+    # False, если total - нижняя граница: документов больше, чем ES считает точно
+    total_exact: bool = True
+    # Значения сортировки последнего документа, для search_after
+    last_sort: Optional[list] = None
+
+
+@dataclass
+class SearchError:
+    """Ошибка одного запроса из multi_search: остальные запросы при этом выполняются."""
+    # Тип ошибки ES, например search_phase_execution_exception
+    type: str
+    reason: str = ""
+    status: int = 500
+
+
+def source_fields(model: ClassVar, prefix: str = "") -> List[str]:
+    """
+    Поля документа, нужные для построения модели, в формате `_source` ES:
+    для вложенных моделей - пути к их полям, например actors.id.
+    """
+    fields = []
+    for name, field_ in model.__fields__.items():
+        if isinstance(field_.type_, type) and issubclass(field_.type_, BaseModel):
+            fields.extend(source_fields(field_.type_, f"{prefix}{name}."))
+        else:
+            fields.append(f"{prefix}{name}")
+    return fields
+
+
 class Storage(abc.ABC):
     def __call__(self):
         return self
@@ -17,9 +55,37 @@ class Storage(abc.ABC):
         pass
 
     @abc.abstractmethod
-    async def search(self, query: dict):
+    async def get_many(self, doc_ids: List[str]) -> list:
+        pass
+
+    @abc.abstractmethod
+    async def search(self, query: dict, model: ClassVar = None):
+        """
+        :param model: модель найденных документов, по умолчанию модель хранилища.
+                      Из хранилища читаются только поля этой модели.
+        """
+        pass
+
+    @abc.abstractmethod
+    async def search_page(self, query: dict, model: ClassVar = None) -> SearchPage:
+        pass
+
+    @abc.abstractmethod
+    async def multi_search(self, queries: List[dict], model: ClassVar = None) -> List[Union[SearchPage, SearchError]]:
+        """
+        Несколько поисковых запросов за одно обращение к хранилищу.
+        :return: результаты в порядке запросов; на месте неудавшегося запроса - SearchError.
+        """
         pass
 
     @abc.abstractmethod
     async def count(self, query: dict) -> int:
         pass
+
+    @abc.abstractmethod
+    def scan(self, query: dict, size: int, source: List[str] = None) -> AsyncIterator[List[dict]]:
+        pass
+
+    @abc.abstractmethod
+    async def aggregate(self, query: dict) -> dict:
+        pass
@@ -0,0 +1,95 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from core.config import DEFAULT_CACHE_EXPIRE, LOCAL_CACHE_MAX_SIZE
+from db.cache import Cache
+from db.memory_cache import LocalCache
+from db.redis_cache import RedisCache
+
+# One LRU per worker process, shared by all services (keys are already prefixed).
+local_cache = LocalCache(max_size=LOCAL_CACHE_MAX_SIZE)
+
+
+class TieredCache(Cache):
+    """
+    Two-tier cache: already parsed objects are kept in the per-worker `local_cache`,
+    misses fall through to the remote cache (Redis by default).
+
+    Writes go to the remote tier and drop the local entry, so the next read parses
+    the value once and keeps the object. Other workers may serve their local copy
+    until its TTL runs out.
+
+    The same value may be read with different `loads` (e.g. raw bytes and a model),
+    so a local entry maps each `loads` to its own object.
+    """
+
+    def __init__(self, remote: Cache = None, local: LocalCache = None):
+        super().__init__()
+        self.remote = remote or RedisCache()
+        self.local = local if local is not None else local_cache
+
+    @property
+    def client(self):
+        return self.remote.client
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.remote.get(key)
+
+    async def set(self, key: str, value: str, expire: int):
+        self.local.delete(key)
+        await self.remote.set(key, value, expire=expire)
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        return await self.remote.get_many(keys)
+
+    async def set_many(self, values: Dict[str, str], expire: int):
+        for key in values:
+            self.local.delete(key)
+        await self.remote.set_many(values, expire=expire)
+
+    async def add_tags(self, tags: Dict[str, Iterable[str]], expire: int, since: float = None):
+        await self.remote.add_tags(tags, expire=expire, since=since)
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> List[str]:
+        keys = await self.remote.invalidate_tags(tags)
+        for key in keys:
+            self.local.delete(key)
+        return keys
+
+    def evict_local(self, key: str):
+        self.local.delete(key)
+
+    async def get_object(self, key: str, loads: Callable[[bytes], Any], expire: int = None) -> Optional[Any]:
+        variants = self.local.get(key)
+        if variants is not None and loads in variants:
+            return variants[loads]
+
+        obj = await self.remote.get_object(key, loads)
+        if obj is not None:
+            self._keep(key, loads, obj, expire, variants)
+        return obj
+
+    async def get_many_objects(self, keys: List[str], loads: Callable[[bytes], Any],
+                               expire: int = None) -> List[Optional[Any]]:
+        entries = [self.local.get(key) for key in keys]
+        objects = [variants.get(loads) if variants is not None else None for variants in entries]
+        missing = [key for key, obj in zip(keys, objects) if obj is None]
+        if not missing:
+            return objects
+
+        loaded = dict(zip(missing, await self.remote.get_many_objects(missing, loads)))
+        for key, variants in zip(keys, entries):
+            obj = loaded.get(key)
+            if obj is not None:
+                self._keep(key, loads, obj, expire, variants)
+        return [obj if obj is not None else loaded[key] for key, obj in zip(keys, objects)]
+
+    def _keep(self, key: str, loads: Callable[[bytes], Any], obj: Any, expire: Optional[int],
+              variants: Optional[Dict[Callable, Any]]):
+        if variants is None:
+            self.local.set(key, {loads: obj}, expire or DEFAULT_CACHE_EXPIRE)
+        else:
+            # The entry keeps its TTL: all variants come from the same remote value.
+            variants[loads] = obj
+
+    def stats(self) -> dict:
+        return self.local.stats()
@@ -3,14 +3,22 @@ import logging
 import aioredis
 import uvicorn as uvicorn
 from elasticsearch import AsyncElasticsearch
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.responses import ORJSONResponse
 
-from api.v1 import film, genre, person
+from api import metrics
+from api.instrumentation import TracingMiddleware
+from api.v1 import admin, film, genre, person
 from core import config
 from core.config import DEV
+from core.deadline import deadline
+from core.tracing import setup_tracing
+from core.scheduler import scheduler
 from core.logger import LOGGING
 from db import es_storage, redis_cache
+from services import auth, local_auth, warmup
+from services.genre import refresh_genres_popularity_periodically
+from services.invalidation import consume_invalidation_events
 from tags import tags_metadata
 
 app = FastAPI(
@@ -21,25 +29,52 @@ app = FastAPI(
     openapi_tags=tags_metadata
 )
 
+app.add_middleware(TracingMiddleware)
+
+
+if config.REQUEST_DEADLINE:
+    @app.middleware("http")
+    async def request_deadline(request: Request, call_next):
+        # Storage calls made while handling the request share its time budget.
+        with deadline(config.REQUEST_DEADLINE):
+            return await call_next(request)
+
 
 @app.on_event("startup")
 async def startup():
+    setup_tracing(config.TRACING_EXPORTER)
     redis_cache.redis = await aioredis.create_redis_pool((config.REDIS_HOST, config.REDIS_PORT),
                                                          minsize=10,
                                                          maxsize=20,
                                                          timeout=1)
-    es_storage.es = AsyncElasticsearch(hosts=[f"{config.ELASTIC_HOST}:{config.ELASTIC_PORT}"])
+    es_storage.es = AsyncElasticsearch(hosts=[f"{config.ELASTIC_HOST}:{config.ELASTIC_PORT}"],
+                                       timeout=config.ES_TIMEOUT)
+    auth.session = auth.create_session()
+    if config.AUTH_MODE == "local":
+        await local_auth.key_store.refresh(auth.session)
+    if config.WARMUP_ON_STARTUP:
+        # Startup is not finished until the cache is warm or WARMUP_TIMEOUT runs out, so is the readiness of the app.
+        await warmup.warm_up_on_startup()
+    if config.CACHE_INVALIDATION_CHANNEL:
+        scheduler.start("cache invalidation", consume_invalidation_events, config.CACHE_INVALIDATION_CHANNEL)
+    if config.GENRE_POPULARITY_REFRESH_INTERVAL:
+        scheduler.start("genres popularity refresh", refresh_genres_popularity_periodically,
+                        config.GENRE_POPULARITY_REFRESH_INTERVAL)
 
 
 @app.on_event("shutdown")
 async def shutdown():
+    await scheduler.close()
     await redis_cache.redis.close()
     await es_storage.es.close()
+    await auth.session.close()
 
 
+app.include_router(metrics.router)
 app.include_router(film.router, prefix="/api/v1/film", tags=["film"])
 app.include_router(genre.router, prefix="/api/v1/genre", tags=["genre"])
 app.include_router(person.router, prefix="/api/v1/person", tags=["person"])
+app.include_router(admin.router, prefix="/api/v1/admin", tags=["admin"])
 
 
 if __name__ == "__main__":
@@ -11,7 +11,7 @@ def orjson_dumps(v, *, default):
 class AbstractModel(BaseModel):
     id: str
 
-    class Meta:
+    class Config:
         # Заменяем стандартную работу с json на более быструю
         json_loads = orjson.loads
         json_dumps = orjson_dumps
@@ -23,3 +23,10 @@ class FilmPreview(AbstractModel):
     title: str
     imdb_rating: Optional[float]
     description: str
+
+
+class FilmRoles(AbstractModel):
+    """Только идентификаторы участников фильма: для поиска ролей персон."""
+    actors: List[AbstractModel]
+    writers: List[AbstractModel]
+    directors: List[AbstractModel]
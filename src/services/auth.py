@@ -1,8 +1,10 @@
 """
 Auth integration
 """
-import uuid
+import asyncio
+import hashlib
 from http import HTTPStatus
+from typing import Tuple
 
 import aiohttp
 import backoff
@@ -11,21 +13,102 @@ from fastapi import HTTPException
 from fastapi.params import Depends
 from fastapi.security import HTTPBasicCredentials, HTTPBearer
 
-from core.config import AUTH_BACKOFF_TIME, AUTH_URL, BACKOFF_FACTOR
+from core.config import (AUTH_BACKOFF_TIME, AUTH_CACHE_EXPIRE, AUTH_CACHE_MAX_SIZE, AUTH_KEEPALIVE_TIMEOUT,
+                         AUTH_MODE, AUTH_NEGATIVE_CACHE_EXPIRE, AUTH_POOL_SIZE, AUTH_REMOTE_FALLBACK, AUTH_TIMEOUT,
+                         AUTH_URL, BACKOFF_FACTOR)
+from core.metrics import LatencyStats, count_retry, observe_call
+from core.tracing import outgoing_headers
+from db.memory_cache import LocalCache
+from services import local_auth
 
 security = HTTPBearer(auto_error=False)
 
+# Application-lifetime client, created on startup.
+session: aiohttp.ClientSession = None
+
+# (token hash, roles) -> auth service verdict. Tokens themselves are never kept in memory.
+verdicts = LocalCache(max_size=AUTH_CACHE_MAX_SIZE)
+auth_latency = LatencyStats()
+
+CACHEABLE_VERDICTS = (HTTPStatus.OK, HTTPStatus.UNAUTHORIZED, HTTPStatus.FORBIDDEN)
+
+
+def create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(limit=AUTH_POOL_SIZE,
+                                     keepalive_timeout=AUTH_KEEPALIVE_TIMEOUT,
+                                     ttl_dns_cache=300)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=AUTH_TIMEOUT))
+
+
+def auth_stats() -> dict:
+    cache = verdicts.stats()
+    lookups = cache["hits"] + cache["misses"]
+    return {
+        "cache": cache,
+        "cache_hit_ratio": cache["hits"] / lookups if lookups else 0.0,
+        "latency": auth_latency.stats(),
+    }
+
 
 def giveup_handler(details):
     raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE)
 
 
+# A slow auth service hits the session timeout (AUTH_TIMEOUT): retried like a lost connection.
+@backoff.on_exception(backoff.expo,
+                      (ClientConnectionError, asyncio.TimeoutError),
+                      max_time=AUTH_BACKOFF_TIME,
+                      factor=BACKOFF_FACTOR,
+                      on_backoff=count_retry("auth", "check"),
+                      on_giveup=giveup_handler)
+async def check_token(token: str, roles: Tuple[str, ...]) -> HTTPStatus:
+    data = {"roles": roles}
+    with auth_latency.time(), observe_call("auth", "check"):
+        # The request id and the trace context let the auth service log the call as part of this request.
+        headers = {
+            "Authorization": f"Bearer {token}",
+            **outgoing_headers(),
+        }
+        async with session.get(
+                AUTH_URL,
+                json=data,
+                headers=headers,
+        ) as response:
+            if response.status in CACHEABLE_VERDICTS:
+                return HTTPStatus(response.status)
+            raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
+                                detail=f"Auth response: {await response.json()}")
+
+
+async def get_verdict(token: str, roles: Tuple[str, ...]) -> HTTPStatus:
+    if AUTH_MODE == "local":
+        verdict = await local_auth.verify_token(token, roles, session)
+        if verdict is not None:
+            return verdict
+        if not AUTH_REMOTE_FALLBACK:
+            return HTTPStatus.UNAUTHORIZED
+
+    key = (hashlib.sha256(token.encode()).hexdigest(), roles)
+    verdict = verdicts.get(key)
+    if verdict is None:
+        verdict = await check_token(token, roles)
+        expire = AUTH_CACHE_EXPIRE if verdict == HTTPStatus.OK else AUTH_NEGATIVE_CACHE_EXPIRE
+        verdicts.set(key, verdict, expire)
+    return verdict
+
+
+def raise_for_verdict(verdict: HTTPStatus) -> bool:
+    if verdict == HTTPStatus.OK:
+        return True
+    if verdict == HTTPStatus.UNAUTHORIZED:
+        raise HTTPException(status_code=HTTPStatus.NETWORK_AUTHENTICATION_REQUIRED)
+    raise HTTPException(status_code=HTTPStatus.FORBIDDEN,
+                        detail="Forbidden")
+
+
 def role_validator_factory(roles):
-    @backoff.on_exception(backoff.expo,
-                          ClientConnectionError,
-                          max_time=AUTH_BACKOFF_TIME,
-                          factor=BACKOFF_FACTOR,
-                          on_giveup=giveup_handler)
+    roles = tuple(roles)
+
     async def token_is_valid(credentials: HTTPBasicCredentials = Depends(security), ):
         # If endpoint can be accessed by guest, everyone else can
         if "guest" in roles:
@@ -33,25 +116,5 @@ def role_validator_factory(roles):
         # If not, credentials required
         if credentials is None:
             raise HTTPException(status_code=HTTPStatus.NETWORK_AUTHENTICATION_REQUIRED)
-        async with aiohttp.ClientSession() as session:
-            data = {"roles": roles}
-            headers = {
-                "Authorization": f"Bearer {credentials.credentials}",
-                "X-Request-Id": str(uuid.uuid4()),
-            }
-            async with session.get(
-                    AUTH_URL,
-                    json=data,
-                    headers=headers,
-            ) as response:
-                if response.status == 200:
-                    return True
-                if response.status == 401:
-                    raise HTTPException(status_code=HTTPStatus.NETWORK_AUTHENTICATION_REQUIRED)
-                if response.status == 403:
-                    raise HTTPException(status_code=HTTPStatus.FORBIDDEN,
-                                        detail="Forbidden")
-                else:
-                    raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
-                                        detail=f"Auth response: {await response.json()}")
+        return raise_for_verdict(await get_verdict(credentials.credentials, roles))
     return token_is_valid
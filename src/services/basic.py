@@ -1,32 +1,302 @@
-from typing import Optional, List, ClassVar
+import asyncio
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Awaitable, Callable, ClassVar, Dict, Iterable, List, Optional
 
 import orjson
+from opentelemetry import trace
 
+from core.circuit_breaker import BackendUnavailable
+from core.config import CACHE_STALE_IF_ERROR_TTL, CACHE_STALE_TTL
+from core.metrics import CACHE_LOOKUPS
+from core.tracing import tracer
+from core.scheduler import scheduler
 from db.cache import Cache
+from db.storage import SearchPage, Storage
 from models.basic import AbstractModel
+from services.cache_keys import cache_key
+from services.invalidation import entity_tag, list_tag
+from services.pagination import Page, next_cursor
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts the coroutine,
+    the others await its result instead of hitting the storage again.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key: str, func: Callable[..., Awaitable], *args) -> Any:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func(*args))
+            self._calls[key] = future
+            future.add_done_callback(partial(self._forget, key))
+        # A cancelled request must not cancel the call other requests are waiting for.
+        return await asyncio.shield(future)
+
+    def _forget(self, key: str, future: asyncio.Future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            # Mark exception as retrieved even if every waiter is gone.
+            future.exception()
+
+
+single_flight = SingleFlight()
+
+# When the running `BaseService.load_once` call started reading the storage.
+load_started: ContextVar[Optional[float]] = ContextVar("load_started", default=None)
+
+
+@dataclass
+class CachedResponse:
+    """
+    Final JSON body of a list response as it is kept in the cache, plus response metadata
+    (number of items, total number of hits, cursor of the next page). Hits are sent to the client as is,
+    models are built only when a caller needs them.
+
+    Cache format: metadata JSON, a newline, then the body.
+    The value lives in the cache CACHE_STALE_TTL + CACHE_STALE_IF_ERROR_TTL seconds longer than its `expire`:
+    after `fresh_until` it is stale, still served, but refreshed in the background.
+    CACHE_STALE_TTL seconds later it is expired: it is reloaded before responding
+    and served only if the storage is unavailable.
+    """
+    body: bytes
+    meta: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_records(cls, records: List[AbstractModel], model: ClassVar, **meta) -> "CachedResponse":
+        fields = set(model.__fields__)
+        body = orjson.dumps([record.dict(include=fields) for record in records], default=str)
+        return cls(body, {"count": len(records), **meta})
+
+    @classmethod
+    def from_search(cls, result: SearchPage, model: ClassVar, items: List[AbstractModel] = None,
+                    **meta) -> "CachedResponse":
+        """
+        Response for the found documents (or `items` built from them) with the total number of hits.
+        """
+        items = result.items if items is None else items
+        return cls.from_records(items, model, total=result.total, exact=result.total_exact, **meta)
+
+    @classmethod
+    def loads(cls, data: bytes) -> Optional["CachedResponse"]:
+        """
+        None for a value in another format, e.g. a plain JSON array cached by an older version:
+        callers treat it as a cache miss and overwrite it.
+        """
+        meta, newline, body = data.partition(b"\n")
+        try:
+            meta = orjson.loads(meta)
+        except ValueError:
+            return None
+        if not newline or not isinstance(meta, dict):
+            return None
+        return cls(body, meta)
+
+    def dumps(self) -> bytes:
+        # orjson escapes newlines inside strings, so the first one ends the metadata.
+        return orjson.dumps(self.meta) + b"\n" + self.body
+
+    @property
+    def count(self) -> int:
+        return self.meta.get("count", 0)
+
+    @property
+    def total(self) -> Optional[int]:
+        """Total number of hits, None if the response was built without it."""
+        return self.meta.get("total")
+
+    @property
+    def total_exact(self) -> bool:
+        """False if `total` is a lower bound, see ES_TRACK_TOTAL_HITS."""
+        return self.meta.get("exact", True)
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        return self.meta.get("next")
+
+    @property
+    def stale(self) -> bool:
+        fresh_until = self.meta.get("fresh_until")
+        return fresh_until is not None and fresh_until < time.time()
+
+    @property
+    def expired(self) -> bool:
+        fresh_until = self.meta.get("fresh_until")
+        return fresh_until is not None and fresh_until + CACHE_STALE_TTL < time.time()
+
+    def records(self, model: ClassVar) -> List[AbstractModel]:
+        return [model(**item) for item in orjson.loads(self.body)]
+
+    def page(self, model: ClassVar) -> Page:
+        return Page(self.records(model), self.next_cursor)
 
 
 class BaseService:
+    prefix: str
+    # Entity type in cache invalidation events: film, person or genre.
+    entity: str
     model: ClassVar
     cache: Cache
 
-    async def get_record_from_cache(self, key: str) -> Optional[list]:
-        data = await self.cache.get(key)
-        if not data:
-            return None
+    def record_tags(self, record: AbstractModel) -> List[str]:
+        """
+        Invalidation tags of a cached record: the record itself and entities shown in it.
+        """
+        return [entity_tag(self.entity, record.id)]
 
-        return self.model.parse_raw(data)
+    def lookup_span(self):
+        """Span of a cache lookup, `count_lookups` inside it records the result."""
+        return tracer.start_as_current_span("cache.lookup", attributes={"cache.prefix": self.prefix})
 
-    async def get_records_from_cache(self, query: str) -> Optional[List[AbstractModel]]:
-        data = await self.cache.get(query)
-        if not data:
-            return None
+    def count_lookups(self, result: str, count: int = 1):
+        """Counts cache lookups of the service: hit, miss, stale, expired or stale_if_error."""
+        if count:
+            CACHE_LOOKUPS.labels(self.prefix, result).inc(count)
+            trace.get_current_span().set_attribute(f"cache.{result}", count)
 
-        return [self.model(**item) for item in orjson.loads(data)]
+    async def get_record_from_cache(self, key: str, expire: int = None) -> Optional[AbstractModel]:
+        return await self.get_custom_data_from_cache(key, expire, self.model.parse_raw)
 
-    async def get_custom_data_from_cache(self, key: str):
-        return await self.cache.get(key)
+    async def get_raw_from_cache(self, key: str, expire: int = None) -> Optional[bytes]:
+        return await self.get_custom_data_from_cache(key, expire, bytes)
 
-    async def save_to_cache(self, key: str, value: str, expire: int):
+    async def get_custom_data_from_cache(self, key: str, expire: int = None,
+                                         loads: Callable[[bytes], Any] = lambda data: data):
+        with self.lookup_span():
+            value = await self.cache.get_object(key, loads, expire=expire)
+            self.count_lookups("miss" if value is None else "hit")
+        return value
+
+    async def save_to_cache(self, key: str, value: str, expire: int, tags: Iterable[str] = ()):
         await self.cache.set(key, value, expire=expire)
+        if tags:
+            await self.cache.add_tags({key: tags}, expire=expire, since=load_started.get())
+
+    async def load_once(self, key: str, func: Callable[..., Awaitable], *args) -> Any:
+        """
+        Runs `func(*args)` on a cache miss for `key`. Concurrent misses for the same key
+        share one call, so `func` is expected to save its result to the cache itself.
+        Values it saves are dropped if their tags are invalidated while it runs.
+        """
+        return await single_flight.do(key, self._load, func, *args)
+
+    @staticmethod
+    async def _load(func: Callable[..., Awaitable], *args) -> Any:
+        # Runs in its own task, so the start time is seen only by this load.
+        load_started.set(time.time())
+        return await func(*args)
+
+    async def get_records_by_ids(self, ids: List[str], expire: int,
+                                 load_many: Callable[[List[str]], Awaitable[list]]) -> List[AbstractModel]:
+        """
+        Returns records for the given ids in one cache round trip (MGET).
+        Cache misses are loaded with a single `load_many(missing_ids)` call and saved in one pipeline.
+        Ids that are not found anywhere are skipped, the order of the rest is preserved.
+        """
+        ids = list(dict.fromkeys(ids))
+        keys = [cache_key(self.prefix, record_id) for record_id in ids]
+        with self.lookup_span():
+            records = await self.cache.get_many_objects(keys, self.model.parse_raw, expire=expire)
+            missing = [record_id for record_id, record in zip(ids, records) if record is None]
+            self.count_lookups("hit", len(ids) - len(missing))
+            self.count_lookups("miss", len(missing))
+
+        if missing:
+            started = time.time()
+            loaded = {record.id: record for record in await load_many(missing) if record}
+            await self.cache.set_many({cache_key(self.prefix, record_id): record.json()
+                                       for record_id, record in loaded.items()}, expire=expire)
+            await self.cache.add_tags({cache_key(self.prefix, record_id): self.record_tags(record)
+                                       for record_id, record in loaded.items()}, expire=expire, since=started)
+            records = [record or loaded.get(record_id) for record_id, record in zip(ids, records)]
+        return [record for record in records if record]
+
+    async def get_response(self, key: str, expire: int,
+                           load: Callable[..., Awaitable[CachedResponse]], *args) -> CachedResponse:
+        """
+        Returns the list response cached under `key` without parsing it.
+        On a miss `load(*args)` builds the response, saves it to the cache and returns it.
+        A stale response is returned as is, while `load` refreshes it in the background.
+        An expired one is returned only if `load` fails because the storage is unavailable.
+        """
+        with self.lookup_span():
+            response = await self.cache.get_object(key, CachedResponse.loads, expire=expire)
+            self.count_lookups("miss" if response is None else "expired" if response.expired
+                               else "stale" if response.stale else "hit")
+        if response is None:
+            response = await self.load_once(key, load, *args)
+        elif response.expired:
+            response = await self._reload(key, response, load, *args)
+        elif response.stale:
+            scheduler.schedule(key, self._revalidate, key, load, *args)
+        return response
+
+    async def _reload(self, key: str, expired: CachedResponse,
+                      load: Callable[..., Awaitable[CachedResponse]], *args) -> CachedResponse:
+        try:
+            return await self.load_once(key, load, *args)
+        except BackendUnavailable:
+            self.count_lookups("stale_if_error")
+            return expired
+
+    async def _revalidate(self, key: str, load: Callable[..., Awaitable[CachedResponse]], *args):
+        data = await self.cache.get(key)
+        cached = CachedResponse.loads(data) if data else None
+        if cached and not cached.stale:
+            # Another worker has already refreshed the value, only our local copy is stale.
+            self.cache.evict_local(key)
+            return
+        await self.load_once(key, load, *args)
+
+    async def save_response(self, key: str, response: CachedResponse, expire: int,
+                            tags: Iterable[str] = ()) -> CachedResponse:
+        if CACHE_STALE_TTL or CACHE_STALE_IF_ERROR_TTL:
+            response.meta["fresh_until"] = time.time() + expire
+            expire += CACHE_STALE_TTL + CACHE_STALE_IF_ERROR_TTL
+        await self.save_to_cache(key, response.dumps(), expire, tags)
+        return response
+
+    async def save_responses(self, responses: Dict[str, CachedResponse], expire: int, tags: Iterable[str] = ()):
+        """
+        Same as `save_response` for several responses, in one cache round trip.
+        """
+        if not responses:
+            return
+        if CACHE_STALE_TTL or CACHE_STALE_IF_ERROR_TTL:
+            fresh_until = time.time() + expire
+            for response in responses.values():
+                response.meta["fresh_until"] = fresh_until
+            expire += CACHE_STALE_TTL + CACHE_STALE_IF_ERROR_TTL
+        await self.cache.set_many({key: response.dumps() for key, response in responses.items()}, expire=expire)
+        if tags:
+            await self.cache.add_tags(dict.fromkeys(responses, tags), expire=expire, since=load_started.get())
+
+    async def get_page(self, key: str, storage: Storage, query: dict, size: int, expire: int,
+                       prepare: Callable[[list], Awaitable[list]] = None,
+                       model: ClassVar = None) -> CachedResponse:
+        """
+        Returns a cursor page for the ES query with `search_after`, cached under `key`.
+        :param prepare: optional coroutine turning found documents into `self.model` instances.
+        :param model: model of the page items in the response, `self.model` by default.
+        """
+        return await self.get_response(key, expire, self._load_page, key, storage, query, size, expire,
+                                       prepare, model or self.model)
 
+    async def _load_page(self, key: str, storage: Storage, query: dict, size: int, expire: int,
+                         prepare: Callable[[list], Awaitable[list]], model: ClassVar) -> CachedResponse:
+        # Without `prepare` the found documents are the page items: only their fields are fetched.
+        result = await storage.search_page(query, None if prepare else model)
+        items = await prepare(result.items) if prepare else result.items
+        response = CachedResponse.from_search(result, model, items,
+                                              next=next_cursor(result.items, size, result.last_sort))
+        return await self.save_response(key, response, expire, [list_tag(self.entity)])
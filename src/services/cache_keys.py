@@ -0,0 +1,55 @@
+"""
+Cache keys for service responses.
+
+Every key starts with the schema version, so bumping CACHE_KEY_VERSION on deploy
+makes all previously cached values unreachable (they expire on their own).
+Request parameters are normalized first, so semantically identical requests share
+one entry, and then hashed into a short fixed-length suffix.
+"""
+import hashlib
+from typing import Optional
+
+import orjson
+
+from core.config import CACHE_KEY_VERSION
+
+DIGEST_SIZE = 12
+
+
+def normalize_query(query: Optional[str]) -> Optional[str]:
+    """
+    Full-text queries are analyzed by ES case-insensitively and split on whitespace,
+    so neither case nor extra spaces change the result.
+    """
+    if query is None:
+        return None
+    return " ".join(query.split()).lower() or None
+
+
+def normalize_sort(sort: Optional[str]) -> Optional[str]:
+    """`imdb_rating` and `+imdb_rating` are the same ascending sort."""
+    if sort is None:
+        return None
+    sort = sort.strip()
+    if sort.startswith("+"):
+        sort = sort[1:].strip()
+    return sort or None
+
+
+def params_digest(params: dict) -> str:
+    data = orjson.dumps(params, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).hexdigest()
+
+
+def cache_key(prefix: str, *parts: str, **params) -> str:
+    """
+    `cache_key("film_search", film_id)` -> "v1:film_search:<film_id>"
+    `cache_key("film_search", "search", query=..., page=...)` -> "v1:film_search:search:<digest>"
+
+    :param parts: readable key parts, such as a record id
+    :param params: request parameters, hashed into the last part of the key
+    """
+    key = ":".join((f"v{CACHE_KEY_VERSION}", prefix) + parts)
+    if params:
+        key = f"{key}:{params_digest(params)}"
+    return key
@@ -0,0 +1,34 @@
+"""
+Helpers for independent I/O inside one request.
+
+`gather` runs awaitables concurrently, optionally at most `limit` at a time,
+and cancels the rest as soon as one of them fails. Each of them, and so `gather`,
+gives up with 504 when the request deadline (see core.deadline) is spent.
+"""
+import asyncio
+from typing import Awaitable, List
+
+from core.deadline import with_deadline
+
+
+async def gather(*aws: Awaitable, limit: int = None) -> List:
+    """
+    Like asyncio.gather, but a failure cancels the calls that are still running,
+    and at most `limit` awaitables run at the same time.
+    """
+    semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def run(aw: Awaitable):
+        if semaphore is None:
+            return await with_deadline(aw)
+        async with semaphore:
+            return await with_deadline(aw)
+
+    tasks = [asyncio.ensure_future(run(aw)) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
@@ -1,24 +1,31 @@
+import logging
 from functools import lru_cache
-from typing import Optional, List, ClassVar
+from typing import AsyncIterator, Optional, List, ClassVar, Tuple
 
 import orjson
 from elasticsearch_dsl import Search, Q
 from fastapi import Depends
 
-from core.config import FILM_CACHE_EXPIRE, FILM_WORKS_INDEX
+from core.config import EXPORT_BATCH_SIZE, FILM_CACHE_EXPIRE, FILM_WORKS_INDEX
 from db.cache import Cache
 from db.current_cache import get_current_cache
 from db.current_storage import get_current_storage
-from db.storage import Storage
+from db.storage import SearchError, Storage
 from models.film import Film, FilmPreview
-from services.basic import BaseService
+from services.basic import BaseService, CachedResponse
+from services.cache_keys import cache_key, normalize_query, normalize_sort
+from services.invalidation import entity_tag, entity_tags, list_tag
+from services.pagination import Page, check_page_window, cursor_sort, decode_cursor
+
+logger = logging.getLogger(__name__)
 
 
 def create_query_search(query: str = None,
                         page: int = 1,
                         size: int = 10,
                         sort: str = None,
-                        genre: str = None) -> dict:
+                        genre: str = None,
+                        search_after: list = None) -> dict:
     s = Search()
     if query:
         multi_match_fields = (
@@ -30,6 +37,12 @@ def create_query_search(query: str = None,
     if genre:
         s = s.query("nested", path="genres",
                     query=Q("bool", filter=Q("term", genres__id=genre)))
+    if search_after is not None:
+        # Курсорная пагинация: страница после документа с указанными значениями сортировки.
+        s = s.sort(*cursor_sort(sort, scored=bool(query)))
+        if search_after:
+            s = s.extra(search_after=search_after)
+        return s[:size].to_dict()
     if sort:
         s = s.sort(sort)
 
@@ -37,8 +50,17 @@ def create_query_search(query: str = None,
     return s[start: start + size].to_dict()
 
 
+def create_query_export(genre: str = None) -> dict:
+    s = Search()
+    if genre:
+        s = s.query("nested", path="genres",
+                    query=Q("bool", filter=Q("term", genres__id=genre)))
+    return s.to_dict()
+
+
 class FilmService(BaseService):
     prefix = "film_search"
+    entity = "film"
 
     def __init__(self, model: ClassVar, cache: Cache, storage: Storage, cache_expire: int):
         self.model = model
@@ -46,16 +68,30 @@ class FilmService(BaseService):
         self.storage = storage
         self.cache_expire = cache_expire
 
+    def record_tags(self, film: Film) -> List[str]:
+        persons = {person.id for person in film.actors + film.writers + film.directors}
+        return ([entity_tag(self.entity, film.id)]
+                + entity_tags("person", sorted(persons))
+                + entity_tags("genre", [genre.id for genre in film.genres]))
+
     async def get_by_id(self, film_id: str) -> Optional[Film]:
-        key = f"{self.prefix}:{film_id}"
-        film = await self.get_record_from_cache(key)
+        key = cache_key(self.prefix, film_id)
+        film = await self.get_record_from_cache(key, self.cache_expire)
         if not film:
-            film = await self.storage.get(film_id)
-            if not film:
-                return None
-            await self.save_to_cache(key, film.json(), self.cache_expire)
+            film = await self.load_once(key, self._get_film_from_storage, key, film_id)
         return film
 
+    async def get_by_id_raw(self, film_id: str) -> Optional[bytes]:
+        """
+        JSON фильма в том виде, в котором он лежит в кеше: при попадании модель не создается.
+        """
+        key = cache_key(self.prefix, film_id)
+        data = await self.get_raw_from_cache(key, self.cache_expire)
+        if data is None:
+            film = await self.load_once(key, self._get_film_from_storage, key, film_id)
+            data = film.json().encode() if film else None
+        return data
+
     async def get_by_search(self,
                             query: str = None,
                             page: int = 1,
@@ -63,20 +99,102 @@ class FilmService(BaseService):
                             sort: str = None,
                             genre: str = None
                             ) -> List[FilmPreview]:
+        response = await self.get_by_search_raw(query, page, size, sort, genre)
+        return response.records(FilmPreview)
 
-        params = (query, page, size, sort, genre)
-        key = f"{self.prefix}:{str(params)}"
+    async def get_by_search_raw(self,
+                                query: str = None,
+                                page: int = 1,
+                                size: int = 10,
+                                sort: str = None,
+                                genre: str = None
+                                ) -> CachedResponse:
+        key, params = self._search_key(query, page, size, sort, genre)
+        return await self.get_response(key, self.cache_expire, self._get_films_from_storage, key, params)
 
-        films = await self.get_records_from_cache(key)
-        if not films:
-            search = create_query_search(*params)
-            films = await self.storage.search(search)
-            if not films:
-                return []
+    async def get_pages_raw(self, searches: List[dict]) -> List[Optional[CachedResponse]]:
+        """
+        Несколько страниц списка фильмов, параметры каждой - как у get_by_search_raw.
+        Кеш читается одним MGET, отсутствующие и устаревшие страницы ищутся одним msearch.
+        :return: страницы в порядке searches; на месте страницы, запрос которой не удался, None.
+        """
+        pages = [self._search_key(**search) for search in searches]
+        with self.lookup_span():
+            cached = await self.cache.get_many_objects([key for key, _ in pages], CachedResponse.loads,
+                                                       expire=self.cache_expire)
+            responses = {key: response for (key, _), response in zip(pages, cached)
+                         if response is not None and not response.stale}
+            missing = {key: params for key, params in pages if key not in responses}
+            self.count_lookups("hit", len(pages) - len(missing))
+            self.count_lookups("miss", len(missing))
+        if missing:
+            results = await self.storage.multi_search([create_query_search(*params) for params in missing.values()],
+                                                      model=FilmPreview)
+            loaded = {}
+            for key, result in zip(missing, results):
+                if isinstance(result, SearchError):
+                    logger.warning("Film list query %s failed: %s %s", key, result.type, result.reason)
+                    continue
+                loaded[key] = CachedResponse.from_search(result, FilmPreview)
+            await self.save_responses({key: response for key, response in loaded.items() if response.count},
+                                      self.cache_expire, [list_tag(self.entity)])
+            responses.update(loaded)
+        return [responses.get(key) for key, _ in pages]
+
+    async def get_by_cursor(self,
+                            query: str = None,
+                            cursor: str = "",
+                            size: int = 10,
+                            sort: str = None,
+                            genre: str = None
+                            ) -> Page:
+        response = await self.get_by_cursor_raw(query, cursor, size, sort, genre)
+        return response.page(FilmPreview)
+
+    async def get_by_cursor_raw(self,
+                                query: str = None,
+                                cursor: str = "",
+                                size: int = 10,
+                                sort: str = None,
+                                genre: str = None
+                                ) -> CachedResponse:
+        query, sort = normalize_query(query), normalize_sort(sort)
+        search = create_query_search(query, size=size, sort=sort, genre=genre, search_after=decode_cursor(cursor))
+        key = cache_key(self.prefix, "cursor", query=query, cursor=cursor, size=size, sort=sort, genre=genre)
+        return await self.get_page(key, self.storage, search, size, self.cache_expire, model=FilmPreview)
+
+    async def get_many(self, film_ids: List[str]) -> List[Film]:
+        return await self.get_records_by_ids(film_ids, self.cache_expire, self.storage.get_many)
+
+    async def export(self, fields: List[str], genre: str = None) -> AsyncIterator[bytes]:
+        """
+        Выгрузка всех фильмов в формате NDJSON: одна строка - один фильм с полями fields.
+        Документы сериализуются по пачке за раз, поэтому память не зависит от размера каталога.
+        """
+        async for batch in self.storage.scan(create_query_export(genre), EXPORT_BATCH_SIZE, source=fields):
+            yield b"".join(orjson.dumps(doc) + b"\n" for doc in batch)
+
+    def _search_key(self, query: str = None, page: int = 1, size: int = 10, sort: str = None,
+                    genre: str = None) -> Tuple[str, tuple]:
+        check_page_window(page, size)
+        query, sort = normalize_query(query), normalize_sort(sort)
+        key = cache_key(self.prefix, "search", query=query, page=page, size=size, sort=sort, genre=genre)
+        return key, (query, page, size, sort, genre)
+
+    async def _get_film_from_storage(self, key: str, film_id: str) -> Optional[Film]:
+        film = await self.storage.get(film_id)
+        if not film:
+            return None
+        await self.save_to_cache(key, film.json(), self.cache_expire, self.record_tags(film))
+        return film
 
-            data = orjson.dumps([f.dict() for f in films], default=str)
-            await self.save_to_cache(key, data, self.cache_expire)
-        return films
+    async def _get_films_from_storage(self, key: str, params: tuple) -> CachedResponse:
+        search = create_query_search(*params)
+        result = await self.storage.search_page(search, model=FilmPreview)
+        response = CachedResponse.from_search(result, FilmPreview)
+        if not result.items:
+            return response
+        return await self.save_response(key, response, self.cache_expire, [list_tag(self.entity)])
 
 
 @lru_cache()
@@ -1,22 +1,49 @@
+import asyncio
+import logging
+import time
 from functools import lru_cache
-from typing import Optional, List, Tuple, ClassVar
+from typing import Optional, List, Tuple, ClassVar, Dict
 
 from fastapi import Depends
-import orjson
 from elasticsearch_dsl import Search, Q
 
-from core.config import GENRE_CACHE_EXPIRE, GENRE_POPULARITY_CACHE_EXPIRE, GENRES_INDEX, FILM_WORKS_INDEX
+from core.config import (GENRE_CACHE_EXPIRE, GENRE_POPULARITY_CACHE_EXPIRE, GENRES_INDEX, FILM_WORKS_INDEX,
+                         GENRES_MAX_COUNT)
 from db.current_cache import get_current_cache
 from db.current_storage import get_current_storage
 from db.cache import Cache
-from db.storage import Storage
+from db.storage import SearchPage, Storage
 from models.genre import Genre
 from models.film import Film
-from services.basic import BaseService
+from services.basic import BaseService, CachedResponse
+from services.cache_keys import cache_key, normalize_query, normalize_sort
+from services.concurrency import gather
+from services.invalidation import list_tag
+from services.pagination import Page, check_page_window, cursor_sort, decode_cursor
+
+logger = logging.getLogger(__name__)
+
+
+def create_genres_popularity_query(genre_ids: List[str] = None) -> dict:
+    """
+    Запрос на количество фильмов по каждому жанру одной агрегацией.
+    reverse_nested считает фильмы, а не вложенные документы жанров.
+    Без genre_ids считает популярность всех жанров.
+    """
+    s = Search()
+    terms = {"field": "genres.id", "size": len(genre_ids) if genre_ids else GENRES_MAX_COUNT}
+    if genre_ids:
+        s = s.query(Q("nested", path="genres", query=Q("terms", genres__id=genre_ids)))
+        terms["include"] = genre_ids
+    s.aggs.bucket("genres", "nested", path="genres") \
+        .bucket("ids", "terms", **terms) \
+        .bucket("films", "reverse_nested")
+    return s.to_dict()
 
 
 class GenreService(BaseService):
     prefix = "genres"
+    entity = "genre"
 
     def __init__(self, model: ClassVar, cache: Cache, storage: Storage, film_storage: Storage,
                  cache_expire: int, genre_popularity_cache_expire: int):
@@ -32,91 +59,190 @@ class GenreService(BaseService):
         genre = await self._get_genre_from_cache(genre_id)
         if not genre:
             # Если жанра нет в кэше, то ищем его в хранилище.
-            genre = await self._get_genre_from_storage(genre_id)
-            if not genre:
-                # Если он отсутствует в хранилище, значит, жанра вообще нет в базе.
-                return None
-            # Сохраняем жанр в кеш.
-            await self._put_genre_to_cache(genre)
+            # Одновременные промахи по одному жанру ждут один запрос.
+            genre = await self.load_once(cache_key(self.prefix, genre_id), self._load_genre, genre_id)
         return genre
 
+    async def get_many(self, genre_ids: List[str]) -> List[Genre]:
+        return await self.get_records_by_ids(genre_ids, self.cache_expire, self.storage.get_many)
+
     async def get_by_search(self,
                             query: str = None,
                             page: int = 1,
                             size: int = 10,
                             sort: str = None,
                             ) -> List[Genre]:
+        response = await self.get_by_search_raw(query, page, size, sort)
+        return response.records(Genre)
 
+    async def get_by_search_raw(self,
+                                query: str = None,
+                                page: int = 1,
+                                size: int = 10,
+                                sort: str = None,
+                                ) -> CachedResponse:
+        check_page_window(page, size)
+        query, sort = normalize_query(query), normalize_sort(sort)
         params = (query, page, size, sort)
-        genres = await self._get_genres_from_cache(str(params))
+        key = cache_key(self.prefix, "search", query=query, page=page, size=size, sort=sort)
+        return await self.get_response(key, self.cache_expire, self._load_genres, key, params)
 
-        if not genres:
-            genres = await self._get_genres_from_storage(params)
-            if not genres:
-                return []
+    async def get_by_cursor(self,
+                            query: str = None,
+                            cursor: str = "",
+                            size: int = 10,
+                            sort: str = None,
+                            ) -> Page:
+        response = await self.get_by_cursor_raw(query, cursor, size, sort)
+        return response.page(Genre)
 
-            data = orjson.dumps([f.dict() for f in genres], default=str)
-            await self._put_genres_to_cache(str(params), data)
-        return genres
+    async def get_by_cursor_raw(self,
+                                query: str = None,
+                                cursor: str = "",
+                                size: int = 10,
+                                sort: str = None,
+                                ) -> CachedResponse:
+        query, sort = normalize_query(query), normalize_sort(sort)
+        search = GenreService._create_query_search(query, size=size, sort=sort, search_after=decode_cursor(cursor))
+        key = cache_key(self.prefix, "cursor", query=query, cursor=cursor, size=size, sort=sort)
+        return await self.get_page(key, self.storage, search, size, self.cache_expire)
 
     async def get_genre_popularity(self, genre_id: str) -> int:
         popularity = await self._get_genre_popularity_from_cache(genre_id)
-        if not popularity:
-            popularity = await self._get_genre_popularity_from_storage(genre_id)
-            await self._put_genre_popularity_to_cache(str(genre_id), popularity)
+        if popularity is None:
+            popularity = await self.load_once(self._popularity_key(genre_id),
+                                              self._load_genre_popularity, genre_id)
+        return popularity
+
+    async def get_with_popularity(self, genre_id: str) -> Tuple[Optional[Genre], int]:
+        """
+        Жанр и его популярность. Популярность считается по идентификатору, поэтому при промахе
+        оба запроса к хранилищу выполняются одновременно, а в кэш она попадает, только если жанр существует.
+        """
+        popularity = await self._get_genre_popularity_from_cache(genre_id)
+        if popularity is not None:
+            return await self.get_by_id(genre_id), popularity
+        return await self.load_once(cache_key(self.prefix, "with_popularity", genre_id),
+                                    self._load_genre_with_popularity, genre_id)
+
+    async def get_genres_popularity(self, genre_ids: List[str]) -> Dict[str, int]:
+        """
+        Популярность нескольких жанров: одно чтение из кэша (MGET) и,
+        для отсутствующих в кэше, одна агрегация в хранилище.
+        """
+        keys = [self._popularity_key(genre_id) for genre_id in genre_ids]
+        with self.lookup_span():
+            cached = await self.cache.get_many_objects(keys, int, expire=self.genre_popularity_cache_expire)
+            popularity = {genre_id: value for genre_id, value in zip(genre_ids, cached) if value is not None}
+            missing = [genre_id for genre_id in genre_ids if genre_id not in popularity]
+            self.count_lookups("hit", len(popularity))
+            self.count_lookups("miss", len(missing))
+
+        if missing:
+            started = time.time()
+            loaded = await self._get_genres_popularity_from_storage(missing)
+            await self._put_genres_popularity_to_cache(loaded, self.genre_popularity_cache_expire, started)
+            popularity.update(loaded)
+        return popularity
+
+    async def refresh_genres_popularity(self, expire: int, genre_ids: List[str] = None) -> Dict[str, int]:
+        """
+        Пересчитывает популярность всех жанров (или жанров genre_ids) одной агрегацией и сохраняет её в кэш.
+        Для переданных genre_ids сохраняется и нулевая популярность.
+        """
+        started = time.time()
+        popularity = await self._get_genres_popularity_from_storage(genre_ids)
+        await self._put_genres_popularity_to_cache(popularity, expire, started)
         return popularity
 
+    async def _load_genre(self, genre_id: str) -> Optional[Genre]:
+        genre = await self._get_genre_from_storage(genre_id)
+        if not genre:
+            # Если он отсутствует в хранилище, значит, жанра вообще нет в базе.
+            return None
+        # Сохраняем жанр в кеш.
+        await self._put_genre_to_cache(genre)
+        return genre
+
+    async def _load_genres(self, key: str, params: Tuple) -> CachedResponse:
+        result = await self._get_genres_from_storage(params)
+        response = CachedResponse.from_search(result, Genre)
+        if not result.items:
+            return response
+        return await self.save_response(key, response, self.cache_expire, [list_tag(self.entity)])
+
+    async def _load_genre_with_popularity(self, genre_id: str) -> Tuple[Optional[Genre], int]:
+        genre, popularity = await gather(self.get_by_id(genre_id),
+                                         self._get_genres_popularity_from_storage([genre_id]))
+        if genre:
+            await self._put_genre_popularity_to_cache(genre_id, popularity[genre_id])
+        return genre, popularity[genre_id]
+
+    async def _load_genre_popularity(self, genre_id: str) -> int:
+        popularity = await self._get_genres_popularity_from_storage([genre_id])
+        await self._put_genre_popularity_to_cache(str(genre_id), popularity[genre_id])
+        return popularity[genre_id]
+
     async def _get_genre_from_storage(self, genre_id: str) -> Optional[Genre]:
         return await self.storage.get(genre_id)
 
-    async def _get_genres_from_storage(self, params: Tuple) -> List[Genre]:
+    async def _get_genres_from_storage(self, params: Tuple) -> SearchPage:
         search = GenreService._create_query_search(*params)
-        return await self.storage.search(search)
+        return await self.storage.search_page(search)
 
-    async def _get_genre_popularity_from_storage(self, genre_id: str) -> int:
-        s = Search()
-        s = s.query(Q("nested", path="genres", query=Q("match", genres__id=genre_id)))
-        return await self.film_storage.count(s.to_dict())
+    async def _get_genres_popularity_from_storage(self, genre_ids: List[str] = None) -> Dict[str, int]:
+        aggs = await self.film_storage.aggregate(create_genres_popularity_query(genre_ids))
+        buckets = aggs.get("genres", {}).get("ids", {}).get("buckets", [])
+        popularity = dict.fromkeys(genre_ids or [], 0)
+        popularity.update({bucket["key"]: bucket["films"]["doc_count"] for bucket in buckets})
+        return popularity
 
     async def _get_genre_from_cache(self, genre_id: str) -> Optional[Genre]:
         # Пытаемся получить данные из кеша.
-        key = f"{self.prefix}:{genre_id}"
-        return await self.get_record_from_cache(key)
-
-    async def _get_genres_from_cache(self, params: str) -> Optional[Genre]:
-        key = f"{self.prefix}:{params}"
-        return await self.get_records_from_cache(key)
+        key = cache_key(self.prefix, genre_id)
+        return await self.get_record_from_cache(key, self.cache_expire)
 
-    async def _get_genre_popularity_from_cache(self, genre_id: str) -> int:
-        key = f"{self.prefix}:popularity:{genre_id}"
-        return await self.get_custom_data_from_cache(key)
+    async def _get_genre_popularity_from_cache(self, genre_id: str) -> Optional[int]:
+        key = self._popularity_key(genre_id)
+        return await self.get_custom_data_from_cache(key, self.genre_popularity_cache_expire, loads=int)
 
     async def _put_genre_to_cache(self, genre: Genre):
         # Сохраняем данные в кэш.
         # Выставляем время жизни кеша.
         # pydantic позволяет сериализовать модель в json.
-        key = f"{self.prefix}:{genre.id}"
-        await self.save_to_cache(key, genre.json(), self.cache_expire)
-
-    async def _put_genres_to_cache(self, params: str, genres):
-        key = f"{self.prefix}:{params}"
-        await self.save_to_cache(key, genres, self.cache_expire)
+        key = cache_key(self.prefix, genre.id)
+        await self.save_to_cache(key, genre.json(), self.cache_expire, self.record_tags(genre))
 
     async def _put_genre_popularity_to_cache(self, genre_id: str, popularity: int):
-        key = f"{self.prefix}:popularity:{genre_id}"
-        await self.save_to_cache(key, str(popularity), self.genre_popularity_cache_expire)
+        key = self._popularity_key(genre_id)
+        # Популярность зависит от фильмов жанра, поэтому сбрасывается при изменении любого фильма.
+        await self.save_to_cache(key, str(popularity), self.genre_popularity_cache_expire, [list_tag("film")])
+
+    async def _put_genres_popularity_to_cache(self, popularity: Dict[str, int], expire: int, since: float):
+        values = {self._popularity_key(genre_id): str(count) for genre_id, count in popularity.items()}
+        await self.cache.set_many(values, expire=expire)
+        await self.cache.add_tags(dict.fromkeys(values, [list_tag("film")]), expire=expire, since=since)
+
+    def _popularity_key(self, genre_id: str) -> str:
+        return cache_key(self.prefix, "popularity", genre_id)
 
     @staticmethod
     def _create_query_search(query: str = None,
                              page: int = 1,
                              size: int = 10,
-                             sort: str = None) -> dict:
+                             sort: str = None,
+                             search_after: list = None) -> dict:
         s = Search()
         if query:
             multi_match_fields = (
                 "name", "description",
             )
             s = s.query("multi_match", query=query, fields=multi_match_fields)
+        if search_after is not None:
+            s = s.sort(*cursor_sort(sort, scored=bool(query)))
+            if search_after:
+                s = s.extra(search_after=search_after)
+            return s[:size].to_dict()
         if sort:
             s = s.sort(sort)
         start = (page - 1) * size
@@ -130,3 +256,22 @@ def get_genre_service(
         films_storage: Storage = Depends(get_current_storage(model=Film, index=FILM_WORKS_INDEX))
 ) -> GenreService:
     return GenreService(Genre, cache, storage, films_storage, GENRE_CACHE_EXPIRE, GENRE_POPULARITY_CACHE_EXPIRE)
+
+
+async def refresh_genres_popularity_periodically(interval: int):
+    """
+    Фоновая задача: держит в кэше заранее посчитанную таблицу жанр -> популярность.
+    Записи живут дольше периода обновления, поэтому запросы не попадают в хранилище.
+    """
+    service = GenreService(Genre, get_current_cache(),
+                           get_current_storage(model=Genre, index=GENRES_INDEX),
+                           get_current_storage(model=Film, index=FILM_WORKS_INDEX),
+                           GENRE_CACHE_EXPIRE, GENRE_POPULARITY_CACHE_EXPIRE)
+    expire = max(GENRE_POPULARITY_CACHE_EXPIRE, 2 * interval)
+    while True:
+        try:
+            popularity = await service.refresh_genres_popularity(expire)
+            logger.debug("Genres popularity refreshed for %d genres", len(popularity))
+        except Exception:
+            logger.exception("Failed to refresh genres popularity")
+        await asyncio.sleep(interval)
@@ -0,0 +1,126 @@
+"""
+Event-driven cache invalidation.
+
+After writing changed documents to ES the ETL publishes a JSON message
+to the CACHE_INVALIDATION_CHANNEL Redis channel:
+
+    {"type": "film", "ids": ["<uuid>", ...]}
+
+where type is one of "film", "person" or "genre". Every cached value is tagged
+at write time (see `BaseService.save_to_cache`):
+
+* a record and responses built from it get `<type>:<id>` of every entity they show,
+  e.g. film details are tagged with the film, its persons and genres;
+* search and list responses get `list:<type>`, since any change may move documents
+  in or out of them.
+
+An event deletes everything tagged with the changed ids and all lists of that type.
+Values are rebuilt on the next request. Relations are not inferred:
+when a film gets a new actor, the ETL sends events for both the film and the person.
+
+Deleted keys leave their tag sets, so every key is handed to the one worker that deletes it.
+That worker publishes the keys to the same channel, and every worker drops its local copies:
+
+    {"evict": ["<cache key>", ...]}
+
+While Redis fails, an event is retried for up to CACHE_INVALIDATION_RETRY_TIME seconds,
+then logged and dropped. Pub/sub has no replay: events published while a worker is
+resubscribing after a lost connection never reach it. In both cases the affected values
+stay stale until their TTL expires.
+"""
+import asyncio
+import logging
+from typing import Iterable, List
+
+import backoff
+import orjson
+
+from core.config import BACKOFF_FACTOR, CACHE_INVALIDATION_CHANNEL, CACHE_INVALIDATION_RETRY_TIME
+from db.cache import Cache
+from db.current_cache import get_current_cache
+
+logger = logging.getLogger(__name__)
+
+ENTITIES = ("film", "person", "genre")
+RESUBSCRIBE_DELAY = 1
+
+# Retries a failed step of event handling; a malformed message is not retried.
+retry = backoff.on_exception(backoff.expo,
+                             Exception,
+                             max_time=lambda: CACHE_INVALIDATION_RETRY_TIME,
+                             factor=BACKOFF_FACTOR,
+                             giveup=lambda error: isinstance(error, ValueError))
+
+
+def entity_tag(entity: str, entity_id: str) -> str:
+    return f"{entity}:{entity_id}"
+
+
+def entity_tags(entity: str, entity_ids: Iterable[str]) -> List[str]:
+    return [entity_tag(entity, entity_id) for entity_id in entity_ids]
+
+
+def list_tag(entity: str) -> str:
+    return f"list:{entity}"
+
+
+def event_tags(event: dict) -> List[str]:
+    """
+    Tags affected by the change event.
+    :raise ValueError: if the event is malformed
+    """
+    if not isinstance(event, dict) or event.get("type") not in ENTITIES:
+        raise ValueError(f"unknown event: {event!r}")
+    entity = event["type"]
+    ids = event.get("ids", [])
+    if not isinstance(ids, list):
+        raise ValueError(f"ids must be a list: {event!r}")
+    return [list_tag(entity)] + entity_tags(entity, map(str, ids))
+
+
+def eviction_message(keys: List[str]) -> bytes:
+    return orjson.dumps({"evict": keys})
+
+
+async def handle_event(cache: Cache, message: bytes) -> List[str]:
+    """
+    Drops values affected by one event, or local copies of the keys in an eviction message.
+    :return: deleted keys, to be sent to other workers in an eviction message
+    :raise ValueError: if the message is malformed
+    """
+    event = orjson.loads(message)
+    if isinstance(event, dict) and "evict" in event:
+        if not isinstance(event["evict"], list):
+            raise ValueError(f"evict must be a list: {event!r}")
+        for key in event["evict"]:
+            cache.evict_local(str(key))
+        return []
+    tags = event_tags(event)
+    keys = await cache.invalidate_tags(tags)
+    logger.debug("Invalidated %d cache keys for %s", len(keys), tags)
+    return keys
+
+
+async def consume_invalidation_events(channel_name: str = CACHE_INVALIDATION_CHANNEL):
+    """
+    Background task: listens for change events and invalidates the cache.
+    Every worker subscribes, so workers with a local cache tier drop their copies too.
+    """
+    cache = get_current_cache()
+    while True:
+        try:
+            channel, = await cache.client.subscribe(channel_name)
+            async for message in channel.iter():
+                try:
+                    keys = await retry(handle_event)(cache, message)
+                    if keys:
+                        # Retried on its own: the keys have left the tag sets and would not be found again.
+                        await retry(cache.client.publish)(channel_name, eviction_message(keys))
+                except ValueError:
+                    logger.warning("Malformed cache invalidation event: %r", message)
+                except Exception:
+                    logger.exception("Cache invalidation event dropped: %r", message)
+        except Exception:
+            logger.exception("Cache invalidation consumer failed")
+        # The channel is closed when the connection is lost: subscribe again.
+        await asyncio.sleep(RESUBSCRIBE_DELAY)
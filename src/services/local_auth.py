@@ -0,0 +1,122 @@
+"""
+Local verification of JWT access tokens, so role checks don't need the auth service.
+"""
+import asyncio
+import logging
+import time
+from http import HTTPStatus
+from typing import Optional, Tuple, Union
+
+import aiohttp
+import orjson
+from jose import jwt
+from jose.exceptions import ExpiredSignatureError, JWTClaimsError, JWTError
+
+from core.config import (AUTH_JWKS_REFRESH, AUTH_JWKS_URL, AUTH_JWT_ALGORITHMS, AUTH_JWT_AUDIENCE,
+                         AUTH_JWT_KEY_FILE, AUTH_JWT_ROLES_CLAIM)
+
+logger = logging.getLogger(__name__)
+
+
+class KeyStore:
+    """
+    Public keys for token verification: a PEM key or a JWKS document from a file,
+    or a JWKS fetched from the auth service and refreshed every `refresh` seconds.
+    A token signed with an unknown `kid` triggers an early refresh, at most once a minute.
+    """
+    min_refresh = 60
+
+    def __init__(self, key_file: str = None, jwks_url: str = None, refresh: int = 3600):
+        self.key_file = key_file
+        self.jwks_url = jwks_url
+        self.refresh_interval = refresh
+        self.keys: Union[str, dict, None] = None
+        self.loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get_key(self, kid: Optional[str], session: aiohttp.ClientSession) -> Union[str, dict, None]:
+        if self.keys is None or self._age() > self.refresh_interval:
+            await self.refresh(session)
+        key = self._find(kid)
+        if key is None and self.jwks_url and self._age() > self.min_refresh:
+            await self.refresh(session)
+            key = self._find(kid)
+        return key
+
+    async def refresh(self, session: aiohttp.ClientSession):
+        loaded_at = self.loaded_at
+        async with self._lock:
+            if self.loaded_at != loaded_at:
+                # Someone else has just refreshed keys.
+                return
+            try:
+                self.keys = await self._load(session)
+            except (OSError, ValueError, aiohttp.ClientError, asyncio.TimeoutError):
+                logger.exception("Failed to load keys for token verification")
+            # Failed attempts are not retried on every request either.
+            self.loaded_at = time.monotonic()
+
+    async def _load(self, session: aiohttp.ClientSession) -> Union[str, dict, None]:
+        if self.key_file:
+            with open(self.key_file) as f:
+                content = f.read()
+            return orjson.loads(content) if content.lstrip().startswith("{") else content
+        if self.jwks_url:
+            async with session.get(self.jwks_url) as response:
+                response.raise_for_status()
+                return await response.json()
+        return None
+
+    def _find(self, kid: Optional[str]) -> Union[str, dict, None]:
+        if not isinstance(self.keys, dict):
+            return self.keys
+        keys = self.keys.get("keys", [self.keys])
+        if kid is None:
+            return keys[0] if len(keys) == 1 else None
+        return next((key for key in keys if key.get("kid") == kid), None)
+
+    def _age(self) -> float:
+        return time.monotonic() - self.loaded_at
+
+
+key_store = KeyStore(AUTH_JWT_KEY_FILE, AUTH_JWKS_URL, AUTH_JWKS_REFRESH)
+
+
+def get_claim(claims: dict, path: str):
+    for name in path.split("."):
+        if not isinstance(claims, dict):
+            return None
+        claims = claims.get(name)
+    return claims
+
+
+async def verify_token(token: str, roles: Tuple[str, ...],
+                       session: aiohttp.ClientSession) -> Optional[HTTPStatus]:
+    """
+    Checks signature, expiry and roles of the token.
+    :return: verdict in terms of the auth service (200, 401 or 403)
+             or None if there is no key to verify the token with.
+    """
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+    except JWTError:
+        return HTTPStatus.UNAUTHORIZED
+
+    key = await key_store.get_key(kid, session)
+    if key is None:
+        return None
+
+    try:
+        claims = jwt.decode(token, key,
+                            algorithms=AUTH_JWT_ALGORITHMS,
+                            audience=AUTH_JWT_AUDIENCE,
+                            options={"verify_aud": AUTH_JWT_AUDIENCE is not None})
+    except (ExpiredSignatureError, JWTClaimsError, JWTError):
+        return HTTPStatus.UNAUTHORIZED
+
+    token_roles = get_claim(claims, AUTH_JWT_ROLES_CLAIM) or ()
+    if isinstance(token_roles, str):
+        token_roles = (token_roles,)
+    if set(token_roles) & set(roles):
+        return HTTPStatus.OK
+    return HTTPStatus.FORBIDDEN
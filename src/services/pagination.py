@@ -0,0 +1,91 @@
+"""
+Cursor pagination on top of ES search_after.
+
+A cursor is the opaque, url-safe encoding of sort values of the last document on a page.
+Cursor pages are always sorted with a unique tiebreaker, so every document is returned exactly once.
+"""
+import base64
+import binascii
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import List, Optional, Union
+
+import orjson
+from fastapi import HTTPException
+
+from core.config import ES_MAX_RESULT_WINDOW
+
+# Уникальное поле для однозначной сортировки: keyword во всех индексах (сортировка по _id требует fielddata)
+TIEBREAKER = "id"
+# Подстановка для документов без значения поля сортировки. По умолчанию ES отдает для них ±Infinity,
+# которые в JSON курсора превращаются в null и ломают search_after. Документы без значения идут последними.
+# Рейтинг IMDB лежит в диапазоне от 0 до 10: 11 больше любого рейтинга, -1 меньше любого, поэтому подстановка
+# не совпадает ни с одним настоящим значением и ставит фильмы без рейтинга в конец при любом направлении.
+MISSING_SORT_VALUES = {"imdb_rating": {"asc": 11.0, "desc": -1.0}}
+
+
+@dataclass
+class Page:
+    items: list
+    next_cursor: Optional[str] = None
+
+
+def encode_cursor(sort_values: list) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps(sort_values)).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    """
+    Empty cursor means the first page, anything else must be produced by `encode_cursor`.
+    """
+    if not cursor:
+        return []
+    try:
+        values = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        values = None
+    if not isinstance(values, list) or not values:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Malformed cursor")
+    return values
+
+
+def sort_clause(sort: str) -> Union[str, dict]:
+    """
+    `-field` is a descending sort. Fields that may be missing get a finite substitute,
+    so every sort value fits a cursor.
+    """
+    field, order = (sort[1:], "desc") if sort.startswith("-") else (sort, "asc")
+    missing = MISSING_SORT_VALUES.get(field)
+    if missing is None:
+        return sort
+    return {field: {"order": order, "missing": missing[order]}}
+
+
+def cursor_sort(sort: Optional[str], scored: bool) -> List[Union[str, dict]]:
+    """
+    Sort for cursor pages: requested order (or relevance for full-text queries) and the tiebreaker.
+    """
+    if sort:
+        return [sort_clause(sort), TIEBREAKER]
+    if scored:
+        return ["_score", TIEBREAKER]
+    return [TIEBREAKER]
+
+
+def next_cursor(items: list, size: int, last_sort: Optional[list]) -> Optional[str]:
+    if len(items) < size or not last_sort:
+        return None
+    return encode_cursor(last_sort)
+
+
+def page_count(total: int, size: int) -> int:
+    """
+    Number of pages reachable with page numbers: deeper pages are only available with a cursor.
+    """
+    return min(-(-total // size), ES_MAX_RESULT_WINDOW // size)
+
+
+def check_page_window(page: int, size: int):
+    if page * size > ES_MAX_RESULT_WINDOW:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
+                            detail=f"Page is too deep, use cursor pagination after {ES_MAX_RESULT_WINDOW} items")
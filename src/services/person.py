@@ -1,41 +1,64 @@
+import logging
 from functools import lru_cache
-from typing import ClassVar, List, Optional
+from http import HTTPStatus
+from typing import ClassVar, Dict, List, Optional
 
-import orjson
 from elasticsearch_dsl import Q, Search
-from fastapi import Depends
+from fastapi import Depends, HTTPException
 
-from core.config import FILM_CACHE_EXPIRE, FILM_WORKS_INDEX, PERSONS_INDEX, PERSON_CACHE_EXPIRE
+from core.config import (ES_MAX_RESULT_WINDOW, FILM_CACHE_EXPIRE, FILM_WORKS_INDEX, PERSONS_INDEX,
+                         PERSON_CACHE_EXPIRE, PERSON_FILMS_LIMIT)
 from db.cache import Cache
 from db.current_cache import get_current_cache
 from db.current_storage import get_current_storage
-from db.storage import Storage
-from models.film import Film, FilmPreview
+from db.storage import SearchError, Storage
+from models.film import Film, FilmPreview, FilmRoles
 from models.person import BasePerson, Person
-from services.basic import BaseService
+from services.basic import BaseService, CachedResponse
+from services.cache_keys import cache_key, normalize_query
+from services.concurrency import gather
+from services.invalidation import entity_tag, entity_tags, list_tag
+from services.pagination import Page, check_page_window, cursor_sort, decode_cursor
 
+logger = logging.getLogger(__name__)
 
-def create_person_films_query(person_id: str, role: str) -> dict:
-    """Create query for ElasticSearch to get films where person occupied given role"""
+ROLES = ("writer", "director", "actor")
+
+
+def create_person_films_query(person_id: str) -> dict:
+    """
+    Create query for ElasticSearch to get up to PERSON_FILMS_LIMIT films where the person occupied any role.
+    Films are returned in index order, so roles of the person keep a stable order.
+    """
     s = Search()
-    q = s.query(Q("nested", path=f"{role}s", query=Q("match", **{f"{role}s.id": person_id})))
-    return q.to_dict()
+    q = s.query(Q("bool", should=[
+        Q("nested", path=f"{role}s", query=Q("term", **{f"{role}s.id": person_id}))
+        for role in ROLES
+    ]))
+    return q.sort("_doc")[:min(PERSON_FILMS_LIMIT, ES_MAX_RESULT_WINDOW)].to_dict()
 
 
 def create_person_search_query(query: str,
                                page: int = 1,
-                               page_size: int = 5) -> dict:
+                               page_size: int = 5,
+                               search_after: list = None) -> dict:
     """
     Create query for ElasticSearch to get persons by search string
     :param query: string to search in full names
     :param page: page number
     :param page_size: page size
+    :param search_after: sort values of the previous page last person, switches to cursor pagination
     :return: dict with ES query params
     """
     s = Search()
     start = (page - 1) * page_size
     if query:
         s = s.query("match", full_name=query)
+    if search_after is not None:
+        s = s.sort(*cursor_sort(None, scored=bool(query)))
+        if search_after:
+            s = s.extra(search_after=search_after)
+        return s[:page_size].to_dict()
     s = s[start:start + page_size].to_dict()
     return s
 
@@ -56,6 +79,7 @@ def create_films_by_person_query(person_id):
 
 class PersonService(BaseService):
     prefix = "person_search"
+    entity = "person"
 
     def __init__(self, model: ClassVar, cache: Cache, storage: Storage, film_storage: Storage):
         self.model = model
@@ -63,43 +87,83 @@ class PersonService(BaseService):
         self.storage = storage
         self.film_storage = film_storage
 
+    def record_tags(self, person: Person) -> List[str]:
+        films = dict.fromkeys(film.id for film in person.films)
+        return [entity_tag(self.entity, person.id)] + entity_tags("film", films)
+
     async def get_by_id(self, person_id: str) -> Optional[Person]:
-        person = await self.get_record_from_cache(f"{self.prefix}:{person_id}")
+        key = cache_key(self.prefix, person_id)
+        person = await self.get_record_from_cache(key, PERSON_CACHE_EXPIRE)
         if not person:
-            person = await self._person_from_storage(person_id)
-            if not person:
-                return None
-            await self.save_to_cache(f"{self.prefix}:{person.id}", person.json(), expire=PERSON_CACHE_EXPIRE)
+            person = await self.load_once(key, self._load_person, key, person_id)
         return person
 
+    async def get_by_id_raw(self, person_id: str) -> Optional[bytes]:
+        """
+        Get person JSON as it is kept in the cache, no model is built on a hit
+        """
+        key = cache_key(self.prefix, person_id)
+        data = await self.get_raw_from_cache(key, PERSON_CACHE_EXPIRE)
+        if data is None:
+            person = await self.load_once(key, self._load_person, key, person_id)
+            data = person.json().encode() if person else None
+        return data
+
+    async def _load_person(self, key: str, person_id: str) -> Optional[Person]:
+        person = await self._person_from_storage(person_id)
+        if not person:
+            return None
+        await self.save_to_cache(key, person.json(), PERSON_CACHE_EXPIRE, self.record_tags(person))
+        return person
+
+    async def get_many(self, person_ids: List[str]) -> List[Person]:
+        return await self.get_records_by_ids(person_ids, PERSON_CACHE_EXPIRE, self._persons_from_storage)
+
     async def _person_from_storage(self, person_id: str) -> Optional[Person]:
-        person = await self.storage.get(person_id)
+        # Films are found by person id, so both requests go to ES at once.
+        person, filmworks = await gather(self.storage.get(person_id), self._get_filmworks([person_id]))
         if not person:
             return None
-        person = person.dict()
-        person["films"] = await self._get_filmworks(person_id)
-        return Person.parse_obj(person)
+        return Person(**person.dict(), films=filmworks[person_id])
 
-    async def _get_filmworks(self, person_id: str) -> Optional[List[dict]]:
+    async def _persons_from_storage(self, person_ids: List[str]) -> List[Person]:
+        persons, filmworks = await gather(self.storage.get_many(person_ids), self._get_filmworks(person_ids))
+        return [Person(**person.dict(), films=filmworks[person.id]) for person in persons if person]
+
+    async def _add_filmworks(self, persons: List[BasePerson]) -> List[Person]:
         """
-        Find films which given person did create
-        :param person_id:
-        :return: List[dict]
+        Turn BasePerson instances into Person with their films.
+        All roles of all given persons are resolved with a single ES round trip (_msearch).
         """
-        roles = ("writer", "director", "actor")
-        all_films = []
-        for role in roles:
-            films = await self._get_filmworks_by_person_job(person_id, role)
-            films = [{"id": film.id, "role": role} for film in films]
-            all_films.extend(films)
-        return all_films
-
-    async def _get_filmworks_by_person_job(self, person_id: str, role: str) -> Optional[List[Film]]:
-        query = create_person_films_query(person_id, role)
-        films = await self.film_storage.search(query)
-        return films or []
+        filmworks = await self._get_filmworks([person.id for person in persons])
+        return [Person(**person.dict(), films=filmworks[person.id]) for person in persons]
 
-    async def search(self, query: str, page: int, page_size: int) -> Optional[List[Person]]:
+    async def _get_filmworks(self, person_ids: List[str]) -> Dict[str, List[dict]]:
+        """
+        Find films which given persons did create
+        :param person_ids: list of persons uuid
+        :return: dict person_id -> list of {"id": film_id, "role": role}, roles go in ROLES order
+        """
+        person_ids = list(dict.fromkeys(person_ids))
+        if not person_ids:
+            return {}
+        # One query per person, so a prolific person does not use up the films limit of the others.
+        results = await self.film_storage.multi_search([create_person_films_query(person_id)
+                                                        for person_id in person_ids], model=FilmRoles)
+        filmworks = {}
+        for person_id, result in zip(person_ids, results):
+            if isinstance(result, SearchError):
+                logger.warning("Films of person %s were not found: %s %s", person_id, result.type, result.reason)
+                raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail="Person films query failed")
+            roles = {role: [] for role in ROLES}
+            for film in result.items:
+                for role in ROLES:
+                    if any(participant.id == person_id for participant in getattr(film, f"{role}s")):
+                        roles[role].append({"id": film.id, "role": role})
+            filmworks[person_id] = [film for role in ROLES for film in roles[role]]
+        return filmworks
+
+    async def search(self, query: str, page: int, page_size: int) -> List[Person]:
         """
         Search persons by name
         :param query: query string to search in full names
@@ -107,16 +171,56 @@ class PersonService(BaseService):
         :param page_size: page size
         :return: paginated list of persons who match the query
         """
-        query = create_person_search_query(query, page, page_size)
-        persons = await self.get_records_from_cache(f"{self.prefix}:{query}")
-        if not persons:
-            persons = await self.storage.search(query)
-            persons = [await self.get_by_id(p.id) for p in persons]  # get Person instances from BasePerson
-            serialized_persons = orjson.dumps([p.dict() for p in persons], default=str)
-            await self.save_to_cache(f"{self.prefix}:{query}", serialized_persons, PERSON_CACHE_EXPIRE)
-        if not persons:
-            return []
-        return persons
+        response = await self.search_raw(query, page, page_size)
+        return response.records(Person)
+
+    async def search_raw(self, query: str, page: int, page_size: int) -> CachedResponse:
+        """
+        Same as `search`, but returns the response body ready to be sent
+        """
+        check_page_window(page, page_size)
+        query = normalize_query(query)
+        key = cache_key(self.prefix, "search", query=query, page=page, size=page_size)
+        search = create_person_search_query(query, page, page_size)
+        return await self.get_response(key, PERSON_CACHE_EXPIRE, self._load_persons, key, search)
+
+    async def search_by_cursor(self, query: str, cursor: str, page_size: int) -> Page:
+        """
+        Search persons by name with cursor pagination
+        :param query: query string to search in full names
+        :param cursor: cursor from the previous page, empty string for the first page
+        :param page_size: page size
+        :return: page of persons and cursor for the next one
+        """
+        response = await self.search_by_cursor_raw(query, cursor, page_size)
+        return response.page(Person)
+
+    async def search_by_cursor_raw(self, query: str, cursor: str, page_size: int) -> CachedResponse:
+        """
+        Same as `search_by_cursor`, but returns the response body ready to be sent
+        """
+        query = normalize_query(query)
+        search = create_person_search_query(query, page_size=page_size, search_after=decode_cursor(cursor))
+        key = cache_key(self.prefix, "cursor", query=query, cursor=cursor, size=page_size)
+        return await self.get_page(key, self.storage, search, page_size, PERSON_CACHE_EXPIRE,
+                                   prepare=self._with_filmworks)
+
+    async def _with_filmworks(self, found: List[BasePerson]) -> List[Person]:
+        """
+        Turn found BasePerson instances into Person: the cached ones are taken with one MGET,
+        films for the rest are found with one round trip.
+        """
+        found = {p.id: p for p in found}
+
+        async def add_filmworks(person_ids: List[str]) -> List[Person]:
+            return await self._add_filmworks([found[person_id] for person_id in person_ids])
+
+        return await self.get_records_by_ids(list(found), PERSON_CACHE_EXPIRE, add_filmworks)
+
+    async def _load_persons(self, key: str, query: dict) -> CachedResponse:
+        result = await self.storage.search_page(query)
+        response = CachedResponse.from_search(result, Person, await self._with_filmworks(result.items))
+        return await self.save_response(key, response, PERSON_CACHE_EXPIRE, [list_tag(self.entity)])
 
     async def get_films_by_person(self, person_id: str) -> List[FilmPreview]:
         """
@@ -124,14 +228,22 @@ class PersonService(BaseService):
         :param person_id: uuid of the person
         :return: List[FilmPreview] with films of person with given person_id
         """
+        response = await self.get_films_by_person_raw(person_id)
+        return response.records(FilmPreview)
+
+    async def get_films_by_person_raw(self, person_id: str) -> CachedResponse:
+        """
+        Same as `get_films_by_person`, but returns the response body ready to be sent
+        """
+        key = cache_key(self.prefix, "films", person_id)
         query = create_films_by_person_query(person_id)
-        films = await self.get_records_from_cache(f"{self.prefix}:{query}")
-        if not films:
-            films = await self.film_storage.search(query)
-            serialized_films = orjson.dumps([f.dict() for f in films], default=str)
-            await self.save_to_cache(f"{self.prefix}:{query}", serialized_films, expire=FILM_CACHE_EXPIRE)
-        films = [FilmPreview.parse_obj(film) for film in films]
-        return films
+        return await self.get_response(key, FILM_CACHE_EXPIRE, self._load_films_by_person, key, person_id, query)
+
+    async def _load_films_by_person(self, key: str, person_id: str, query: dict) -> CachedResponse:
+        result = await self.film_storage.search_page(query, model=FilmPreview)
+        response = CachedResponse.from_search(result, FilmPreview)
+        tags = [entity_tag(self.entity, person_id)] + entity_tags("film", [film.id for film in result.items])
+        return await self.save_response(key, response, FILM_CACHE_EXPIRE, tags)
 
 
 @lru_cache()
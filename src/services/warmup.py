@@ -0,0 +1,170 @@
+"""
+Cache warm-up: fills the cache with what the first minutes of traffic ask for,
+so a deploy or a Redis flush doesn't turn into an ES load spike.
+
+Runs on startup with WARMUP_ON_STARTUP=true (the app starts serving when it is done),
+or by hand from the src directory:
+    python -m services.warmup --pages 5 --film-ids <id>,<id>
+"""
+import argparse
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+import aioredis
+import orjson
+from elasticsearch import AsyncElasticsearch
+
+from core import config
+from core.config import (BATCH_MAX_SIZE, FILM_CACHE_EXPIRE, FILM_PAGE_SIZE, FILM_WORKS_INDEX, GENRE_CACHE_EXPIRE,
+                         GENRE_PAGE_SIZE, GENRE_POPULARITY_CACHE_EXPIRE, GENRES_INDEX, GENRES_MAX_COUNT, PERSONS_INDEX,
+                         WARMUP_CONCURRENCY, WARMUP_FILM_IDS, WARMUP_FILM_PAGES, WARMUP_FILM_SORTS,
+                         WARMUP_PERSON_IDS, WARMUP_TIMEOUT)
+from db import es_storage, redis_cache
+from db.current_cache import get_current_cache
+from db.current_storage import get_current_storage
+from models.film import Film
+from models.genre import Genre
+from models.person import BasePerson, Person
+from services.film import FilmService
+from services.genre import GenreService
+from services.person import PersonService
+
+logger = logging.getLogger(__name__)
+
+# Report of the last warm-up in this process, None until it is finished.
+last_report: Optional[dict] = None
+
+
+def create_services() -> Tuple[FilmService, GenreService, PersonService]:
+    cache = get_current_cache()
+    film_storage = get_current_storage(model=Film, index=FILM_WORKS_INDEX)
+    return (
+        FilmService(Film, cache, film_storage, FILM_CACHE_EXPIRE),
+        GenreService(Genre, cache, get_current_storage(model=Genre, index=GENRES_INDEX), film_storage,
+                     GENRE_CACHE_EXPIRE, GENRE_POPULARITY_CACHE_EXPIRE),
+        PersonService(Person, cache, get_current_storage(model=BasePerson, index=PERSONS_INDEX), film_storage),
+    )
+
+
+def chunks(items: Sequence, size: int = BATCH_MAX_SIZE) -> List[Sequence]:
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+async def warm_up(films: FilmService,
+                  genres: GenreService,
+                  persons: PersonService,
+                  pages: int = WARMUP_FILM_PAGES,
+                  sorts: Sequence[Optional[str]] = WARMUP_FILM_SORTS,
+                  film_ids: Sequence[str] = WARMUP_FILM_IDS,
+                  person_ids: Sequence[str] = WARMUP_PERSON_IDS,
+                  concurrency: int = WARMUP_CONCURRENCY) -> dict:
+    """
+    Preloads all genres with their popularity, the first `pages` pages of the film list
+    for every sort order and genre, and the given films and persons.
+    Records are read with mget, film list pages with msearch, both written with pipelined Redis commands,
+    at most `concurrency` ES requests are in flight.
+    :return: report with elapsed seconds and the number of warmed cache keys
+    """
+    start = time.perf_counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(func: Callable[..., Awaitable], *args, **kwargs):
+        async with semaphore:
+            return await func(*args, **kwargs)
+
+    # Genre list pages go one by one: the short page is the last one.
+    genre_ids, genre_pages = [], 0
+    while len(genre_ids) == genre_pages * GENRE_PAGE_SIZE and len(genre_ids) < GENRES_MAX_COUNT:
+        page = await genres.get_by_search(page=genre_pages + 1, size=GENRE_PAGE_SIZE)
+        if not page:
+            break
+        genre_ids.extend(genre.id for genre in page)
+        genre_pages += 1
+
+    async def load_many(load: Callable[[Sequence], Awaitable[list]], items: Sequence) -> list:
+        loaded = await asyncio.gather(*(bounded(load, part) for part in chunks(list(items))))
+        return [record for part in loaded for record in part]
+
+    popularity, genre_records, film_records, person_records = await asyncio.gather(
+        bounded(genres.refresh_genres_popularity, GENRE_POPULARITY_CACHE_EXPIRE, genre_ids),
+        load_many(genres.get_many, genre_ids),
+        load_many(films.get_many, film_ids),
+        load_many(persons.get_many, person_ids),
+    )
+
+    # Film list pages are searched with one msearch per chunk.
+    searches = [
+        {"page": page, "size": FILM_PAGE_SIZE, "sort": sort, "genre": genre}
+        for sort in sorts
+        for genre in [None] + genre_ids
+        for page in range(1, pages + 1)
+    ]
+    film_pages = await load_many(films.get_pages_raw, searches)
+    film_pages = sum(1 for response in film_pages if response and response.count)
+
+    report = {
+        "elapsed": round(time.perf_counter() - start, 3),
+        "keys": (genre_pages + len(genre_records) + len(popularity) + film_pages
+                 + len(film_records) + len(person_records)),
+        "genres": len(genre_ids),
+        "film_pages": film_pages,
+        "films": len(film_records),
+        "persons": len(person_records),
+    }
+    logger.info("Cache warm-up finished: %s", report)
+    return report
+
+
+async def warm_up_on_startup(timeout: float = WARMUP_TIMEOUT):
+    """
+    Warm-up for the app startup: a failure or a warm-up longer than `timeout` seconds is logged,
+    the app starts with a cold (or partly warm) cache.
+    """
+    global last_report
+    try:
+        last_report = await asyncio.wait_for(warm_up(*create_services()), timeout or None)
+    except asyncio.TimeoutError:
+        logger.warning("Cache warm-up took longer than %s s, starting with a cold cache", timeout)
+    except Exception:
+        logger.exception("Cache warm-up failed")
+
+
+async def main(args: argparse.Namespace) -> dict:
+    redis_cache.redis = await aioredis.create_redis_pool((config.REDIS_HOST, config.REDIS_PORT),
+                                                         maxsize=args.concurrency, timeout=1)
+    es_storage.es = AsyncElasticsearch(hosts=[f"{config.ELASTIC_HOST}:{config.ELASTIC_PORT}"],
+                                       timeout=config.ES_TIMEOUT)
+    try:
+        return await warm_up(*create_services(),
+                             pages=args.pages,
+                             sorts=args.sorts,
+                             film_ids=args.film_ids,
+                             person_ids=args.person_ids,
+                             concurrency=args.concurrency)
+    finally:
+        redis_cache.redis.close()
+        await redis_cache.redis.wait_closed()
+        await es_storage.es.close()
+
+
+def parse_args(argv: Sequence[str] = None) -> argparse.Namespace:
+    def id_list(value: str) -> List[str]:
+        return [item for item in value.split(",") if item]
+
+    parser = argparse.ArgumentParser(description="Fill the cache before traffic arrives.")
+    parser.add_argument("--pages", type=int, default=WARMUP_FILM_PAGES,
+                        help="film list pages per sort order and genre")
+    parser.add_argument("--sorts", type=lambda value: [sort or None for sort in value.split(",")],
+                        default=list(WARMUP_FILM_SORTS),
+                        help="comma separated film sort orders, an empty item means no sorting")
+    parser.add_argument("--film-ids", type=id_list, default=list(WARMUP_FILM_IDS))
+    parser.add_argument("--person-ids", type=id_list, default=list(WARMUP_PERSON_IDS))
+    parser.add_argument("--concurrency", type=int, default=WARMUP_CONCURRENCY)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    # The report goes to stdout for scripts, the log of the warm-up goes to stderr.
+    print(orjson.dumps(asyncio.run(main(parse_args()))).decode())
@@ -11,4 +11,8 @@ tags_metadata = [
         "name": "film",
         "description": "Кинопроизведения."
     },
+    {
+        "name": "admin",
+        "description": "Служебные эндпоинты для администраторов."
+    },
 ]
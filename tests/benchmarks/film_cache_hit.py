@@ -0,0 +1,72 @@
+"""
+Throughput of warm (cache hit) requests to /api/v1/film/, raw cached JSON vs models.
+Redis and Elasticsearch are replaced with in-memory fakes, so only the API CPU cost is measured.
+
+Both paths read the same cached page from the same service in one run:
+* models - the handler as it was before responses were cached as raw JSON: the cached page is parsed
+  into FilmPreview models and FastAPI validates and serializes them with response_model;
+* raw - the current handler: the cached bytes are sent as they are.
+
+Run from the project root:
+    python -m tests.benchmarks.film_cache_hit
+"""
+import asyncio
+import time
+from typing import List
+
+from fastapi import Depends, FastAPI, Query
+
+from tests.support.asgi import request
+
+from main import app  # noqa: E402
+from models.film import Film, FilmPreview  # noqa: E402
+from services.auth import role_validator_factory  # noqa: E402
+from services.film import FilmService, get_film_service  # noqa: E402
+
+from tests.unit.factories import make_film, make_genre, make_person  # noqa: E402
+from tests.unit.fakes import FakeCache, FakeStorage  # noqa: E402
+
+REQUESTS = 200
+PAGE_SIZE = 50
+PATH = "/api/v1/film/"
+
+models_app = FastAPI()
+
+
+@models_app.get(PATH,
+                response_model=List[FilmPreview],
+                dependencies=[Depends(role_validator_factory(roles=("guest", "user", "subscriber", "admin")))])
+async def films_index_models(size: int = Query(PAGE_SIZE, alias="page[size]"),
+                             film_service: FilmService = Depends(get_film_service)) -> List[FilmPreview]:
+    return await film_service.get_by_search(size=size)
+
+
+def make_catalog(size: int):
+    genres = [make_genre(f"g{i}") for i in range(3)]
+    persons = [make_person(f"p{i}", f"Person {i}") for i in range(10)]
+    return [make_film(f"f{i:03}", actors=persons, writers=persons[:3], directors=persons[:1], genres=genres)
+            for i in range(size)]
+
+
+async def throughput(api, params=()) -> float:
+    response = await request(api, PATH, params)  # warm up the cache
+    assert response.status == 200, response
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        await request(api, PATH, params)
+    return REQUESTS / (time.perf_counter() - start)
+
+
+async def main():
+    service = FilmService(Film, FakeCache(), FakeStorage(make_catalog(PAGE_SIZE), latency=0), 60)
+    for api in (app, models_app):
+        api.dependency_overrides[get_film_service] = lambda: service
+
+    params = [("page[size]", str(PAGE_SIZE))]
+    print(f"GET {PATH}?page[size]={PAGE_SIZE}, cache hits")
+    for name, api in (("models", models_app), ("raw", app)):
+        print(f"{name:>6}: {await throughput(api, params):8.0f} req/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
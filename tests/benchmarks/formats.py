@@ -0,0 +1,79 @@
+"""
+Candidate formats for cached model lists, compared by `serializers.py`. The services do not use them.
+
+JSONSerializer is what services store today (orjson of `record.dict()`).
+MsgpackSerializer stores every record as an array of its field values in model field
+order, so field names are not repeated in every record. It needs the optional `msgpack`
+package and the model class to read the data back.
+"""
+import abc
+from typing import Any, ClassVar, Dict, List, Type
+
+import orjson
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON, ModelField
+
+
+class Serializer(abc.ABC):
+    name: ClassVar[str]
+
+    @abc.abstractmethod
+    def dumps(self, records: List[BaseModel]) -> bytes:
+        pass
+
+    @abc.abstractmethod
+    def loads(self, data: bytes, model: Type[BaseModel]) -> List[BaseModel]:
+        pass
+
+
+class JSONSerializer(Serializer):
+    name = "json"
+
+    def dumps(self, records: List[BaseModel]) -> bytes:
+        return orjson.dumps([record.dict() for record in records], default=str)
+
+    def loads(self, data: bytes, model: Type[BaseModel]) -> List[BaseModel]:
+        return [model(**item) for item in orjson.loads(data)]
+
+
+class MsgpackSerializer(Serializer):
+    name = "msgpack"
+
+    def __init__(self):
+        import msgpack
+        self.msgpack = msgpack
+
+    def dumps(self, records: List[BaseModel]) -> bytes:
+        return self.msgpack.packb([self._pack(record) for record in records], use_bin_type=True)
+
+    def loads(self, data: bytes, model: Type[BaseModel]) -> List[BaseModel]:
+        return [model(**self._unpack(model, values)) for values in self.msgpack.unpackb(data, raw=False)]
+
+    def _pack(self, record: BaseModel) -> list:
+        return [self._pack_value(getattr(record, name)) for name in record.__fields__]
+
+    def _pack_value(self, value: Any) -> Any:
+        if isinstance(value, BaseModel):
+            return self._pack(value)
+        if isinstance(value, (list, tuple)):
+            return [self._pack_value(item) for item in value]
+        return value
+
+    def _unpack(self, model: Type[BaseModel], values: list) -> Dict[str, Any]:
+        return {name: self._unpack_value(field, value)
+                for (name, field), value in zip(model.__fields__.items(), values)}
+
+    def _unpack_value(self, field: ModelField, value: Any) -> Any:
+        nested = field.type_
+        if value is None or not (isinstance(nested, type) and issubclass(nested, BaseModel)):
+            return value
+        if field.shape == SHAPE_SINGLETON:
+            return self._unpack(nested, value)
+        return [self._unpack(nested, item) for item in value]
+
+
+SERIALIZERS = {serializer.name: serializer for serializer in (JSONSerializer, MsgpackSerializer)}
+
+
+def get_serializer(name: str) -> Serializer:
+    return SERIALIZERS[name]()
@@ -0,0 +1,204 @@
+"""
+Load test of the API endpoints against in-process Elasticsearch, Redis and auth stand-ins
+(see tests/support/stubs.py) with injected latency. Documents come from tests/functional/testdata/load_data.
+
+Every scenario runs twice at fixed concurrency:
+* cold - caches are flushed, every distinct request of the scenario is sent once;
+* warm - the same requests are repeated until `--requests` are sent.
+Throughput, p50/p95/p99 latency and backend round trips per request are reported
+and can be saved as JSON to compare a change against a baseline.
+
+Run from the project root:
+    python -m tests.benchmarks.load --output baseline.json
+    python -m tests.benchmarks.load --compare baseline.json --scenarios film_index,person_search
+"""
+import argparse
+import asyncio
+import itertools
+import math
+import platform
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import orjson
+
+from tests.support.asgi import request
+from tests.support.stubs import StubAuthSession, StubElasticsearch, StubRedis, load_documents
+
+from main import app  # noqa: E402
+from db import es_storage, redis_cache  # noqa: E402
+from db.tiered_cache import local_cache  # noqa: E402
+from services import auth  # noqa: E402
+
+Target = Tuple[str, List[Tuple[str, str]]]
+
+PHASES = ("cold", "warm")
+
+
+def search_words(values: Sequence[str], limit: int) -> List[str]:
+    """Distinct lowercase words of at least 4 letters, in order of appearance."""
+    words = (word.lower() for value in values for word in value.split())
+    return list(itertools.islice(dict.fromkeys(word for word in words if word.isalpha() and len(word) >= 4), limit))
+
+
+def create_scenarios(documents: Dict[str, List[dict]], limit: int) -> Dict[str, List[Target]]:
+    """Scenario name -> distinct requests to its endpoint, at most `limit`."""
+    films = [doc["id"] for doc in documents["movies"]]
+    persons = [doc["id"] for doc in documents["persons"]]
+    genres = [doc["id"] for doc in documents["genres"]]
+    film_pages = math.ceil(len(films) / 10)
+    genre_pages = [(page, size) for size in (1, 2, 5) for page in range(1, math.ceil(len(genres) / size) + 1)]
+    scenarios = {
+        "film_details": [(f"/api/v1/film/{film_id}", []) for film_id in films],
+        "film_index": [("/api/v1/film/", [("page[number]", str(page)), ("sort", sort)])
+                       for page in range(1, film_pages + 1) for sort in ("-imdb_rating", "imdb_rating")],
+        "film_genre": [("/api/v1/film/", [("filter[genre]", genre_id), ("page[number]", str(page))])
+                       for page in (1, 2, 3) for genre_id in genres],
+        "film_search": [("/api/v1/film/search/", [("query", word)])
+                        for word in search_words([doc["title"] for doc in documents["movies"]], limit)],
+        "genre_index": [("/api/v1/genre/", [("page", str(page)), ("size", str(size))]) for page, size in genre_pages],
+        "genre_details": [(f"/api/v1/genre/{genre_id}", []) for genre_id in genres],
+        "person_details": [(f"/api/v1/person/{person_id}", []) for person_id in persons],
+        "person_search": [("/api/v1/person/search/", [("query", word)])
+                          for word in search_words([doc["full_name"] for doc in documents["persons"]], limit)],
+        "person_films": [(f"/api/v1/person/{person_id}/film", []) for person_id in persons],
+    }
+    return {name: targets[:limit] for name, targets in scenarios.items()}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+class Backends:
+    def __init__(self, documents: Dict[str, List[dict]], es_latency: float, redis_latency: float,
+                 auth_latency: float):
+        self.es = StubElasticsearch(documents, es_latency)
+        self.redis = StubRedis(redis_latency)
+        self.auth = StubAuthSession(auth_latency)
+        es_storage.es, redis_cache.redis, auth.session = self.es, self.redis, self.auth
+
+    def flush(self):
+        self.redis.flushall()
+        local_cache.clear()
+        auth.verdicts.clear()
+
+    def round_trips(self) -> Dict[str, int]:
+        return {
+            "es": sum(self.es.calls.values()),
+            "redis": sum(self.redis.calls.values()),
+            "auth": self.auth.calls,
+        }
+
+
+async def run(targets: List[Target], total: int, concurrency: int, backends: Backends) -> dict:
+    """Sends `total` requests cycling over targets with `concurrency` concurrent clients."""
+    queue = itertools.islice(itertools.cycle(targets), total)
+    latencies, statuses = [], Counter()
+    before = backends.round_trips()
+
+    async def client(number: int):
+        # Every client has its own token, like separate users.
+        headers = {"Authorization": f"Bearer load-test-{number}"}
+        for path, params in queue:
+            start = time.perf_counter()
+            response = await request(app, path, params, headers)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    after = backends.round_trips()
+    return {
+        "requests": len(latencies),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "round_trips_per_request": {backend: round((after[backend] - before[backend]) / len(latencies), 2)
+                                    for backend in after},
+    }
+
+
+async def benchmark(args: argparse.Namespace) -> dict:
+    documents = load_documents()
+    backends = Backends(documents, args.es_latency / 1000, args.redis_latency / 1000, args.auth_latency / 1000)
+    scenarios = create_scenarios(documents, args.requests)
+    if args.scenarios:
+        scenarios = {name: scenarios[name] for name in args.scenarios}
+
+    results = {}
+    for name, targets in scenarios.items():
+        backends.flush()
+        results[name] = {
+            "cold": await run(targets, len(targets), args.concurrency, backends),
+            "warm": await run(targets, args.requests, args.concurrency, backends),
+        }
+        print_result(name, results[name])
+    return {
+        "settings": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "es_latency_ms": args.es_latency,
+            "redis_latency_ms": args.redis_latency,
+            "auth_latency_ms": args.auth_latency,
+            "python": platform.python_version(),
+        },
+        "results": results,
+    }
+
+
+def print_result(name: str, result: dict, baseline: Optional[dict] = None):
+    for phase in PHASES:
+        stats = result[phase]
+        trips = " ".join(f"{backend}={count:g}" for backend, count in stats["round_trips_per_request"].items())
+        line = (f"{name:>15} {phase:>4}: {stats['requests']:>5} req {stats['rps']:>8.0f} req/s "
+                f"p50 {stats['p50_ms']:>7.2f} p95 {stats['p95_ms']:>7.2f} p99 {stats['p99_ms']:>7.2f} ms  {trips}")
+        if baseline and phase in baseline:
+            line += (f"  | req/s {change(baseline[phase]['rps'], stats['rps'])}"
+                     f" p95 {change(baseline[phase]['p95_ms'], stats['p95_ms'])}")
+        print(line)
+
+
+def change(before: float, after: float) -> str:
+    return f"{(after - before) / before * 100:+.0f}%" if before else "n/a"
+
+
+def compare(report: dict, baseline: dict):
+    print(f"\nCompared with the baseline ({baseline['settings']}):")
+    for name, result in report["results"].items():
+        print_result(name, result, baseline["results"].get(name))
+
+
+def parse_args(args: Sequence[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    csv: Callable[[str], List[str]] = lambda value: [item for item in value.split(",") if item]
+    parser.add_argument("--concurrency", type=int, default=10, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=300, help="requests per scenario in the warm run")
+    parser.add_argument("--es-latency", type=float, default=2.0, help="Elasticsearch round trip, ms")
+    parser.add_argument("--redis-latency", type=float, default=0.2, help="Redis round trip, ms")
+    parser.add_argument("--auth-latency", type=float, default=5.0, help="auth service round trip, ms")
+    parser.add_argument("--scenarios", type=csv, default=None, help="comma-separated scenarios, all by default")
+    parser.add_argument("--output", help="save the report to this JSON file")
+    parser.add_argument("--compare", help="JSON report of a previous run to compare with")
+    return parser.parse_args(args)
+
+
+def main(args: argparse.Namespace):
+    report = asyncio.run(benchmark(args))
+    if args.output:
+        with open(args.output, "wb") as file:
+            file.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+    if args.compare:
+        with open(args.compare, "rb") as file:
+            compare(report, orjson.loads(file.read()))
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,76 @@
+"""
+Round trips and latency of person search with and without the N+1 lookups.
+
+Run from the project root:
+    python -m tests.benchmarks.person_search
+"""
+import asyncio
+import os
+import sys
+import time
+
+from elasticsearch_dsl import Q, Search
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src"))
+
+from models.person import Person  # noqa: E402
+from services.person import ROLES, PersonService, create_person_search_query  # noqa: E402
+
+from tests.unit.factories import make_film, make_person  # noqa: E402
+from tests.unit.fakes import FakeCache, FakeStorage  # noqa: E402
+
+PAGE_SIZES = (5, 20, 100)
+FILMS_PER_PERSON = 3
+ES_LATENCY = 0.002
+
+
+def make_storages(page_size: int):
+    persons = [make_person(f"p{i}", f"Person {i}") for i in range(page_size)]
+    films = [make_film(f"f{i}-{j}", actors=[person], writers=[person], directors=[person])
+             for i, person in enumerate(persons) for j in range(FILMS_PER_PERSON)]
+    return FakeStorage(persons, ES_LATENCY), FakeStorage(films, ES_LATENCY)
+
+
+async def legacy_search(service: PersonService, page_size: int):
+    """Search as it was done before: one search, then get_by_id with three role queries per person."""
+    persons = await service.storage.search(create_person_search_query("Person", 1, page_size))
+    result = []
+    for person in persons:
+        person = await service.storage.get(person.id)
+        films = []
+        for role in ROLES:
+            query = Search().query(Q("nested", path=f"{role}s", query=Q("term", **{f"{role}s.id": person.id})))
+            found = await service.film_storage.search(query.to_dict())
+            films.extend({"id": film.id, "role": role} for film in found
+                         if person.id in [p.id for p in getattr(film, f"{role}s")])
+        result.append(Person(**person.dict(), films=films))
+    return result
+
+
+async def measure(search, page_size: int) -> dict:
+    storage, film_storage = make_storages(page_size)
+    service = PersonService(Person, FakeCache(), storage, film_storage)
+    start = time.perf_counter()
+    persons = await search(service, page_size)
+    elapsed = time.perf_counter() - start
+    assert len(persons) == page_size
+    round_trips = sum(storage.calls.values()) + sum(film_storage.calls.values())
+    return {"round_trips": round_trips, "ms": elapsed * 1000}
+
+
+async def current_search(service: PersonService, page_size: int):
+    return await service.search("Person", 1, page_size)
+
+
+async def main():
+    print(f"ES latency {ES_LATENCY * 1000:.0f} ms per call")
+    print(f"{'page size':>9} | {'before: trips':>13} {'ms':>8} | {'after: trips':>12} {'ms':>8}")
+    for page_size in PAGE_SIZES:
+        before = await measure(legacy_search, page_size)
+        after = await measure(current_search, page_size)
+        print(f"{page_size:>9} | {before['round_trips']:>13} {before['ms']:>8.1f} "
+              f"| {after['round_trips']:>12} {after['ms']:>8.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+"""
+Encode/decode time and size of cached model lists: orjson (current) vs msgpack with positional fields.
+Payloads are built from tests/functional/testdata/load_data, sizes after cache compression are shown too.
+Every format is checked to round-trip the payloads before it is timed. Needs the `msgpack` package.
+
+Run from the project root:
+    python -m tests.benchmarks.serializers
+"""
+import os
+import sys
+import time
+from collections import defaultdict
+
+import orjson
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src"))
+
+from core.config import CACHE_COMPRESS_LEVEL, CACHE_COMPRESS_MIN_SIZE  # noqa: E402
+from db.redis_cache import ValueCodec  # noqa: E402
+from models.film import Film, FilmPreview  # noqa: E402
+from models.genre import Genre  # noqa: E402
+from models.person import Person  # noqa: E402
+from services.person import ROLES  # noqa: E402
+from tests.benchmarks.formats import SERIALIZERS  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "functional", "testdata", "load_data")
+PAGE_SIZE = 50
+MIN_TIME = 0.2
+
+
+def load(index: str) -> list:
+    with open(os.path.join(DATA_DIR, f"{index}.json"), "rb") as f:
+        return [doc["_source"] for doc in orjson.loads(f.read())]
+
+
+def make_payloads() -> dict:
+    films = [Film(**doc) for doc in load("movies")]
+    roles = defaultdict(list)
+    for film in films:
+        for role in ROLES:
+            for person in getattr(film, f"{role}s"):
+                roles[person.id].append({"id": film.id, "role": role})
+    persons = [Person(**doc, films=roles[doc["id"]]) for doc in load("persons")]
+    persons.sort(key=lambda person: -len(person.films))
+    return {
+        "Film x1": (Film, films[:1]),
+        f"Film x{PAGE_SIZE}": (Film, films[:PAGE_SIZE]),
+        f"FilmPreview x{PAGE_SIZE}": (FilmPreview, [FilmPreview(**film.dict()) for film in films[:PAGE_SIZE]]),
+        "Genre x all": (Genre, [Genre(**doc) for doc in load("genres")]),
+        f"Person x{PAGE_SIZE}": (Person, persons[:PAGE_SIZE]),
+    }
+
+
+def per_call(func, *args) -> float:
+    """Microseconds per call, repeated for at least MIN_TIME seconds."""
+    calls, start = 0, time.perf_counter()
+    while time.perf_counter() - start < MIN_TIME:
+        func(*args)
+        calls += 1
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    codec = ValueCodec(CACHE_COMPRESS_MIN_SIZE, CACHE_COMPRESS_LEVEL)
+    print(f"{'payload':<16} {'format':<8} {'encode us':>10} {'decode us':>10} {'bytes':>8} {'compressed':>10}")
+    for name, (model, records) in make_payloads().items():
+        for serializer in (cls() for cls in SERIALIZERS.values()):
+            data = serializer.dumps(records)
+            assert serializer.loads(data, model) == records
+            print(f"{name:<16} {serializer.name:<8} "
+                  f"{per_call(serializer.dumps, records):>10.0f} {per_call(serializer.loads, data, model):>10.0f} "
+                  f"{len(data):>8} {len(codec.encode(data)):>10}")
+
+
+if __name__ == "__main__":
+    main()
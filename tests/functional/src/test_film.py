@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 
 API_URL = '/film/'
@@ -97,6 +99,29 @@ async def test_film_filter_unknown_genre(make_get_request,
     assert len(response.body) == 0
 
 
+@pytest.mark.asyncio
+async def test_film_cache_invalidation(make_get_request,
+                                       initialize_environment,
+                                       es_client,
+                                       redis_client):
+    request = (API_URL, {"page[number]": 1, "page[size]": 1})
+    cached = await make_get_request(*request)
+    film = cached.body[0]
+
+    await es_client.update(index="movies", id=film["id"], body={"doc": {"title": "Changed"}}, refresh=True)
+    await redis_client.publish_json("cache:invalidate", {"type": "film", "ids": [film["id"]]})
+    try:
+        for _ in range(50):
+            response = await make_get_request(*request)
+            if response.body[0]["title"] == "Changed":
+                break
+            await asyncio.sleep(0.1)
+        assert response.body[0]["title"] == "Changed"
+    finally:
+        await es_client.update(index="movies", id=film["id"], body={"doc": {"title": film["title"]}}, refresh=True)
+        await redis_client.publish_json("cache:invalidate", {"type": "film", "ids": [film["id"]]})
+
+
 @pytest.mark.asyncio
 async def test_film_cache(make_get_request,
                           initialize_environment,
@@ -108,3 +108,14 @@ async def test_genres_cache(make_get_request,
     response = await make_get_request(f"{API_URL}")
     assert response.status == 200
     assert response.body == expected_json_response
+
+
+@pytest.mark.asyncio
+async def test_genres_batch(make_get_request, initialize_environment):
+    ids = ["3e629e7f-6504-4b0e-bf65-92b201953e6d", "wrong-id", "ee1e6155-046c-4af9-a1bf-2c505e58787e"]
+    response = await make_get_request(f"{API_URL}batch/", params=[("ids", genre_id) for genre_id in ids])
+    assert response.status == 200
+    assert response.body == [
+        {"id": "3e629e7f-6504-4b0e-bf65-92b201953e6d", "name": "Sport", "popularity": 23},
+        {"id": "ee1e6155-046c-4af9-a1bf-2c505e58787e", "name": "Family", "popularity": 95},
+    ]
@@ -0,0 +1,51 @@
+"""
+Minimal in-process ASGI client: drives the FastAPI app without a server or sockets.
+"""
+import os
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+from urllib.parse import urlencode
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+
+@dataclass
+class ASGIResponse:
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+
+async def request(app, path: str, params: List[Tuple[str, str]] = (), headers: Dict[str, str] = None,
+                  method: str = "GET") -> ASGIResponse:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": urlencode(list(params)).encode(),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    start = next(m for m in messages if m["type"] == "http.response.start")
+    body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+    return ASGIResponse(status=start["status"],
+                        headers={k.decode(): v.decode() for k, v in start.get("headers", [])},
+                        body=body)
@@ -0,0 +1,334 @@
+"""
+In-process stand-ins for Elasticsearch, Redis and the auth service with injected latency.
+
+They replace the clients the app creates on startup (`es_storage.es`, `redis_cache.redis`,
+`auth.session`), so the whole API code path runs: storage and cache classes, codecs, backoff.
+Elasticsearch queries are evaluated for the subset of the DSL the services build.
+"""
+import asyncio
+import os
+from collections import Counter
+from functools import cmp_to_key
+from http import HTTPStatus
+from typing import Dict, Iterable, List, Optional
+
+import orjson
+from elasticsearch.exceptions import NotFoundError, RequestError
+
+LOAD_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "functional", "testdata", "load_data")
+NUMERIC_FIELDS = {"imdb_rating"}
+INDICES = {"movies": "movies.json", "persons": "persons.json", "genres": "genres.json"}
+
+
+def load_documents(data_dir: str = LOAD_DATA_DIR) -> Dict[str, List[dict]]:
+    """Index -> list of `_source` documents, from the functional tests data."""
+    documents = {}
+    for index, file_name in INDICES.items():
+        with open(os.path.join(data_dir, file_name), "rb") as file:
+            documents[index] = [hit["_source"] for hit in orjson.loads(file.read())]
+    return documents
+
+
+def field_values(doc: dict, field: str) -> list:
+    """Values of a dotted field, lists of nested objects are flattened."""
+    values = [doc]
+    for name in field.split("."):
+        found = []
+        for value in values:
+            value = value.get(name) if isinstance(value, dict) else None
+            if isinstance(value, list):
+                found.extend(value)
+            elif value is not None:
+                found.append(value)
+        values = found
+    return values
+
+
+def text_matches(values: list, text: str) -> bool:
+    words = str(text).lower().split()
+    return any(word in str(value).lower() for value in values for word in words)
+
+
+def matches(doc: dict, query: Optional[dict], path: str = "") -> bool:
+    """Evaluates bool, nested, term(s), match, multi_match and match_all queries."""
+    if not query:
+        return True
+    (kind, params), = query.items()
+    if kind == "match_all":
+        return True
+    if kind == "bool":
+        must = as_list(params.get("must", [])) + as_list(params.get("filter", []))
+        should = as_list(params.get("should", []))
+        return (all(matches(doc, q, path) for q in must)
+                and not any(matches(doc, q, path) for q in as_list(params.get("must_not", [])))
+                and (not should or any(matches(doc, q, path) for q in should)))
+    if kind == "nested":
+        nested = params["path"]
+        return any(matches(item, params["query"], nested) for item in field_values(doc, nested))
+    if kind == "multi_match":
+        return any(text_matches(field_values(doc, field), params["query"]) for field in params["fields"])
+    (field, value), = params.items()
+    field = field[len(path) + 1:] if path and field.startswith(path + ".") else field
+    values = field_values(doc, field)
+    if kind == "term":
+        return (value["value"] if isinstance(value, dict) else value) in values
+    if kind == "terms":
+        return any(item in values for item in value)
+    if kind == "match":
+        text = value["query"] if isinstance(value, dict) else value
+        return text in values or text_matches(values, text)
+    raise ValueError(f"Unsupported query: {kind}")
+
+
+def as_list(value) -> list:
+    return value if isinstance(value, list) else [value]
+
+
+class StubElasticsearch:
+    """AsyncElasticsearch replacement serving documents from memory."""
+
+    def __init__(self, documents: Dict[str, List[dict]], latency: float = 0.0):
+        self.documents = documents
+        self.by_id = {index: {doc["id"]: doc for doc in docs} for index, docs in documents.items()}
+        self.latency = latency
+        self.calls = Counter()
+
+    async def _round_trip(self, operation: str):
+        self.calls[operation] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def get(self, index, id, request_timeout=None):
+        await self._round_trip("get")
+        doc = self.by_id[index].get(id)
+        if doc is None:
+            raise NotFoundError(HTTPStatus.NOT_FOUND, "not_found", {})
+        return {"_id": id, "found": True, "_source": doc}
+
+    async def mget(self, body, index, request_timeout=None):
+        await self._round_trip("mget")
+        docs = [self.by_id[index].get(doc_id) for doc_id in body["ids"]]
+        return {"docs": [{"found": True, "_source": doc} if doc else {"found": False} for doc in docs]}
+
+    async def search(self, index, body, size=None, request_timeout=None):
+        await self._round_trip("search")
+        return self._search(index, body if size is None else {**body, "size": size})
+
+    async def msearch(self, body, index, request_timeout=None):
+        await self._round_trip("msearch")
+        return {"responses": [self._search(index, query) for query in body[1::2]]}
+
+    async def count(self, index, body, request_timeout=None):
+        await self._round_trip("count")
+        return {"count": sum(1 for doc in self.documents[index] if matches(doc, body.get("query")))}
+
+    async def close(self):
+        pass
+
+    def _search(self, index: str, body: dict) -> dict:
+        found = [doc for doc in self.documents[index] if matches(doc, body.get("query"))]
+        sort = [self._sort_field(item) for item in as_list(body.get("sort", []))]
+        hits = [{"_id": doc["id"], "_source": doc, "sort": [self._sort_value(doc, *item) for item in sort]}
+                for doc in found]
+        if sort:
+            hits.sort(key=cmp_to_key(lambda a, b: self._compare(a["sort"], b["sort"], sort)))
+        if body.get("search_after"):
+            if None in body["search_after"]:
+                raise RequestError(HTTPStatus.BAD_REQUEST, "parsing_exception", "search_after doesn't accept null")
+            hits = [hit for hit in hits if self._compare(hit["sort"], body["search_after"], sort) > 0]
+        start = body.get("from", 0)
+        hits = hits[start:start + body.get("size", 10)]
+        if "_source" in body:
+            hits = [{**hit, "_source": self._project(hit["_source"], body["_source"])} for hit in hits]
+
+        limit = body.get("track_total_hits", 10000)
+        total = {"value": min(len(found), limit), "relation": "eq" if len(found) <= limit else "gte"}
+        result = {"hits": {"total": total, "hits": hits}}
+        if "aggs" in body:
+            result["aggregations"] = self._aggregate(found, body["aggs"])
+        return result
+
+    @staticmethod
+    def _sort_field(item) -> tuple:
+        if isinstance(item, str):
+            return (item[1:], "desc", None) if item.startswith("-") else (item, "asc", None)
+        (field, params), = item.items()
+        if not isinstance(params, dict):
+            return field, params, None
+        return field, params.get("order", "asc"), params.get("missing")
+
+    @staticmethod
+    def _sort_value(doc: dict, field: str, order: str, missing):
+        if field in ("_id", "_doc", "_shard_doc"):
+            return doc["id"]
+        if field == "_score":
+            return 1.0
+        value = doc.get(field)
+        if value is None and isinstance(missing, (int, float)):
+            return missing
+        if value is None and field in NUMERIC_FIELDS:
+            # Numeric fields without a value sort with ±Infinity, as in ES.
+            return float("-inf") if order == "desc" else float("inf")
+        return value
+
+    @staticmethod
+    def _compare(a: list, b: list, sort: list) -> int:
+        for left, right, (_, order, _) in zip(a, b, sort):
+            if left == right:
+                continue
+            # Missing values go last in both directions, as in ES.
+            if left is None or right is None:
+                return 1 if left is None else -1
+            result = -1 if left < right else 1
+            return -result if order == "desc" else result
+        return 0
+
+    @staticmethod
+    def _project(doc: dict, fields: Iterable[str]) -> dict:
+        projected = {}
+        for field in fields:
+            name, _, rest = field.partition(".")
+            if name not in doc:
+                continue
+            if rest and isinstance(doc[name], list):
+                items = projected.setdefault(name, [{} for _ in doc[name]])
+                for item, source in zip(items, doc[name]):
+                    item.update(StubElasticsearch._project(source, [rest]))
+            else:
+                projected[name] = doc[name]
+        return projected
+
+    @staticmethod
+    def _aggregate(found: List[dict], aggs: dict) -> dict:
+        """Supports nested -> terms -> reverse_nested, the genres popularity aggregation."""
+        (nested_name, nested), = aggs.items()
+        (terms_name, terms), = nested["aggs"].items()
+        (reverse_name, _), = terms["aggs"].items()
+        path, params = nested["nested"]["path"], terms["terms"]
+        field = params["field"][len(path) + 1:]
+        counts = Counter(value for doc in found for value in set(field_values(doc, f"{path}.{field}")))
+        include = params.get("include")
+        buckets = [{"key": key, "doc_count": count, reverse_name: {"doc_count": count}}
+                   for key, count in counts.most_common()
+                   if include is None or key in include][:params.get("size", 10)]
+        return {nested_name: {"doc_count": sum(counts.values()), terms_name: {"buckets": buckets}}}
+
+
+class StubRedis:
+    """aioredis pool replacement: plain dict, one latency per command or pipeline."""
+
+    def __init__(self, latency: float = 0.0):
+        self.data: Dict[str, bytes] = {}
+        self.sets: Dict[str, set] = {}
+        self.published = []
+        self.latency = latency
+        self.calls = Counter()
+
+    async def _round_trip(self, operation: str):
+        self.calls[operation] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def get(self, key):
+        await self._round_trip("get")
+        return self.data.get(key)
+
+    async def set(self, key, value, expire=0):
+        await self._round_trip("set")
+        self.data[key] = value.encode() if isinstance(value, str) else value
+
+    async def mget(self, *keys):
+        await self._round_trip("mget")
+        return [self.data.get(key) for key in keys]
+
+    async def delete(self, *keys):
+        await self._round_trip("delete")
+        for key in keys:
+            self.data.pop(key.decode() if isinstance(key, bytes) else key, None)
+
+    async def publish(self, channel, message):
+        await self._round_trip("publish")
+        self.published.append((channel, message))
+
+    def pipeline(self):
+        return StubPipeline(self)
+
+    def flushall(self):
+        self.data.clear()
+        self.sets.clear()
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+class StubPipeline:
+    def __init__(self, redis: StubRedis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, key, value, expire=0):
+        self.commands.append(lambda: self.redis.data.__setitem__(
+            key, value.encode() if isinstance(value, str) else value))
+
+    def sadd(self, key, member):
+        self.commands.append(lambda: self.redis.sets.setdefault(key, set()).add(member.encode()))
+
+    def expire(self, key, seconds):
+        self.commands.append(lambda: None)
+
+    def smembers(self, key):
+        self.commands.append(lambda: set(self.redis.sets.get(key, ())))
+
+    def mget(self, *keys):
+        self.commands.append(lambda: [self.redis.data.get(key) for key in keys])
+
+    def scard(self, key):
+        self.commands.append(lambda: len(self.redis.sets.get(key, ())))
+
+    def srem(self, key, *members):
+        self.commands.append(lambda: self.redis.sets.get(key, set()).difference_update(members))
+
+    def spop(self, key, count=None):
+        members = self.redis.sets.get(key, set())
+        self.commands.append(lambda: [members.pop() for _ in range(min(count, len(members)))])
+
+    async def execute(self):
+        await self.redis._round_trip("pipeline")
+        return [command() for command in self.commands]
+
+
+class StubAuthResponse:
+    status = HTTPStatus.OK
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def json(self):
+        return {}
+
+    async def __aenter__(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class StubAuthSession:
+    """aiohttp session replacement: every token is valid after `latency` seconds."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def get(self, url, json=None, headers=None):
+        self.calls += 1
+        return StubAuthResponse(self.latency)
+
+    async def close(self):
+        pass
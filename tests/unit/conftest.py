@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Сервис запускается из каталога src, поэтому модули импортируются от его корня.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src"))
@@ -0,0 +1,28 @@
+from models.film import Film
+from models.genre import Genre
+from models.person import BasePerson
+
+
+def make_genre(genre_id: str = "g1", name: str = "Drama") -> Genre:
+    return Genre(id=genre_id, name=name, description=None)
+
+
+def make_person(person_id: str = "p1", full_name: str = "John Doe") -> BasePerson:
+    return BasePerson(id=person_id, full_name=full_name)
+
+
+def make_film(film_id: str = "f1", actors=(), writers=(), directors=(), genres=()) -> Film:
+    return Film(
+        id=film_id,
+        title=f"Film {film_id}",
+        imdb_rating=7.5,
+        description="",
+        actors_names=[p.full_name for p in actors],
+        writers_names=[p.full_name for p in writers],
+        directors_names=[p.full_name for p in directors],
+        genres_names=[g.name for g in genres],
+        actors=list(actors),
+        writers=list(writers),
+        directors=list(directors),
+        genres=list(genres),
+    )
@@ -0,0 +1,180 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from db.cache import Cache
+from db.storage import SearchError, SearchPage, Storage
+from models.basic import AbstractModel
+
+
+class FakeCache(Cache):
+    """In-memory replacement for Redis, counts backend calls."""
+
+    def __init__(self):
+        super().__init__()
+        self.data = {}
+        self.tags = {}
+        self.invalidated = {}
+        self.calls = {"get": 0, "set": 0, "get_many": 0, "set_many": 0}
+
+    @property
+    def client(self):
+        return self.data
+
+    async def get(self, key: str) -> Optional[bytes]:
+        self.calls["get"] += 1
+        value = self.data.get(key)
+        if isinstance(value, str):
+            value = value.encode()
+        return value
+
+    async def set(self, key: str, value: str, expire: int):
+        self.calls["set"] += 1
+        self.data[key] = value
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        self.calls["get_many"] += 1
+        self.calls["get"] -= len(keys)
+        return [await self.get(key) for key in keys]
+
+    async def set_many(self, values: Dict[str, str], expire: int):
+        self.calls["set_many"] += 1
+        self.data.update(values)
+
+    async def add_tags(self, tags: Dict[str, Iterable[str]], expire: int, since: float = None):
+        for key, key_tags in tags.items():
+            for tag in key_tags:
+                self.tags.setdefault(tag, set()).add(key)
+            if since is not None and any(self.invalidated.get(tag, -1) >= since for tag in key_tags):
+                self.data.pop(key, None)
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> List[str]:
+        tags = list(tags)
+        self.invalidated.update(dict.fromkeys(tags, time.time()))
+        keys = sorted({key for tag in tags for key in self.tags.pop(tag, ())})
+        for key in keys:
+            self.data.pop(key, None)
+        return keys
+
+
+def nested_ids(query) -> Iterable[tuple]:
+    """(path, id) of every nested term or match on `<path>.id` in the query, e.g. ("actors", "p1")."""
+    if isinstance(query, list):
+        for item in query:
+            yield from nested_ids(item)
+    elif isinstance(query, dict):
+        if "nested" in query:
+            path, inner = query["nested"]["path"], query["nested"]["query"]
+            for condition in ("term", "match"):
+                value = inner.get(condition, {}).get(f"{path}.id")
+                if value is not None:
+                    yield path, value.get("value", value.get("query")) if isinstance(value, dict) else value
+            return
+        for value in query.values():
+            yield from nested_ids(value)
+
+
+class InFlight:
+    """Counts calls waiting for a backend at once, shared by fakes to check that calls overlap."""
+
+    def __init__(self):
+        self.now = 0
+        self.peak = 0
+
+    async def wait(self, latency: float):
+        self.now += 1
+        self.peak = max(self.peak, self.now)
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            self.now -= 1
+
+
+class FakeStorage(Storage):
+    """
+    Storage serving documents from memory with an artificial latency.
+    Counts calls per method to check how many requests reach the backend,
+    and calls in flight at once in `in_flight`, which storages may share.
+    """
+
+    def __init__(self, docs: List[AbstractModel] = (), latency: float = 0.01, in_flight: InFlight = None):
+        super().__init__()
+        self.docs = {doc.id: doc for doc in docs}
+        self.latency = latency
+        self.in_flight = in_flight or InFlight()
+        self.calls = {"get": 0, "get_many": 0, "search": 0, "count": 0, "aggregate": 0, "scan": 0,
+                      "multi_search": 0}
+
+    @property
+    def client(self):
+        return self.docs
+
+    async def get(self, doc_id: str):
+        self.calls["get"] += 1
+        await self.in_flight.wait(self.latency)
+        return self.docs.get(doc_id)
+
+    async def get_many(self, doc_ids: List[str]) -> list:
+        self.calls["get_many"] += 1
+        await self.in_flight.wait(self.latency)
+        return [self.docs.get(doc_id) for doc_id in doc_ids]
+
+    async def search(self, query: dict, model=None):
+        page = await self.search_page(query, model)
+        return page.items
+
+    async def search_page(self, query: dict, model=None) -> SearchPage:
+        """
+        Ignores the query itself except for nested filters by participant id (films of a person),
+        but honors pagination: documents are ordered by id,
+        `search_after` takes the id (last sort value) of the previous page.
+        Documents are converted to `model` if it is given.
+        """
+        self.calls["search"] += 1
+        await self.in_flight.wait(self.latency)
+        return self._page(query, model)
+
+    async def multi_search(self, queries: List[dict], model=None) -> list:
+        """Answers all queries after a single latency, a query with "error" key fails."""
+        self.calls["multi_search"] += 1
+        await self.in_flight.wait(self.latency)
+        return [SearchError(type=query["error"], status=400) if "error" in query else self._page(query, model)
+                for query in queries]
+
+    def _page(self, query: dict, model=None) -> SearchPage:
+        docs = sorted(self.docs.values(), key=lambda doc: doc.id)
+        participants = list(nested_ids(query.get("query")))
+        if participants:
+            docs = [doc for doc in docs
+                    if any(person_id in [p.id for p in getattr(doc, path, [])] for path, person_id in participants)]
+        total = len(docs) if participants else len(self.docs)
+        if query.get("search_after"):
+            docs = [doc for doc in docs if doc.id > query["search_after"][-1]]
+        start = query.get("from", 0)
+        items = docs[start:start + query.get("size", 10)]
+        if model is not None:
+            items = [model(**doc.dict()) for doc in items]
+        return SearchPage(items=items, total=total, last_sort=[items[-1].id] if items else None)
+
+    async def count(self, query: dict) -> int:
+        self.calls["count"] += 1
+        await self.in_flight.wait(self.latency)
+        return len(self.docs)
+
+    async def scan(self, query: dict, size: int, source: List[str] = None):
+        self.calls["scan"] += 1
+        docs = [doc.dict(include=set(source) if source else None) for doc in self.docs.values()]
+        for start in range(0, len(docs), size):
+            await self.in_flight.wait(self.latency)
+            yield docs[start:start + size]
+
+    async def aggregate(self, query: dict) -> dict:
+        """Supports the genres popularity aggregation only."""
+        self.calls["aggregate"] += 1
+        await self.in_flight.wait(self.latency)
+        include = query["aggs"]["genres"]["aggs"]["ids"]["terms"].get("include")
+        counts = Counter(genre.id for doc in self.docs.values() for genre in {g.id: g for g in doc.genres}.values())
+        buckets = [{"key": genre_id, "doc_count": count, "films": {"doc_count": count}}
+                   for genre_id, count in counts.items() if include is None or genre_id in include]
+        return {"genres": {"doc_count": sum(counts.values()), "ids": {"buckets": buckets}}}
@@ -0,0 +1,109 @@
+import asyncio
+import datetime
+from http import HTTPStatus
+from types import SimpleNamespace
+
+import backoff._async
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from services import auth
+
+
+@pytest.fixture
+def auth_service(monkeypatch):
+    calls = []
+    answers = {"good": HTTPStatus.OK, "reader": HTTPStatus.FORBIDDEN}
+
+    async def check_token(token, roles):
+        calls.append((token, roles))
+        return answers.get(token, HTTPStatus.UNAUTHORIZED)
+
+    monkeypatch.setattr(auth, "check_token", check_token)
+    auth.verdicts.clear()
+    return calls
+
+
+def bearer(token):
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+
+@pytest.mark.asyncio
+async def test_positive_verdict_is_cached(auth_service):
+    validator = auth.role_validator_factory(roles=("user", "admin"))
+
+    assert await validator(bearer("good")) is True
+    assert await validator(bearer("good")) is True
+    assert len(auth_service) == 1
+
+
+@pytest.mark.asyncio
+async def test_negative_verdicts_are_cached(auth_service):
+    validator = auth.role_validator_factory(roles=("admin",))
+
+    for _ in range(2):
+        with pytest.raises(HTTPException) as error:
+            await validator(bearer("reader"))
+        assert error.value.status_code == HTTPStatus.FORBIDDEN
+        with pytest.raises(HTTPException) as error:
+            await validator(bearer("expired"))
+        assert error.value.status_code == HTTPStatus.NETWORK_AUTHENTICATION_REQUIRED
+    assert len(auth_service) == 2
+
+
+@pytest.mark.asyncio
+async def test_verdict_depends_on_roles(auth_service):
+    await auth.role_validator_factory(roles=("user",))(bearer("good"))
+    await auth.role_validator_factory(roles=("admin",))(bearer("good"))
+    assert len(auth_service) == 2
+
+
+class TimingOutSession:
+    """The auth service does not answer within the session timeout `timeouts` times, then allows."""
+
+    def __init__(self, timeouts: int):
+        self.timeouts = timeouts
+        self.calls = 0
+
+    def get(self, url, json=None, headers=None):
+        self.calls += 1
+        return self
+
+    async def __aenter__(self):
+        if self.calls <= self.timeouts:
+            raise asyncio.TimeoutError()
+        return SimpleNamespace(status=HTTPStatus.OK)
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_timed_out_check_is_retried(monkeypatch):
+    session = TimingOutSession(timeouts=1)
+    monkeypatch.setattr(auth, "session", session)
+
+    assert await auth.check_token("good", ("user",)) == HTTPStatus.OK
+    assert session.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_auth_service_timing_out_gives_503(monkeypatch):
+    class Clock(datetime.datetime):
+        # Every reading is AUTH_BACKOFF_TIME / 2 later, so retries give up after the second attempt.
+        now_ = datetime.datetime(2021, 1, 1)
+
+        @classmethod
+        def now(cls, tz=None):
+            cls.now_ += datetime.timedelta(seconds=auth.AUTH_BACKOFF_TIME / 2 + 0.1)
+            return cls.now_
+
+    monkeypatch.setattr(backoff._async, "datetime", SimpleNamespace(datetime=Clock))
+    session = TimingOutSession(timeouts=10)
+    monkeypatch.setattr(auth, "session", session)
+
+    with pytest.raises(HTTPException) as error:
+        await auth.check_token("good", ("user",))
+    assert error.value.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert session.calls == 2
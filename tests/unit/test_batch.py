@@ -0,0 +1,76 @@
+from http import HTTPStatus
+
+import orjson
+import pytest
+from fastapi import FastAPI
+from starlette.routing import Match
+
+from api.v1 import film
+from models.film import Film
+from models.person import Person
+from services import auth
+from services.film import FilmService, get_film_service
+from services.person import PersonService
+
+from tests.support.asgi import request
+
+from .factories import make_film, make_person
+from .fakes import FakeCache, FakeStorage
+
+
+@pytest.mark.asyncio
+async def test_films_batch_uses_one_round_trip_per_tier():
+    cache, storage = FakeCache(), FakeStorage([make_film(f"f{i}") for i in range(50)])
+    service = FilmService(Film, cache, storage, 60)
+    await service.get_by_id("f3")
+    ids = ["f3", "f1", "missing", "f2", "f1"]
+
+    films = await service.get_many(ids)
+
+    assert [f.id for f in films] == ["f3", "f1", "f2"]
+    assert storage.calls["get_many"] == 1
+    assert cache.calls["get_many"] == 1
+    assert cache.calls["set_many"] == 1
+
+    films = await service.get_many(ids)
+    assert [f.id for f in films] == ["f3", "f1", "f2"]
+    assert storage.calls["get_many"] == 2  # only "missing" is requested again
+
+
+@pytest.mark.asyncio
+async def test_persons_batch_includes_films():
+    person = make_person("p1")
+    storage = FakeStorage([person, make_person("p2")])
+    film_storage = FakeStorage([make_film("f1", actors=[person])])
+    service = PersonService(Person, FakeCache(), storage, film_storage)
+
+    persons = await service.get_many(["p1", "p2"])
+
+    assert [p.id for p in persons] == ["p1", "p2"]
+    assert {"id": "f1", "role": "actor"} in [f.dict() for f in persons[0].films]
+
+
+@pytest.mark.asyncio
+async def test_static_routes_are_not_taken_for_film_ids(monkeypatch):
+    async def check_token(token, roles):
+        return HTTPStatus.OK
+
+    monkeypatch.setattr(auth, "check_token", check_token)
+    auth.verdicts.clear()
+    service = FilmService(Film, FakeCache(), FakeStorage([make_film("f1"), make_film("f2")]), 60)
+    app = FastAPI()
+    app.include_router(film.router, prefix="/api/v1/film")
+    app.dependency_overrides[get_film_service] = lambda: service
+    headers = {"Authorization": "Bearer user"}
+
+    for path in ("/api/v1/film/batch", "/api/v1/film/batch/"):
+        response = await request(app, path, [("ids", "f2"), ("ids", "f1")], headers)
+        assert response.status == HTTPStatus.OK
+        assert [item["id"] for item in orjson.loads(response.body)] == ["f2", "f1"]
+    details = await request(app, "/api/v1/film/f1", headers=headers)
+
+    assert orjson.loads(details.body)["id"] == "f1"
+    # Streaming responses are not driven here: check which route takes the export path.
+    scope = {"type": "http", "method": "GET", "path": "/api/v1/film/export"}
+    route = next(route for route in app.router.routes if route.matches(scope)[0] == Match.FULL)
+    assert route.endpoint is film.films_export
@@ -0,0 +1,44 @@
+import pytest
+
+from models.film import Film
+from services import cache_keys
+from services.cache_keys import cache_key, normalize_query, normalize_sort
+from services.film import FilmService
+
+from .factories import make_film
+from .fakes import FakeCache, FakeStorage
+
+
+def test_normalization():
+    assert normalize_query("  Star   WARS ") == "star wars"
+    assert normalize_query("   ") is None
+    assert normalize_sort("+imdb_rating") == normalize_sort("imdb_rating") == "imdb_rating"
+    assert normalize_sort("-imdb_rating") == "-imdb_rating"
+
+
+def test_keys_are_short_and_stable():
+    key = cache_key("film_search", "search", query="a" * 1000, page=1, size=10, sort=None, genre=None)
+    same = cache_key("film_search", "search", genre=None, sort=None, size=10, page=1, query="a" * 1000)
+    other = cache_key("film_search", "search", query="a" * 1000, page=2, size=10, sort=None, genre=None)
+
+    assert key == same != other
+    assert len(key) < 64
+    assert cache_key("film_search", "f1") == "v1:film_search:f1"
+
+
+def test_version_bump_changes_keys(monkeypatch):
+    before = cache_key("film_search", "search", query="star")
+    monkeypatch.setattr(cache_keys, "CACHE_KEY_VERSION", "2")
+    assert cache_key("film_search", "search", query="star") != before
+
+
+@pytest.mark.asyncio
+async def test_equivalent_searches_share_cache_entry():
+    cache, storage = FakeCache(), FakeStorage([make_film("f1")])
+    service = FilmService(Film, cache, storage, 60)
+
+    await service.get_by_search(query="Star Wars", sort="imdb_rating")
+    await service.get_by_search(query=" star  wars", sort="+imdb_rating")
+
+    assert storage.calls["search"] == 1
+    assert len(cache.data) == 1
@@ -0,0 +1,202 @@
+from http import HTTPStatus
+
+import elasticsearch
+import pytest
+from fastapi import HTTPException
+from prometheus_client import REGISTRY
+
+from core.circuit_breaker import BackendUnavailable, CircuitBreaker, CircuitOpenError
+from core.deadline import deadline
+from db import es_storage, redis_cache
+from db.es_storage import AsyncElasticsearchStorage
+from db.redis_cache import RedisCache
+from models.film import Film
+from services import basic
+from services.film import FilmService
+
+from .factories import make_film
+from .fakes import FakeCache, FakeStorage
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def create_breaker(clock: Clock, **settings) -> CircuitBreaker:
+    settings = {"window": 10, "min_calls": 4, "error_rate": 0.5, "open_time": 5, "probes": 1, **settings}
+    return CircuitBreaker("test", lambda error: isinstance(error, ConnectionError), clock=clock, **settings)
+
+
+def call(breaker: CircuitBreaker, error: BaseException = None):
+    with breaker:
+        if error:
+            raise error
+
+
+def fail(breaker: CircuitBreaker, times: int = 1):
+    for _ in range(times):
+        with pytest.raises(ConnectionError):
+            call(breaker, ConnectionError())
+
+
+def transitions(state: str) -> float:
+    return REGISTRY.get_sample_value("circuit_breaker_transitions_total", {"backend": "test", "state": state}) or 0.0
+
+
+def test_breaker_opens_on_error_rate_and_rejects_calls():
+    clock = Clock()
+    breaker = create_breaker(clock)
+    opened = transitions("open")
+
+    call(breaker)
+    fail(breaker, 2)
+    assert breaker.state == CircuitBreaker.CLOSED
+    fail(breaker)
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert transitions("open") == opened + 1
+    clock.now += 2
+    with pytest.raises(CircuitOpenError) as error:
+        call(breaker)
+    assert error.value.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert error.value.headers == {"Retry-After": "3"}
+
+
+def test_other_errors_and_old_failures_do_not_count():
+    clock = Clock()
+    breaker = create_breaker(clock)
+
+    fail(breaker, 3)
+    with pytest.raises(KeyError):
+        call(breaker, KeyError())
+    clock.now += 10
+    fail(breaker)
+
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    clock = Clock()
+    breaker = create_breaker(clock, min_calls=1)
+    fail(breaker)
+    clock.now += 5
+
+    with breaker:
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            call(breaker)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    fail(breaker)
+    clock.now += 5
+    fail(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        call(breaker)
+
+
+class BrokenRedis:
+    """Every command fails as if Redis refused the connection."""
+
+    def __getattr__(self, name):
+        async def command(*args, **kwargs):
+            raise ConnectionRefusedError()
+        return command
+
+    def pipeline(self):
+        return BrokenPipeline()
+
+
+class BrokenPipeline:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    async def execute(self):
+        raise ConnectionRefusedError()
+
+
+@pytest.mark.asyncio
+async def test_unavailable_redis_is_bypassed(monkeypatch):
+    monkeypatch.setattr(redis_cache, "redis", BrokenRedis())
+    monkeypatch.setattr(redis_cache, "breaker", create_breaker(Clock(), min_calls=2))
+    cache = RedisCache()
+
+    assert await cache.get("a") is None
+    assert await cache.get_many(["a", "b"]) == [None, None]
+    assert redis_cache.breaker.state == CircuitBreaker.OPEN
+    await cache.set("a", "1", expire=10)
+    await cache.set_many({"a": "1"}, expire=10)
+    await cache.add_tags({"a": ["tag"]}, expire=10)
+
+    assert REGISTRY.get_sample_value("cache_bypass_total", {"operation": "set"}) >= 1
+
+
+@pytest.mark.asyncio
+async def test_open_breaker_stops_storage_retries(monkeypatch):
+    calls = []
+
+    class DownElasticsearch:
+        async def get(self, index, id, request_timeout=None):
+            calls.append(id)
+            raise elasticsearch.ConnectionError("N/A", "connection refused", None)
+
+    monkeypatch.setattr(es_storage, "es", DownElasticsearch())
+    monkeypatch.setattr(es_storage, "breaker", CircuitBreaker("elasticsearch", es_storage.is_failure, min_calls=1))
+    storage = AsyncElasticsearchStorage(Film, "movies")
+
+    with pytest.raises(CircuitOpenError):
+        await storage.get("f1")
+    with pytest.raises(CircuitOpenError):
+        await storage.get("f1")
+
+    assert calls == ["f1"]
+
+
+@pytest.mark.asyncio
+async def test_timeout_cut_by_request_deadline_is_not_a_failure(monkeypatch):
+    timeouts = []
+
+    class SlowElasticsearch:
+        async def get(self, index, id, request_timeout=None):
+            timeouts.append(request_timeout)
+            raise elasticsearch.ConnectionTimeout("TIMEOUT", "read timed out", None)
+
+    monkeypatch.setattr(es_storage, "es", SlowElasticsearch())
+    monkeypatch.setattr(es_storage, "breaker", CircuitBreaker("elasticsearch", es_storage.is_failure, min_calls=1))
+    storage = AsyncElasticsearchStorage(Film, "movies")
+
+    with deadline(0.5), pytest.raises(HTTPException) as error:
+        await storage.get("f1")
+
+    assert error.value.status_code == HTTPStatus.GATEWAY_TIMEOUT
+    assert len(timeouts) == 1 and timeouts[0] < es_storage.ES_TIMEOUT
+    assert es_storage.breaker.state == CircuitBreaker.CLOSED
+    # Without a deadline the call had the full ES_TIMEOUT: its timeout is a failure of ES.
+    with pytest.raises(elasticsearch.ConnectionTimeout):
+        with es_storage.breaker, es_storage.backend_timeout() as timeout:
+            assert timeout == es_storage.ES_TIMEOUT
+            raise elasticsearch.ConnectionTimeout("TIMEOUT", "read timed out", None)
+    assert es_storage.breaker.state == CircuitBreaker.OPEN
+
+
+@pytest.mark.asyncio
+async def test_expired_list_is_served_while_storage_is_unavailable(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(basic.time, "time", lambda: now[0])
+    storage = FakeStorage([make_film("f1")])
+    service = FilmService(Film, FakeCache(), storage, 60)
+    await service.get_by_search()
+
+    async def unavailable(*args, **kwargs):
+        raise CircuitOpenError("elasticsearch")
+
+    monkeypatch.setattr(storage, "search_page", unavailable)
+    now[0] += 60 + basic.CACHE_STALE_TTL + 1
+
+    assert [film.id for film in await service.get_by_search()] == ["f1"]
+    with pytest.raises(BackendUnavailable):
+        await service.get_by_search(query="other")
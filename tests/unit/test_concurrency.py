@@ -0,0 +1,119 @@
+import asyncio
+from http import HTTPStatus
+
+import pytest
+from fastapi import HTTPException
+
+from api.v1.genre import genre_details
+from core.deadline import deadline, remaining, request_timeout
+from models.genre import Genre
+from models.person import Person
+from services.concurrency import gather
+from services.genre import GenreService
+from services.person import PersonService
+
+from .factories import make_film, make_genre, make_person
+from .fakes import FakeCache, FakeStorage, InFlight
+
+LATENCY = 0.1
+
+
+@pytest.mark.asyncio
+async def test_gather_runs_all_calls_at_once():
+    in_flight = InFlight()
+
+    async def call(result: str) -> str:
+        await in_flight.wait(0.01)
+        return result
+
+    results = await gather(call("a"), call("b"), call("c"))
+
+    assert results == ["a", "b", "c"]
+    assert in_flight.peak == 3
+
+
+@pytest.mark.asyncio
+async def test_gather_cancels_siblings_on_failure():
+    finished = []
+
+    async def slow():
+        await asyncio.sleep(LATENCY)
+        finished.append("slow")
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await gather(slow(), failing())
+    await asyncio.sleep(LATENCY)
+
+    assert finished == []
+
+
+@pytest.mark.asyncio
+async def test_gather_limits_concurrency():
+    running, peak = 0, 0
+
+    async def call(i: int) -> int:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return i
+
+    assert await gather(*(call(i) for i in range(10)), limit=3) == list(range(10))
+    assert peak == 3
+
+
+@pytest.mark.asyncio
+async def test_deadline_is_shared_by_calls_of_the_request():
+    assert remaining() is None
+    with deadline(0.05):
+        assert 0 < request_timeout() <= 0.05
+        with pytest.raises(HTTPException) as error:
+            await gather(asyncio.sleep(LATENCY), asyncio.sleep(LATENCY))
+        assert error.value.status_code == HTTPStatus.GATEWAY_TIMEOUT
+        with pytest.raises(HTTPException):
+            request_timeout()
+    assert remaining() is None
+
+
+@pytest.mark.asyncio
+async def test_nested_deadline_does_not_extend_the_budget():
+    with deadline(0.05):
+        with deadline(10):
+            assert remaining() <= 0.05
+
+
+@pytest.mark.asyncio
+async def test_person_and_roles_are_loaded_concurrently():
+    person = make_person("p1")
+    in_flight = InFlight()
+    storage = FakeStorage([person], in_flight=in_flight)
+    film_storage = FakeStorage([make_film("f1", actors=[person])], in_flight=in_flight)
+    service = PersonService(Person, FakeCache(), storage, film_storage)
+
+    found = await service.get_by_id("p1")
+
+    assert [film.id for film in found.films] == ["f1"]
+    assert in_flight.peak == 2
+
+
+@pytest.mark.asyncio
+async def test_genre_details_load_genre_and_popularity_concurrently():
+    genre = make_genre("g1")
+    in_flight = InFlight()
+    service = GenreService(Genre, FakeCache(), FakeStorage([genre], in_flight=in_flight),
+                           FakeStorage([make_film("f1", genres=[genre])], in_flight=in_flight), 60, 60)
+
+    details = await genre_details("g1", service)
+
+    assert (details.id, details.popularity) == ("g1", 1)
+    assert in_flight.peak == 2
+    with pytest.raises(HTTPException) as error:
+        await genre_details("unknown", service)
+    assert error.value.status_code == HTTPStatus.NOT_FOUND
+    assert service._popularity_key("g1") in service.cache.data
+    assert service._popularity_key("unknown") not in service.cache.data
@@ -0,0 +1,102 @@
+import elasticsearch
+import orjson
+import pytest
+
+from core.circuit_breaker import CircuitBreaker, CircuitOpenError
+from db import es_storage
+from db.es_storage import AsyncElasticsearchStorage
+from models.film import Film
+from services.film import FilmService
+
+from .factories import make_film
+from .fakes import FakeCache, FakeStorage
+
+
+class FakeElasticsearch:
+    """Serves `_source` of documents through point-in-time search."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.requests = []
+        self.closed = []
+
+    async def open_point_in_time(self, index, keep_alive, request_timeout=None):
+        return {"id": "pit-1"}
+
+    async def close_point_in_time(self, body, request_timeout=None):
+        self.closed.append(body["id"])
+
+    async def search(self, body, request_timeout=None):
+        self.requests.append(orjson.loads(orjson.dumps(body)))
+        start = body.get("search_after", [-1])[0] + 1
+        hits = [{"_source": doc, "sort": [start + i]} for i, doc in enumerate(self.docs[start:start + body["size"]])]
+        return {"pit_id": "pit-2", "hits": {"hits": hits}}
+
+
+@pytest.mark.asyncio
+async def test_es_scan_walks_index_with_point_in_time(monkeypatch):
+    client = FakeElasticsearch([{"id": str(i)} for i in range(5)])
+    monkeypatch.setattr(es_storage, "es", client)
+    storage = AsyncElasticsearchStorage(Film, "movies")
+
+    batches = [batch async for batch in storage.scan({}, size=2, source=["id"])]
+
+    assert [[doc["id"] for doc in batch] for batch in batches] == [["0", "1"], ["2", "3"], ["4"]]
+    assert client.requests[0]["pit"]["id"] == "pit-1"
+    assert client.requests[1]["pit"]["id"] == "pit-2"
+    assert client.requests[1]["search_after"] == [1]
+    assert client.requests[0]["_source"] == ["id"]
+    assert client.closed == ["pit-2"]
+
+
+class DownElasticsearch(FakeElasticsearch):
+    """Serves the first page, then every search fails as if ES went down."""
+
+    async def search(self, body, request_timeout=None):
+        if self.requests:
+            raise elasticsearch.ConnectionError("N/A", "connection refused", None)
+        return await super().search(body)
+
+
+@pytest.mark.asyncio
+async def test_es_scan_of_unavailable_es_trips_breaker(monkeypatch):
+    monkeypatch.setattr(es_storage, "breaker", CircuitBreaker("elasticsearch", es_storage.is_failure, min_calls=1))
+    client = DownElasticsearch([{"id": str(i)} for i in range(5)])
+    monkeypatch.setattr(es_storage, "es", client)
+    storage = AsyncElasticsearchStorage(Film, "movies")
+
+    batches = []
+    with pytest.raises(CircuitOpenError):
+        async for batch in storage.scan({}, size=2):
+            batches.append(batch)
+
+    assert len(batches) == 1
+    assert es_storage.breaker.state == CircuitBreaker.OPEN
+    # The open breaker rejected the close too: the point in time expires by itself.
+    assert client.closed == []
+
+
+@pytest.mark.asyncio
+async def test_es_scan_closes_only_opened_point_in_time(monkeypatch):
+    class MissingIndex(FakeElasticsearch):
+        async def open_point_in_time(self, index, keep_alive, request_timeout=None):
+            raise elasticsearch.NotFoundError(404, "index_not_found_exception", {})
+
+    client = MissingIndex([])
+    monkeypatch.setattr(es_storage, "es", client)
+
+    with pytest.raises(elasticsearch.NotFoundError):
+        await AsyncElasticsearchStorage(Film, "movies").scan({}, size=2).__anext__()
+
+    assert client.closed == []
+
+
+@pytest.mark.asyncio
+async def test_export_is_ndjson_with_selected_fields():
+    storage = FakeStorage([make_film(f"f{i}") for i in range(3)])
+    service = FilmService(Film, FakeCache(), storage, 60)
+
+    chunks = [chunk async for chunk in service.export(["id", "title"])]
+    rows = [orjson.loads(line) for line in b"".join(chunks).splitlines()]
+
+    assert rows == [{"id": f"f{i}", "title": f"Film f{i}"} for i in range(3)]
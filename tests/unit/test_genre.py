@@ -0,0 +1,67 @@
+import pytest
+
+from models.genre import Genre
+from services.genre import GenreService, create_genres_popularity_query
+from services.pagination import Page
+
+from .factories import make_film, make_genre
+from .fakes import FakeCache, FakeStorage
+
+
+def make_service():
+    genres = [make_genre(f"g{i}") for i in range(50)]
+    films = [make_film(f"f{i}", genres=genres[:i % 5 + 1]) for i in range(20)]
+    return GenreService(Genre, FakeCache(), FakeStorage(genres), FakeStorage(films), 60, 60)
+
+
+def test_popularity_query_counts_films_of_requested_genres():
+    query = create_genres_popularity_query(["g1", "g2"])
+    terms = query["aggs"]["genres"]["aggs"]["ids"]
+    assert terms["terms"] == {"field": "genres.id", "size": 2, "include": ["g1", "g2"]}
+    assert terms["aggs"] == {"films": {"reverse_nested": {}}}
+
+
+@pytest.mark.asyncio
+async def test_popularity_of_page_costs_one_request_per_tier():
+    service = make_service()
+    genre_ids = [f"g{i}" for i in range(50)]
+
+    popularity = await service.get_genres_popularity(genre_ids)
+
+    assert popularity["g0"] == 20
+    assert popularity["g4"] == 4
+    assert popularity["g49"] == 0
+    assert service.film_storage.calls["aggregate"] == 1
+    assert service.cache.calls["get_many"] == 1
+    assert service.cache.calls["set_many"] == 1
+
+    assert await service.get_genres_popularity(genre_ids) == popularity
+    assert await service.get_genre_popularity("g49") == 0
+    assert service.film_storage.calls["aggregate"] == 1
+
+
+@pytest.mark.asyncio
+async def test_refresh_fills_popularity_table():
+    service = make_service()
+
+    await service.refresh_genres_popularity(expire=600)
+    popularity = await service.get_genres_popularity(["g0", "g1"])
+
+    assert popularity == {"g0": 20, "g1": 16}
+    assert service.film_storage.calls["aggregate"] == 1
+
+
+@pytest.mark.asyncio
+async def test_genre_cursor_pages_are_pages_of_genres():
+    service = make_service()
+
+    seen, cursor = [], ""
+    while cursor is not None:
+        page = await service.get_by_cursor(cursor=cursor, size=20)
+        assert isinstance(page, Page)
+        assert all(isinstance(genre, Genre) for genre in page.items)
+        seen.extend(genre.id for genre in page.items)
+        cursor = page.next_cursor
+
+    assert sorted(seen) == sorted(f"g{i}" for i in range(50))
+    assert service.storage.calls["search"] == 3
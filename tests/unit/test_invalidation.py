@@ -0,0 +1,239 @@
+import asyncio
+import time
+
+import orjson
+import pytest
+
+from db import redis_cache
+from db.memory_cache import LocalCache
+from db.redis_cache import RedisCache
+from db.tiered_cache import TieredCache
+from models.film import Film
+from models.person import Person
+from services.cache_keys import cache_key
+from services import invalidation
+from services.film import FilmService
+from services.invalidation import consume_invalidation_events, event_tags, eviction_message, handle_event
+from services.person import PersonService
+
+from tests.support.stubs import StubRedis
+
+from .factories import make_film, make_person
+from .fakes import FakeCache, FakeStorage
+
+
+def event(entity: str, *ids: str) -> bytes:
+    return orjson.dumps({"type": entity, "ids": list(ids)})
+
+
+def test_event_tags():
+    assert event_tags({"type": "film", "ids": ["f1"]}) == ["list:film", "film:f1"]
+    for malformed in ({"type": "cinema", "ids": []}, {"type": "film", "ids": "f1"}, []):
+        with pytest.raises(ValueError):
+            event_tags(malformed)
+
+
+@pytest.mark.asyncio
+async def test_film_change_drops_dependent_values():
+    person = make_person("p1")
+    cache = FakeCache()
+    film_storage = FakeStorage([make_film("f1", actors=[person]), make_film("f2")])
+    films = FilmService(Film, cache, film_storage, 60)
+    persons = PersonService(Person, cache, FakeStorage([person]), film_storage)
+
+    await films.get_by_id("f1")
+    await films.get_by_id("f2")
+    await films.get_by_search(query="star")
+    await persons.get_by_id("p1")
+    await persons.get_films_by_person("p1")
+    await persons.search("", 1, 5)
+
+    before = set(cache.data)
+    deleted = await handle_event(cache, event("film", "f1"))
+
+    # Details of f1, the film list, p1 with its filmography; f2 and person lists survive.
+    assert len(deleted) == 4
+    assert before - set(cache.data) == set(deleted)
+    assert await films.get_by_id("f2") is not None
+    assert len(cache.data) == len(before) - 4
+
+
+@pytest.mark.asyncio
+async def test_person_change_drops_films_with_person():
+    person = make_person("p1")
+    cache = FakeCache()
+    films = FilmService(Film, cache, FakeStorage([make_film("f1", directors=[person]), make_film("f2")]), 60)
+    await films.get_many(["f1", "f2"])
+
+    deleted = await handle_event(cache, event("person", "p1"))
+
+    assert deleted == [cache_key("film_search", "f1")]
+    assert len(cache.data) == 1
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_drops_local_copies():
+    remote = FakeCache()
+    cache = TieredCache(remote=remote, local=LocalCache(max_size=10))
+    await cache.set("key", "old", expire=60)
+    await cache.add_tags({"key": ["film:f1"]}, expire=60)
+    assert await cache.get_object("key", bytes.decode) == "old"
+
+    await handle_event(cache, event("film", "f1"))
+
+    assert await cache.get_object("key", bytes.decode) is None
+
+
+@pytest.mark.asyncio
+async def test_eviction_message_drops_only_local_copies():
+    remote = FakeCache()
+    cache = TieredCache(remote=remote, local=LocalCache(max_size=10))
+    await cache.set("key", "value", expire=60)
+    await cache.get_object("key", bytes.decode)
+    remote.data["key"] = "changed"
+
+    assert await handle_event(cache, eviction_message(["key"])) == []
+    assert await cache.get_object("key", bytes.decode) == "changed"
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    stub = StubRedis()
+    monkeypatch.setattr(redis_cache, "redis", stub)
+    return stub
+
+
+@pytest.mark.asyncio
+async def test_invalidated_keys_leave_tag_sets(redis):
+    cache = RedisCache()
+    await cache.set_many({"a": "1", "b": "2"}, expire=60)
+    await cache.add_tags({"a": ["film:f1", "list:film"], "b": ["list:film"]}, expire=60)
+
+    assert await cache.invalidate_tags(["film:f1"]) == ["a"]
+    assert await cache.invalidate_tags(["film:f1"]) == []
+
+    assert redis.sets["tags:film:f1"] == set()
+    assert "a" not in redis.data and "b" in redis.data
+    assert await cache.invalidate_tags(["list:film"]) == ["a", "b"]
+    assert redis.sets["tags:list:film"] == set()
+    assert "b" not in redis.data
+
+
+@pytest.mark.asyncio
+async def test_tag_set_over_limit_drops_its_values(redis, monkeypatch):
+    monkeypatch.setattr(redis_cache, "CACHE_TAG_MAX_KEYS", 3)
+    cache = RedisCache()
+    keys = [f"k{i}" for i in range(5)]
+    await cache.set_many(dict.fromkeys(keys, "1"), expire=60)
+
+    await cache.add_tags(dict.fromkeys(keys, ["list:film"]), expire=60)
+
+    assert len(redis.sets["tags:list:film"]) == 3
+    assert {key.encode() for key in redis.data} == redis.sets["tags:list:film"]
+
+
+@pytest.mark.asyncio
+async def test_value_loaded_before_invalidation_is_not_cached(redis):
+    cache = RedisCache()
+    loaded_at = time.time()
+    await cache.invalidate_tags(["film:f1"])
+    await cache.set_many({"stale": "old", "fresh": "new"}, expire=60)
+
+    await cache.add_tags({"stale": ["film:f1"], "fresh": ["film:f2"]}, expire=60, since=loaded_at)
+
+    assert "stale" not in redis.data
+    assert redis.data["fresh"] == b"new"
+
+
+@pytest.mark.asyncio
+async def test_load_racing_with_event_does_not_cache_old_record():
+    cache = FakeCache()
+    storage = FakeStorage([make_film("f1")])
+    films = FilmService(Film, cache, storage, 60)
+
+    async def read_then_wait(film_id):
+        film = storage.docs.get(film_id)
+        await asyncio.sleep(0.05)
+        return film
+
+    storage.get = read_then_wait
+    load = asyncio.ensure_future(films.get_by_id("f1"))
+    await asyncio.sleep(0.01)
+    storage.docs["f1"] = make_film("f1").copy(update={"title": "Changed"})
+    await handle_event(cache, event("film", "f1"))
+
+    assert (await load).title == "Film f1"
+    assert (await films.get_by_id("f1")).title == "Changed"
+
+
+class PubSubClient:
+    def __init__(self, messages):
+        self.messages = messages
+        self.subscribed = 0
+        self.published = []
+
+    async def subscribe(self, name):
+        self.subscribed += 1
+        return [self]
+
+    async def iter(self):
+        for message in self.messages:
+            yield message
+        await asyncio.Event().wait()
+
+    async def publish(self, name, message):
+        self.published.append(orjson.loads(message))
+
+
+class FlakyCache(FakeCache):
+    """Redis fails on the first `failures` invalidations."""
+
+    def __init__(self, messages, failures):
+        super().__init__()
+        self.pubsub = PubSubClient(messages)
+        self.failures = failures
+
+    @property
+    def client(self):
+        return self.pubsub
+
+    async def invalidate_tags(self, tags):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionRefusedError()
+        return await super().invalidate_tags(tags)
+
+
+async def consume(cache: FlakyCache, monkeypatch):
+    monkeypatch.setattr(invalidation, "get_current_cache", lambda: cache)
+    task = asyncio.ensure_future(consume_invalidation_events("events"))
+    await asyncio.sleep(0.6)
+    task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_failed_event_is_retried(monkeypatch):
+    cache = FlakyCache([event("film", "f1")], failures=1)
+    await cache.set("a", "1", expire=60)
+    await cache.add_tags({"a": ["film:f1"]}, expire=60)
+
+    await consume(cache, monkeypatch)
+
+    assert "a" not in cache.data
+    assert cache.pubsub.published == [{"evict": ["a"]}]
+    assert cache.pubsub.subscribed == 1
+
+
+@pytest.mark.asyncio
+async def test_event_is_dropped_after_retry_time(monkeypatch):
+    monkeypatch.setattr(invalidation, "CACHE_INVALIDATION_RETRY_TIME", 0)
+    cache = FlakyCache([b"not json", event("film", "f1"), event("film", "f2")], failures=1)
+    await cache.set_many({"a": "1", "b": "2"}, expire=60)
+    await cache.add_tags({"a": ["film:f1"], "b": ["film:f2"]}, expire=60)
+
+    await consume(cache, monkeypatch)
+
+    # The consumer goes on with the next event on the same subscription.
+    assert "a" in cache.data
+    assert "b" not in cache.data
+    assert cache.pubsub.subscribed == 1
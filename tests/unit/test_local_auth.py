@@ -0,0 +1,53 @@
+import time
+from http import HTTPStatus
+
+import pytest
+import rsa
+from jose import jwt
+
+from services import local_auth
+
+
+@pytest.fixture(scope="module")
+def private_keys():
+    return [rsa.newkeys(1024)[1].save_pkcs1().decode() for _ in range(2)]
+
+
+@pytest.fixture
+def key_file(tmp_path, private_keys, monkeypatch):
+    public_key = rsa.PrivateKey.load_pkcs1(private_keys[0].encode())
+    path = tmp_path / "public.pem"
+    path.write_bytes(rsa.PublicKey(public_key.n, public_key.e).save_pkcs1())
+    monkeypatch.setattr(local_auth, "key_store", local_auth.KeyStore(key_file=str(path)))
+    return path
+
+
+def make_token(private_key, roles, expires_in=60):
+    return jwt.encode({"roles": roles, "exp": int(time.time()) + expires_in}, private_key, algorithm="RS256")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("roles", "expires_in", "verdict"),
+    (
+        (["user"], 60, HTTPStatus.OK),
+        (["guest"], 60, HTTPStatus.FORBIDDEN),
+        (["user"], -60, HTTPStatus.UNAUTHORIZED),
+    )
+)
+async def test_token_is_verified_locally(key_file, private_keys, roles, expires_in, verdict):
+    token = make_token(private_keys[0], roles, expires_in)
+    assert await local_auth.verify_token(token, ("user", "admin"), session=None) == verdict
+
+
+@pytest.mark.asyncio
+async def test_token_signed_with_other_key_is_rejected(key_file, private_keys):
+    token = make_token(private_keys[1], ["user"])
+    assert await local_auth.verify_token(token, ("user",), session=None) == HTTPStatus.UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_no_key_means_no_verdict(monkeypatch, private_keys):
+    monkeypatch.setattr(local_auth, "key_store", local_auth.KeyStore())
+    token = make_token(private_keys[0], ["user"])
+    assert await local_auth.verify_token(token, ("user",), session=None) is None
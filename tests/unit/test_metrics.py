@@ -0,0 +1,87 @@
+from http import HTTPStatus
+
+import pytest
+from fastapi import APIRouter, FastAPI, HTTPException
+from prometheus_client import REGISTRY
+
+from api import metrics
+from api.instrumentation import InstrumentedRoute
+from core.metrics import count_retry, observe_call
+from models.film import Film
+from services.film import FilmService
+
+from tests.support.asgi import request
+
+from .factories import make_film
+from .fakes import FakeCache, FakeStorage
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def create_app() -> FastAPI:
+    router = APIRouter(route_class=InstrumentedRoute)
+
+    @router.get("/{item_id}")
+    async def item(item_id: str):
+        if item_id == "missing":
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
+        return {"id": item_id}
+
+    app = FastAPI()
+    app.include_router(metrics.router)
+    app.include_router(router, prefix="/items")
+    return app
+
+
+@pytest.mark.asyncio
+async def test_request_latency_is_labeled_with_route_template():
+    app = create_app()
+    labels = {"method": "GET", "route": "/items/{item_id}"}
+    ok = sample("http_request_duration_seconds_count", status="200", **labels)
+    not_found = sample("http_request_duration_seconds_count", status="404", **labels)
+
+    await request(app, "/items/1")
+    await request(app, "/items/2")
+    await request(app, "/items/missing")
+
+    assert sample("http_request_duration_seconds_count", status="200", **labels) == ok + 2
+    assert sample("http_request_duration_seconds_count", status="404", **labels) == not_found + 1
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_exposes_backends_and_in_process_stats():
+    response = await request(create_app(), "/metrics")
+
+    assert response.status == HTTPStatus.OK
+    assert b"backend_call_duration_seconds" in response.body
+    assert b"background_tasks_pending" in response.body
+    assert b"auth_cache_hits" in response.body
+
+
+def test_backend_calls_record_errors_and_retries():
+    errors = sample("backend_call_errors_total", backend="test", operation="get", error="ValueError")
+    calls = sample("backend_call_duration_seconds_count", backend="test", operation="get")
+
+    with pytest.raises(ValueError):
+        with observe_call("test", "get"):
+            raise ValueError()
+    count_retry("test", "get")({})
+
+    assert sample("backend_call_errors_total", backend="test", operation="get", error="ValueError") == errors + 1
+    assert sample("backend_call_duration_seconds_count", backend="test", operation="get") == calls + 1
+    assert sample("backend_call_retries_total", backend="test", operation="get") == 1
+
+
+@pytest.mark.asyncio
+async def test_service_counts_cache_hits_and_misses_per_prefix():
+    service = FilmService(Film, FakeCache(), FakeStorage([make_film("f1")]), 60)
+    hits, misses = (sample("cache_lookups_total", prefix="film_search", result=result) for result in ("hit", "miss"))
+
+    await service.get_by_id("f1")
+    await service.get_by_id("f1")
+    await service.get_many(["f1", "f2"])
+
+    assert sample("cache_lookups_total", prefix="film_search", result="hit") == hits + 2
+    assert sample("cache_lookups_total", prefix="film_search", result="miss") == misses + 2
@@ -0,0 +1,26 @@
+import orjson
+import pytest
+from pydantic import ValidationError
+
+from models.basic import orjson_dumps
+from models.film import Film, FilmPreview
+
+from .factories import make_film
+
+
+def test_models_serialize_json_with_orjson():
+    film = make_film("f1")
+
+    assert Film.__config__.json_dumps is orjson_dumps
+    assert FilmPreview.__config__.json_loads is orjson.loads
+    # The standard json module puts spaces after separators, orjson does not.
+    assert film.json().startswith('{"id":"f1",')
+    assert Film.parse_raw(film.json()) == film
+
+
+def test_models_parse_json_with_orjson():
+    data = make_film("f1").json().replace("7.5", "NaN")
+
+    # The standard json module accepts NaN, orjson rejects it.
+    with pytest.raises(ValidationError):
+        Film.parse_raw(data)
@@ -0,0 +1,74 @@
+import pytest
+
+from core.config import ES_TRACK_TOTAL_HITS
+from db import es_storage
+from db.es_storage import AsyncElasticsearchStorage
+from db.storage import SearchError, source_fields
+from models.film import Film, FilmPreview
+from services.film import FilmService
+
+from .factories import make_film
+from .fakes import FakeCache, FakeStorage
+
+
+class FakeElasticsearch:
+    """Answers every msearch query with all documents, a query with "fail" key gets an error."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.bodies = []
+
+    async def msearch(self, body, index, request_timeout=None):
+        self.bodies.append(body)
+        hits = [{"_source": doc, "sort": [doc["id"]]} for doc in self.docs]
+        error = {"error": {"type": "search_phase_execution_exception", "reason": "bad query"}, "status": 400}
+        return {"responses": [error if "fail" in query else {"hits": {"total": {"value": len(hits)}, "hits": hits}}
+                              for query in body[1::2]]}
+
+
+@pytest.mark.asyncio
+async def test_multi_search_sends_all_queries_at_once(monkeypatch):
+    film = make_film("f1")
+    client = FakeElasticsearch([film.dict()])
+    monkeypatch.setattr(es_storage, "es", client)
+    storage = AsyncElasticsearchStorage(Film, "movies")
+
+    first, failed, second = await storage.multi_search([{"size": 1}, {"fail": True}, {}], model=FilmPreview)
+
+    assert len(client.bodies) == 1
+    assert client.bodies[0][0] == {}
+    assert client.bodies[0][1] == {"size": 1, "track_total_hits": ES_TRACK_TOTAL_HITS,
+                                   "_source": source_fields(FilmPreview)}
+    assert first.items == second.items == [FilmPreview(**film.dict())]
+    assert first.total == 1 and first.last_sort == ["f1"]
+    assert failed == SearchError(type="search_phase_execution_exception", reason="bad query", status=400)
+    assert await storage.multi_search([]) == []
+
+
+@pytest.mark.asyncio
+async def test_film_pages_are_loaded_with_one_request():
+    storage = FakeStorage([make_film(f"f{i:02}") for i in range(25)])
+    service = FilmService(Film, FakeCache(), storage, 60)
+    await service.get_by_search_raw(page=1, size=10)
+
+    pages = await service.get_pages_raw([{"page": page, "size": 10} for page in (1, 2, 3, 4)])
+
+    assert [page.count for page in pages] == [10, 10, 5, 0]
+    assert (storage.calls["search"], storage.calls["multi_search"]) == (1, 1)
+    assert service.cache.calls["set_many"] == 1
+
+    assert await service.get_pages_raw([{"page": 2, "size": 10}, {"page": 3, "size": 10}]) == pages[1:3]
+    assert storage.calls["multi_search"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_page_does_not_fail_the_others(monkeypatch):
+    storage = FakeStorage([make_film("f1")])
+    service = FilmService(Film, FakeCache(), storage, 60)
+    monkeypatch.setattr("services.film.create_query_search",
+                        lambda query, *params: {"error": "bad"} if query == "broken" else {})
+
+    pages = await service.get_pages_raw([{"query": "broken"}, {"query": "fine"}])
+
+    assert pages[0] is None
+    assert pages[1].count == 1
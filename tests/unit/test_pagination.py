@@ -0,0 +1,101 @@
+import pytest
+from fastapi import HTTPException
+
+from db import es_storage
+from db.es_storage import AsyncElasticsearchStorage
+from models.film import Film
+from models.person import Person
+from services.film import FilmService, create_query_search
+from services.pagination import decode_cursor, encode_cursor
+from services.person import PersonService
+
+from tests.support.stubs import StubElasticsearch
+
+from .factories import make_film, make_person
+from .fakes import FakeCache, FakeStorage
+
+
+def test_cursor_round_trip():
+    values = [8.5, "0fdad8d4-6672-46a4-b5c6-529faa368ac7"]
+    assert decode_cursor(encode_cursor(values)) == values
+    assert decode_cursor("") == []
+
+
+@pytest.mark.parametrize("cursor", ("not a cursor", encode_cursor([]), encode_cursor({"a": 1})))
+def test_malformed_cursor(cursor):
+    with pytest.raises(HTTPException):
+        decode_cursor(cursor)
+
+
+def test_cursor_query_has_tiebreaker_and_no_offset():
+    query = create_query_search(sort="-imdb_rating", size=20, search_after=[8.5, "abc"])
+    assert query["sort"] == [{"imdb_rating": {"order": "desc", "missing": -1.0}}, "id"]
+    assert query["search_after"] == [8.5, "abc"]
+    assert query["size"] == 20
+    assert "from" not in query or query["from"] == 0
+
+
+@pytest.mark.asyncio
+async def test_deep_page_requires_cursor():
+    service = FilmService(Film, FakeCache(), FakeStorage(), 60)
+    with pytest.raises(HTTPException):
+        await service.get_by_search(page=1001, size=10)
+
+
+@pytest.mark.asyncio
+async def test_film_cursor_walks_whole_catalog():
+    storage = FakeStorage([make_film(f"f{i:02}") for i in range(25)])
+    service = FilmService(Film, FakeCache(), storage, 60)
+
+    seen, cursor = [], ""
+    while cursor is not None:
+        page = await service.get_by_cursor(cursor=cursor, size=10)
+        seen.extend(film.id for film in page.items)
+        cursor = page.next_cursor
+
+    assert seen == [f"f{i:02}" for i in range(25)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sort, expected", (("-imdb_rating", ["f9", "f8", "f7", "f6", "f0"]),
+                                            ("imdb_rating", ["f6", "f7", "f8", "f9", "f0"])))
+async def test_cursor_walks_past_film_without_rating(monkeypatch, sort, expected):
+    films = [make_film(f"f{i}").copy(update={"imdb_rating": i or None}) for i in (0, 6, 7, 8, 9)]
+    monkeypatch.setattr(es_storage, "es", StubElasticsearch({"movies": [film.dict() for film in films]}))
+    service = FilmService(Film, FakeCache(), AsyncElasticsearchStorage(Film, "movies"), 60)
+
+    seen, cursor = [], ""
+    while cursor is not None:
+        page = await service.get_by_cursor(cursor=cursor, size=1, sort=sort)
+        seen.extend(film.id for film in page.items)
+        cursor = page.next_cursor
+
+    assert seen == expected
+
+
+@pytest.mark.asyncio
+async def test_cursor_pages_are_cached():
+    storage = FakeStorage([make_film(f"f{i}") for i in range(5)])
+    service = FilmService(Film, FakeCache(), storage, 60)
+
+    first = await service.get_by_cursor(cursor="", size=2)
+    again = await service.get_by_cursor(cursor="", size=2)
+
+    assert [f.id for f in again.items] == [f.id for f in first.items]
+    assert again.next_cursor == first.next_cursor
+    assert storage.calls["search"] == 1
+
+
+@pytest.mark.asyncio
+async def test_person_cursor_pages_include_films():
+    persons = [make_person(f"p{i}") for i in range(3)]
+    film_storage = FakeStorage([make_film("f1", actors=persons)])
+    service = PersonService(Person, FakeCache(), FakeStorage(persons), film_storage)
+
+    page = await service.search_by_cursor("", "", 2)
+    assert [p.id for p in page.items] == ["p0", "p1"]
+    assert [f.id for f in page.items[0].films] == ["f1"]
+
+    page = await service.search_by_cursor("", page.next_cursor, 2)
+    assert [p.id for p in page.items] == ["p2"]
+    assert page.next_cursor is None
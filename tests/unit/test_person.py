@@ -0,0 +1,58 @@
+import pytest
+
+from db import es_storage
+from db.es_storage import AsyncElasticsearchStorage
+from models.film import Film
+from models.person import Person
+from services import person as person_service
+from services.person import PersonService
+
+from tests.support.stubs import StubElasticsearch
+
+from .factories import make_film, make_person
+from .fakes import FakeCache, FakeStorage
+
+
+@pytest.mark.asyncio
+async def test_search_resolves_roles_of_page_with_one_round_trip():
+    persons = [make_person(f"p{i:02}") for i in range(20)]
+    films = [make_film(f"f{i:02}", actors=[person], directors=[person]) for i, person in enumerate(persons)]
+    storage, film_storage = FakeStorage(persons), FakeStorage(films)
+    service = PersonService(Person, FakeCache(), storage, film_storage)
+
+    found = await service.search("query", 1, 20)
+
+    assert [p.id for p in found] == [p.id for p in persons]
+    assert [f.dict() for f in found[3].films] == [{"id": "f03", "role": "director"}, {"id": "f03", "role": "actor"}]
+    assert storage.calls["search"] == 1
+    assert storage.calls["get"] == storage.calls["get_many"] == 0
+    assert film_storage.calls["multi_search"] == 1
+    assert film_storage.calls["search"] == 0
+
+
+@pytest.mark.asyncio
+async def test_search_reuses_cached_persons():
+    persons = [make_person(f"p{i}") for i in range(5)]
+    storage, film_storage = FakeStorage(persons), FakeStorage([make_film("f0", writers=persons[:1])])
+    service = PersonService(Person, FakeCache(), storage, film_storage)
+    cached = await service.get_by_id("p0")
+
+    found = await service.search("query", 1, 5)
+
+    assert found[0] == cached
+    assert film_storage.calls["multi_search"] == 2
+
+
+@pytest.mark.asyncio
+async def test_prolific_person_does_not_use_up_films_limit_of_others(monkeypatch):
+    prolific, other = make_person("p1"), make_person("p2")
+    films = [make_film(f"f{i}", actors=[prolific]) for i in range(6)] + [make_film("f9", writers=[other])]
+    monkeypatch.setattr(person_service, "PERSON_FILMS_LIMIT", 3)
+    monkeypatch.setattr(es_storage, "es", StubElasticsearch({"movies": [film.dict() for film in films]}))
+    service = PersonService(Person, FakeCache(), FakeStorage([prolific, other]),
+                            AsyncElasticsearchStorage(Film, "movies"))
+
+    found = await service.get_many(["p1", "p2"])
+
+    assert [film.id for film in found[0].films] == ["f0", "f1", "f2"]
+    assert [(film.id, film.role) for film in found[1].films] == [("f9", "writer")]
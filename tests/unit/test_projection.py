@@ -0,0 +1,46 @@
+import pytest
+
+from db import es_storage
+from db.es_storage import AsyncElasticsearchStorage
+from db.storage import source_fields
+from models.film import Film, FilmPreview, FilmRoles
+
+from .factories import make_film, make_person
+
+
+class FakeElasticsearch:
+    """Applies `_source` includes of the first level, records request bodies."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.bodies = []
+
+    async def search(self, index, body, request_timeout=None):
+        self.bodies.append(body)
+        fields = {field.split(".")[0] for field in body.get("_source", [])}
+        hits = [{"_source": {k: v for k, v in doc.items() if not fields or k in fields}} for doc in self.docs]
+        return {"hits": {"total": {"value": len(hits)}, "hits": hits}}
+
+
+def test_source_fields_follow_nested_models():
+    assert source_fields(FilmPreview) == ["id", "title", "imdb_rating", "description"]
+    assert source_fields(FilmRoles) == ["id", "actors.id", "writers.id", "directors.id"]
+
+
+@pytest.mark.asyncio
+async def test_search_fetches_only_model_fields(monkeypatch):
+    film = make_film("f1", actors=[make_person("p1")])
+    client = FakeElasticsearch([film.dict()])
+    monkeypatch.setattr(es_storage, "es", client)
+    storage = AsyncElasticsearchStorage(Film, "movies")
+
+    previews = await storage.search({"query": {"match_all": {}}}, model=FilmPreview)
+    roles = await storage.search({}, model=FilmRoles)
+    films = await storage.search({})
+
+    assert previews == [FilmPreview(**film.dict())]
+    assert client.bodies[0]["_source"] == source_fields(FilmPreview)
+    assert client.bodies[0]["query"] == {"match_all": {}}
+    assert [actor.id for actor in roles[0].actors] == ["p1"]
+    assert films == [film]
+    assert "_source" not in client.bodies[2]
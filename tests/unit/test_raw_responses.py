@@ -0,0 +1,90 @@
+import orjson
+import pytest
+
+from db.memory_cache import LocalCache
+from db.tiered_cache import TieredCache
+from models.film import Film, FilmPreview
+from models.person import Person
+from services.basic import CachedResponse
+from services.film import FilmService
+from services.person import PersonService
+
+from .factories import make_film, make_person
+from .fakes import FakeCache, FakeStorage
+
+
+def test_cached_response_round_trip():
+    response = CachedResponse(orjson.dumps([{"title": "line\nbreak"}]), {"count": 1, "next": "abc"})
+    assert CachedResponse.loads(response.dumps()) == response
+
+
+@pytest.mark.parametrize("data", (b'[{"id": "f1"}]', b'[{"id": "f1"}]\n[]', b"not json\n[]"))
+def test_value_in_other_format_is_not_a_cached_response(data):
+    assert CachedResponse.loads(data) is None
+
+
+@pytest.mark.asyncio
+async def test_list_cached_in_old_format_is_reloaded():
+    storage = FakeStorage([make_film("f1")])
+    service = FilmService(Film, FakeCache(), storage, 60)
+    await service.get_by_search_raw(size=2)
+    key, = service.cache.data
+    await service.cache.set(key, orjson.dumps([make_film("old").dict()]), expire=60)
+
+    response = await service.get_by_search_raw(size=2)
+
+    assert [item["id"] for item in orjson.loads(response.body)] == ["f1"]
+    assert storage.calls["search"] == 2
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_keeps_variants_of_one_key():
+    cache = TieredCache(remote=FakeCache(), local=LocalCache(max_size=10))
+    film = make_film("f1")
+    await cache.set("film:f1", film.json(), expire=60)
+
+    raw = await cache.get_object("film:f1", bytes)
+    parsed = await cache.get_object("film:f1", Film.parse_raw)
+
+    assert isinstance(raw, bytes)
+    assert parsed == film
+    assert await cache.get_object("film:f1", bytes) is raw
+    assert await cache.get_object("film:f1", Film.parse_raw) is parsed
+
+
+@pytest.mark.asyncio
+async def test_film_search_hit_returns_cached_body():
+    storage = FakeStorage([make_film("f1"), make_film("f2")])
+    service = FilmService(Film, FakeCache(), storage, 60)
+
+    miss = await service.get_by_search_raw(size=2)
+    hit = await service.get_by_search_raw(size=2)
+
+    assert hit.body == miss.body
+    assert hit.count == 2
+    assert storage.calls["search"] == 1
+    assert [set(item) for item in orjson.loads(hit.body)] == [set(FilmPreview.__fields__)] * 2
+
+
+@pytest.mark.asyncio
+async def test_film_details_raw_matches_model():
+    service = FilmService(Film, FakeCache(), FakeStorage([make_film("f1")]), 60)
+
+    miss = await service.get_by_id_raw("f1")
+    hit = await service.get_by_id_raw("f1")
+
+    assert Film.parse_raw(hit) == Film.parse_raw(miss) == await service.get_by_id("f1")
+    assert await service.get_by_id_raw("missing") is None
+
+
+@pytest.mark.asyncio
+async def test_person_films_are_cached_as_previews():
+    person = make_person("p1")
+    film_storage = FakeStorage([make_film("f1", actors=[person])])
+    service = PersonService(Person, FakeCache(), FakeStorage([person]), film_storage)
+
+    await service.get_films_by_person_raw("p1")
+    films = await service.get_films_by_person("p1")
+
+    assert films == [FilmPreview(**make_film("f1").dict())]
+    assert film_storage.calls["search"] == 1
@@ -0,0 +1,80 @@
+import pytest
+
+from db import redis_cache
+from db.redis_cache import RedisCache, ValueCodec
+
+from .factories import make_film, make_person
+
+
+class FakeRedis:
+    """Just enough of aioredis for RedisCache values."""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, expire=0):
+        self.data[key] = value
+
+    async def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, key, value, expire=0):
+        self.commands.append((key, value))
+
+    async def execute(self):
+        self.redis.data.update(self.commands)
+
+
+def test_codec_compresses_large_values_only():
+    codec = ValueCodec(min_size=100, level=6)
+    film = make_film("f1", actors=[make_person(f"p{i}") for i in range(20)]).json()
+
+    large, small = codec.encode(film), codec.encode("42")
+
+    assert large.startswith(b"\x00z") and len(large) < len(film)
+    assert small == b"42"
+    assert codec.decode(large) == film.encode()
+    assert codec.decode(small) == b"42"
+    assert codec.stats()["compressed"] == codec.stats()["plain"] == 1
+    assert codec.stats()["stored_bytes"] < codec.stats()["raw_bytes"]
+
+
+def test_codec_keeps_incompressible_values_plain():
+    codec = ValueCodec(min_size=10, level=6)
+    value = bytes(range(32, 127))
+    assert codec.encode(value) == value
+
+
+def test_codec_reads_legacy_values():
+    codec = ValueCodec(min_size=0, level=6)
+    assert codec.decode(b'{"id": "f1"}') == b'{"id": "f1"}'
+    assert codec.decode(None) is None
+    with pytest.raises(ValueError):
+        codec.decode(b"\x00?data")
+
+
+@pytest.mark.asyncio
+async def test_redis_cache_is_transparent(monkeypatch):
+    monkeypatch.setattr(redis_cache, "redis", FakeRedis())
+    monkeypatch.setattr(redis_cache, "codec", ValueCodec(min_size=100, level=6))
+    cache = RedisCache()
+    film = make_film("f1", actors=[make_person(f"p{i}") for i in range(20)])
+
+    await cache.set("f1", film.json(), expire=60)
+    await cache.set_many({"f2": film.json(), "n": "7"}, expire=60)
+
+    assert redis_cache.redis.data["f1"].startswith(b"\x00z")
+    assert await cache.get_object("f1", film.parse_raw) == film
+    assert await cache.get_many(["f2", "n", "missing"]) == [film.json().encode(), b"7", None]
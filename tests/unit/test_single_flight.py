@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from models.film import Film
+from models.genre import Genre
+from models.person import Person
+from services.basic import SingleFlight
+from services.film import FilmService
+from services.genre import GenreService
+from services.person import PersonService
+
+from .factories import make_film, make_genre, make_person
+from .fakes import FakeCache, FakeStorage
+
+CONCURRENCY = 1000
+
+
+async def run_concurrently(func, *args):
+    return await asyncio.gather(*(func(*args) for _ in range(CONCURRENCY)))
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_one_call():
+    calls = []
+
+    async def load(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value
+
+    flight = SingleFlight()
+    results = await asyncio.gather(*(flight.do("key", load, 42) for _ in range(CONCURRENCY)))
+
+    assert results == [42] * CONCURRENCY
+    assert len(calls) == 1
+    assert len(flight) == 0
+
+
+@pytest.mark.asyncio
+async def test_single_flight_propagates_errors_and_retries():
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("storage is down")
+
+    flight = SingleFlight()
+    results = await asyncio.gather(*(flight.do("key", load) for _ in range(10)), return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+
+    with pytest.raises(ValueError):
+        await flight.do("key", load)
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_cancelled_waiter():
+    async def load():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    flight = SingleFlight()
+    first = asyncio.ensure_future(flight.do("key", load))
+    second = asyncio.ensure_future(flight.do("key", load))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "done"
+
+
+@pytest.mark.asyncio
+async def test_film_by_id_misses_are_coalesced():
+    cache, storage = FakeCache(), FakeStorage([make_film("f1")])
+    service = FilmService(Film, cache, storage, 60)
+
+    films = await run_concurrently(service.get_by_id, "f1")
+
+    assert {f.id for f in films} == {"f1"}
+    assert storage.calls["get"] == 1
+    assert cache.calls["set"] == 1
+
+
+@pytest.mark.asyncio
+async def test_film_search_misses_are_coalesced():
+    cache, storage = FakeCache(), FakeStorage([make_film("f1"), make_film("f2")])
+    service = FilmService(Film, cache, storage, 60)
+
+    results = await run_concurrently(service.get_by_search, "query")
+
+    assert all(len(films) == 2 for films in results)
+    assert storage.calls["search"] == 1
+    assert cache.calls["set"] == 1
+
+
+@pytest.mark.asyncio
+async def test_genre_and_popularity_misses_are_coalesced():
+    genre = make_genre("g1")
+    cache = FakeCache()
+    storage = FakeStorage([genre])
+    film_storage = FakeStorage([make_film("f1", genres=[genre]), make_film("f2", genres=[genre])])
+    service = GenreService(Genre, cache, storage, film_storage, 60, 60)
+
+    genres = await run_concurrently(service.get_by_id, "g1")
+    popularity = await run_concurrently(service.get_genre_popularity, "g1")
+
+    assert {g.id for g in genres} == {"g1"}
+    assert set(popularity) == {2}
+    assert storage.calls["get"] == 1
+    assert film_storage.calls["aggregate"] == 1
+    assert cache.calls["set"] == 2
+
+
+@pytest.mark.asyncio
+async def test_person_details_and_films_misses_are_coalesced():
+    person = make_person("p1")
+    cache = FakeCache()
+    storage = FakeStorage([person])
+    film_storage = FakeStorage([make_film("f1", actors=[person])])
+    service = PersonService(Person, cache, storage, film_storage)
+
+    persons = await run_concurrently(service.get_by_id, "p1")
+    assert {p.id for p in persons} == {"p1"}
+    assert storage.calls["get"] == 1
+    search_calls = film_storage.calls["search"]
+
+    films = await run_concurrently(service.get_films_by_person, "p1")
+    assert all([f.id for f in person_films] == ["f1"] for person_films in films)
+    assert film_storage.calls["search"] == search_calls + 1
@@ -0,0 +1,197 @@
+from http import HTTPStatus
+
+import elasticsearch
+import orjson
+import pytest
+from fastapi import FastAPI, HTTPException
+
+from api.v1 import admin
+from db import es_storage
+from db.es_storage import AsyncElasticsearchStorage
+from db.slow_log import SlowQueryLog, profile_summary, query_shape
+from models.film import Film
+from services import auth
+from services.film import create_query_search
+
+from tests.support.asgi import request
+
+from .factories import make_film
+
+PROFILE = {"shards": [
+    {"id": "[n1][movies][0]",
+     "searches": [{"query": [{"type": "BooleanQuery", "description": "+title:star", "time_in_nanos": 2_000_000,
+                              "children": [{"type": "TermQuery", "description": "title:star",
+                                            "time_in_nanos": 1_500_000}]}],
+                   "rewrite_time": 100_000,
+                   "collector": [{"name": "SimpleTopScoreDocCollector", "time_in_nanos": 300_000}]}],
+     "aggregations": []},
+    {"id": "[n1][movies][1]",
+     "searches": [{"query": [{"type": "BooleanQuery", "description": "+title:star", "time_in_nanos": 9_000_000}],
+                   "rewrite_time": 0, "collector": []}],
+     "aggregations": []},
+]}
+
+
+class FakeElasticsearch:
+    def __init__(self, docs, took=5, profile=None):
+        self.docs = docs
+        self.took = took
+        self.profile = profile
+        self.bodies = []
+
+    async def search(self, index, body, request_timeout=None):
+        self.bodies.append(body)
+        hits = [{"_source": doc} for doc in self.docs]
+        result = {"took": self.took, "timed_out": False, "hits": {"total": {"value": len(hits)}, "hits": hits}}
+        if body.get("profile"):
+            result["profile"] = self.profile
+        return result
+
+    async def msearch(self, body, index, request_timeout=None):
+        return {"responses": [{**await self.search(index, query), "took": took}
+                              for took, query in zip((10, 3000), body[1::2])]}
+
+
+@pytest.fixture
+def slow_log(monkeypatch):
+    log = SlowQueryLog(threshold=1e-9, size=10)
+    monkeypatch.setattr(es_storage, "slow_log", log)
+    monkeypatch.setattr(admin, "slow_log", log)
+    return log
+
+
+def test_query_shape_hides_user_values_and_keeps_structure():
+    query = create_query_search("star wars", page=3, sort="-imdb_rating", genre="g1")
+
+    shape = query_shape(query)
+
+    assert "star wars" not in orjson.dumps(shape).decode()
+    assert "g1" not in orjson.dumps(shape).decode()
+    assert shape["from"] == "?"
+    assert shape["size"] == 10
+    assert shape["sort"] == query["sort"]
+    assert query_shape(create_query_search("other", page=1, sort="-imdb_rating", genre="g2")) == shape
+
+
+def test_profile_summary_puts_slowest_shard_first():
+    shards = profile_summary(PROFILE)
+
+    assert [shard["id"] for shard in shards] == ["[n1][movies][1]", "[n1][movies][0]"]
+    assert shards[1]["query_ms"] == 2.0
+    assert shards[1]["rewrite_ms"] == 0.1
+    assert shards[1]["collector_ms"] == 0.3
+    assert shards[1]["queries"][0]["children"][0] == {"type": "TermQuery", "description": "title:star",
+                                                      "time_ms": 1.5, "children": []}
+
+
+def test_fast_calls_are_not_recorded():
+    log = SlowQueryLog(threshold=1, size=10)
+
+    log.record("search", "movies", {"query": {"match_all": {}}}, 0.5, {"took": 400})
+    SlowQueryLog(threshold=0, size=10).record("search", "movies", {}, 100)
+
+    assert log.recent() == []
+    assert log.stats() == {"slow": 0, "profiled": 0, "entries": 0}
+
+
+@pytest.mark.asyncio
+async def test_slow_search_is_recorded_with_shape_and_hits(slow_log, monkeypatch):
+    monkeypatch.setattr(es_storage, "es", FakeElasticsearch([make_film("f1").dict()], took=7))
+    storage = AsyncElasticsearchStorage(Film, "movies")
+
+    await storage.search_page(create_query_search("star wars"))
+    await storage.search_page(create_query_search("alien"))
+
+    entries = slow_log.recent()
+    assert [entry["operation"] for entry in entries] == ["search", "search"]
+    assert entries[0]["index"] == "movies"
+    assert entries[0]["took_ms"] == 7
+    assert entries[0]["hits"] == 1
+    assert entries[0]["total"] == 1
+    assert entries[0]["slow"] is True
+    assert entries[0]["error"] is None
+    assert "profile" not in entries[0]
+    shapes = slow_log.shapes()
+    assert len(shapes) == 1
+    assert shapes[0]["count"] == 2
+    assert slow_log.recent(fingerprint=shapes[0]["fingerprint"]) == entries
+
+
+class FailingElasticsearch:
+    async def search(self, index, body, request_timeout=None):
+        raise elasticsearch.RequestError(HTTPStatus.BAD_REQUEST, "search_phase_execution_exception", {})
+
+    async def msearch(self, body, index, request_timeout=None):
+        raise elasticsearch.TransportError(HTTPStatus.INTERNAL_SERVER_ERROR, "internal_server_error", {})
+
+
+@pytest.mark.asyncio
+async def test_failed_slow_calls_are_recorded_with_error(slow_log, monkeypatch):
+    monkeypatch.setattr(es_storage, "es", FailingElasticsearch())
+    storage = AsyncElasticsearchStorage(Film, "movies")
+
+    with pytest.raises(HTTPException):
+        await storage.search_page(create_query_search("star"))
+    with pytest.raises(elasticsearch.TransportError):
+        await storage.multi_search([create_query_search(page=1), create_query_search(page=2)])
+
+    entries = slow_log.recent()
+    assert [(entry["operation"], entry["error"]) for entry in entries] == [
+        ("multi_search", "TransportError"), ("multi_search", "TransportError"), ("search", "RequestError")]
+    assert entries[-1]["took_ms"] is None
+    assert entries[-1]["hits"] is None
+
+
+@pytest.mark.asyncio
+async def test_batched_queries_are_judged_by_their_own_took(monkeypatch):
+    log = SlowQueryLog(threshold=1, size=10)
+    monkeypatch.setattr(es_storage, "slow_log", log)
+    monkeypatch.setattr(es_storage, "es", FakeElasticsearch([]))
+    storage = AsyncElasticsearchStorage(Film, "movies")
+
+    await storage.multi_search([create_query_search(page=1), create_query_search(page=2)])
+
+    assert [(entry["operation"], entry["took_ms"]) for entry in log.recent()] == [("multi_search", 3000)]
+
+
+@pytest.mark.asyncio
+async def test_sampled_queries_are_profiled(monkeypatch):
+    log = SlowQueryLog(threshold=10, size=10, profile_rate=1.0)
+    client = FakeElasticsearch([], profile=PROFILE)
+    monkeypatch.setattr(es_storage, "slow_log", log)
+    monkeypatch.setattr(es_storage, "es", client)
+
+    await AsyncElasticsearchStorage(Film, "movies").search_page(create_query_search("star"))
+
+    assert client.bodies[0]["profile"] is True
+    entry, = log.recent()
+    assert entry["slow"] is False
+    assert entry["profile"][0]["id"] == "[n1][movies][1]"
+    assert log.recent(slow_only=True) == []
+    assert log.stats()["profiled"] == 1
+
+
+@pytest.mark.asyncio
+async def test_admin_endpoint_requires_admin_role(slow_log, monkeypatch):
+    async def check_token(token, roles):
+        return HTTPStatus.OK if token == "admin" else HTTPStatus.FORBIDDEN
+
+    monkeypatch.setattr(auth, "check_token", check_token)
+    auth.verdicts.clear()
+    slow_log.record("count", "movies", {"query": {"term": {"id": "f1"}}}, 2.0, {"count": 1})
+    app = FastAPI()
+    app.include_router(admin.router, prefix="/api/v1/admin")
+
+    forbidden = await request(app, "/api/v1/admin/slow-queries", headers={"Authorization": "Bearer user"})
+    response = await request(app, "/api/v1/admin/slow-queries", headers={"Authorization": "Bearer admin"})
+    cleared = await request(app, "/api/v1/admin/slow-queries", headers={"Authorization": "Bearer admin"},
+                            method="DELETE")
+
+    assert forbidden.status == HTTPStatus.FORBIDDEN
+    assert response.status == HTTPStatus.OK
+    body = orjson.loads(response.body)
+    assert body["queries"][0]["shape"] == {"query": {"term": {"id": "?"}}}
+    assert body["queries"][0]["total"] == 1
+    assert body["shapes"][0]["count"] == 1
+    assert cleared.status == HTTPStatus.NO_CONTENT
+    assert slow_log.recent() == []
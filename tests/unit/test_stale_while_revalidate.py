@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+from opentelemetry import trace
+
+from core.deadline import deadline, remaining
+from core.scheduler import BackgroundScheduler
+from models.film import Film
+from models.genre import Genre
+from services import basic
+from services.film import FilmService
+from services.genre import GenreService
+
+from .factories import make_film, make_genre
+from .fakes import FakeCache, FakeStorage
+
+
+@pytest.mark.asyncio
+async def test_scheduler_bounds_and_deduplicates_tasks():
+    scheduler = BackgroundScheduler(max_concurrency=2, max_pending=3)
+    running, peak = [0], [0]
+
+    async def job():
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+
+    assert scheduler.schedule("a", job)
+    assert not scheduler.schedule("a", job)
+    assert scheduler.schedule("b", job)
+    assert scheduler.schedule("c", job)
+    assert not scheduler.schedule("d", job)
+
+    await asyncio.sleep(0.05)
+    assert peak[0] == 2
+    assert scheduler.stats() == {"pending": 0, "completed": 3, "failed": 0, "dropped": 1}
+
+
+@pytest.mark.asyncio
+async def test_scheduled_tasks_do_not_inherit_request_context():
+    scheduler = BackgroundScheduler(max_concurrency=1, max_pending=1)
+    span = trace.NonRecordingSpan(trace.SpanContext(trace_id=1, span_id=1, is_remote=False))
+    seen = []
+
+    async def job():
+        seen.append((remaining(), basic.load_started.get(), trace.get_current_span().get_span_context().is_valid))
+
+    with deadline(0.01), trace.use_span(span):
+        token = basic.load_started.set(1.0)
+        assert scheduler.schedule("job", job)
+        basic.load_started.reset(token)
+    await asyncio.sleep(0.02)
+
+    assert seen == [(None, None, False)]
+
+
+@pytest.mark.asyncio
+async def test_stale_list_is_served_and_refreshed_once(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(basic.time, "time", lambda: now[0])
+    scheduler = BackgroundScheduler(max_concurrency=1, max_pending=10)
+    monkeypatch.setattr(basic, "scheduler", scheduler)
+    storage = FakeStorage([make_film("f1").copy(update={"title": "Old"})])
+    service = FilmService(Film, FakeCache(), storage, 60)
+
+    await service.get_by_search()
+    storage.docs["f1"] = make_film("f1").copy(update={"title": "New"})
+    now[0] += 61
+
+    stale = await asyncio.gather(*(service.get_by_search() for _ in range(5)))
+    assert [films[0].title for films in stale] == ["Old"] * 5
+    assert len(scheduler) == 1
+
+    await asyncio.sleep(0.05)
+    assert storage.calls["search"] == 2
+    assert (await service.get_by_search())[0].title == "New"
+
+
+@pytest.mark.asyncio
+async def test_long_running_tasks_stop_on_close():
+    scheduler = BackgroundScheduler(max_concurrency=1, max_pending=1)
+    ticks = []
+
+    async def consumer():
+        while True:
+            ticks.append(1)
+            await asyncio.sleep(0.01)
+
+    scheduler.start("consumer", consumer)
+    scheduler.start("refresher", consumer)
+    assert scheduler.schedule("job", asyncio.sleep, 1)
+    with pytest.raises(ValueError):
+        scheduler.start("consumer", consumer)
+    await asyncio.sleep(0.03)
+    await scheduler.close()
+    stopped = len(ticks)
+    await asyncio.sleep(0.03)
+
+    assert stopped >= 2
+    assert len(ticks) == stopped
+    assert len(scheduler) == 0
+    scheduler.start("consumer", consumer)
+    await scheduler.close()
+
+
+@pytest.mark.asyncio
+async def test_genre_cursor_returns_page():
+    service = GenreService(Genre, FakeCache(), FakeStorage([make_genre("g1"), make_genre("g2")]),
+                           FakeStorage(), 60, 60)
+
+    page = await service.get_by_cursor(cursor="", size=1)
+
+    assert [genre.id for genre in page.items] == ["g1"]
+    assert page.next_cursor
@@ -0,0 +1,59 @@
+import pytest
+
+from db.memory_cache import LocalCache
+from db.tiered_cache import TieredCache
+from models.genre import Genre
+
+from .fakes import FakeCache
+
+
+def test_local_cache_evicts_least_recently_used():
+    cache = LocalCache(max_size=2)
+    cache.set("a", 1, expire=60)
+    cache.set("b", 2, expire=60)
+    assert cache.get("a") == 1
+    cache.set("c", 3, expire=60)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_local_cache_expires_keys(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("db.memory_cache.time.monotonic", lambda: now[0])
+    cache = LocalCache(max_size=10)
+    cache.set("a", 1, expire=5)
+    now[0] += 4
+    assert cache.get("a") == 1
+    now[0] += 1
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_keeps_parsed_objects():
+    remote = FakeCache()
+    cache = TieredCache(remote=remote, local=LocalCache(max_size=10))
+    genre = Genre(id="1", name="Drama", description=None)
+    await cache.set("genres:1", genre.json(), expire=60)
+
+    first = await cache.get_object("genres:1", Genre.parse_raw, expire=60)
+    second = await cache.get_object("genres:1", Genre.parse_raw, expire=60)
+
+    assert first == genre
+    assert second is first
+    assert remote.calls["get"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_set_drops_local_copy():
+    remote = FakeCache()
+    cache = TieredCache(remote=remote, local=LocalCache(max_size=10))
+    await cache.set("key", "old", expire=60)
+    assert await cache.get_object("key", bytes.decode) == "old"
+
+    await cache.set("key", "new", expire=60)
+    assert await cache.get_object("key", bytes.decode) == "new"
@@ -0,0 +1,79 @@
+import pytest
+from fastapi import Response
+
+from api.v1.genre import genre_index
+from api.v1.responses import cached_json_response
+from core.config import ES_MAX_RESULT_WINDOW
+from db import es_storage
+from db.es_storage import AsyncElasticsearchStorage
+from models.film import Film
+from models.genre import Genre
+from services.basic import CachedResponse
+from services.film import FilmService
+from services.genre import GenreService
+
+from .factories import make_film, make_genre
+from .fakes import FakeCache, FakeStorage
+
+
+class FakeElasticsearch:
+    def __init__(self, total: dict):
+        self.total = total
+        self.bodies = []
+
+    async def search(self, index, body, request_timeout=None):
+        self.bodies.append(body)
+        return {"hits": {"total": self.total, "hits": []}}
+
+
+@pytest.mark.asyncio
+async def test_search_reports_whether_total_is_exact(monkeypatch):
+    client = FakeElasticsearch({"value": 10000, "relation": "gte"})
+    monkeypatch.setattr(es_storage, "es", client)
+    storage = AsyncElasticsearchStorage(Film, "movies")
+
+    page = await storage.search_page({"track_total_hits": 50})
+    assert (page.total, page.total_exact) == (10000, False)
+    assert client.bodies[0]["track_total_hits"] == 50
+
+    client.total = {"value": 7, "relation": "eq"}
+    page = await storage.search_page({})
+    assert (page.total, page.total_exact) == (7, True)
+    assert client.bodies[1]["track_total_hits"] > 0
+
+
+@pytest.mark.asyncio
+async def test_film_list_has_total_without_count_query():
+    storage = FakeStorage([make_film(f"f{i:02}") for i in range(25)])
+    service = FilmService(Film, FakeCache(), storage, 60)
+
+    response = cached_json_response(await service.get_by_search_raw(page=1, size=10), 10)
+    cached = cached_json_response(await service.get_by_search_raw(page=1, size=10), 10)
+
+    assert response.headers["X-Total-Count"] == cached.headers["X-Total-Count"] == "25"
+    assert response.headers["X-Total-Relation"] == "eq"
+    assert response.headers["X-Page-Count"] == "3"
+    assert (storage.calls["search"], storage.calls["count"]) == (1, 0)
+
+
+def test_page_count_stops_at_result_window():
+    response = CachedResponse(b"[]", {"total": 10 ** 6, "exact": False})
+
+    headers = cached_json_response(response, 10).headers
+
+    assert headers["X-Total-Relation"] == "gte"
+    assert headers["X-Page-Count"] == str(ES_MAX_RESULT_WINDOW // 10)
+    assert "X-Total-Count" not in cached_json_response(CachedResponse(b"[]")).headers
+
+
+@pytest.mark.asyncio
+async def test_genre_list_sets_total_headers():
+    genres = [make_genre(f"g{i:02}") for i in range(12)]
+    service = GenreService(Genre, FakeCache(), FakeStorage(genres), FakeStorage([]), 60, 60)
+    response = Response()
+
+    page = await genre_index(size=5, page=3, cursor=None, response=response, genre_service=service)
+
+    assert [genre.id for genre in page] == ["g10", "g11"]
+    assert response.headers["X-Total-Count"] == "12"
+    assert response.headers["X-Page-Count"] == "3"
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+from fastapi import APIRouter, FastAPI
+from opentelemetry import trace
+
+from api.instrumentation import InstrumentedRoute, TracingMiddleware
+from core.tracing import outgoing_headers, request_id, setup_tracing, tracer
+from db import es_storage
+from db.es_storage import AsyncElasticsearchStorage, query_type
+from models.film import Film
+from models.person import BasePerson, Person
+from services.person import PersonService
+
+from tests.support.asgi import request
+
+from .factories import make_film, make_person
+from .fakes import FakeCache
+
+exporter = setup_tracing("memory")
+
+TRACE_ID = "0af7651916cd43dd8448eb211c80319c"
+PARENT_ID = "b7ad6b7169203331"
+
+
+class FakeElasticsearch:
+    def __init__(self, persons, films):
+        self.persons = {person.id: person.dict() for person in persons}
+        self.films = [film.dict() for film in films]
+
+    async def get(self, index, doc_id, request_timeout=None):
+        await asyncio.sleep(0.02)
+        return {"_source": self.persons[doc_id]}
+
+    async def search(self, index, body, request_timeout=None):
+        await asyncio.sleep(0.02)
+        hits = [{"_source": film} for film in self.films]
+        return {"hits": {"total": {"value": len(hits)}, "hits": hits}}
+
+    async def msearch(self, index, body, request_timeout=None):
+        return {"responses": [await self.search(index, query) for query in body[1::2]]}
+
+
+def create_app() -> FastAPI:
+    service = PersonService(Person, FakeCache(), AsyncElasticsearchStorage(BasePerson, "persons"),
+                            AsyncElasticsearchStorage(Film, "movies"))
+    router = APIRouter(route_class=InstrumentedRoute)
+
+    @router.get("/{person_id}")
+    async def person_details(person_id: str):
+        return await service.get_by_id(person_id)
+
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware)
+    app.include_router(router, prefix="/persons")
+    return app
+
+
+@pytest.mark.asyncio
+async def test_request_span_breaks_down_into_io_spans(monkeypatch):
+    person = make_person("p1")
+    monkeypatch.setattr(es_storage, "es", FakeElasticsearch([person], [make_film("f1", actors=[person])]))
+    exporter.clear()
+
+    response = await request(create_app(), "/persons/p1", headers={
+        "X-Request-Id": "req-1",
+        "traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01",
+    })
+
+    assert response.status == 200
+    assert response.headers["x-request-id"] == "req-1"
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    root = spans["GET /persons/{person_id}"]
+    assert format(root.context.trace_id, "032x") == TRACE_ID
+    assert format(root.parent.span_id, "016x") == PARENT_ID
+    assert root.attributes["http.request_id"] == "req-1"
+    assert root.attributes["http.status_code"] == 200
+
+    lookup, get, search = spans["cache.lookup"], spans["elasticsearch.get"], spans["elasticsearch.multi_search"]
+    assert lookup.attributes["cache.prefix"] == "person_search"
+    assert lookup.attributes["cache.miss"] == 1
+    assert get.attributes["elasticsearch.index"] == "persons"
+    assert search.attributes["elasticsearch.index"] == "movies"
+    assert search.attributes["elasticsearch.queries"] == 1
+    assert {span.parent.span_id for span in (lookup, get, search)} == {root.context.span_id}
+    # The person and their films are loaded concurrently.
+    assert search.start_time < get.end_time and get.start_time < search.end_time
+
+
+def test_outgoing_calls_carry_request_id_and_trace_context():
+    token = request_id.set("req-2")
+    try:
+        with tracer.start_as_current_span("auth.check"):
+            headers = outgoing_headers()
+            span_id = trace.get_current_span().get_span_context().span_id
+    finally:
+        request_id.reset(token)
+
+    assert headers["X-Request-Id"] == "req-2"
+    assert headers["traceparent"].split("-")[2] == format(span_id, "016x")
+
+
+def test_query_type_names_root_query_and_extras():
+    assert query_type({"query": {"multi_match": {}}, "search_after": [1]}) == "multi_match+search_after"
+    assert query_type({"aggs": {}}) == "match_all+aggs"
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from models.film import Film
+from models.genre import Genre
+from models.person import Person
+from services.film import FilmService
+from services.genre import GenreService
+from services.person import PersonService
+from services import warmup
+from services.warmup import warm_up
+
+from .factories import make_film, make_genre, make_person
+from .fakes import FakeCache, FakeStorage
+
+
+@pytest.mark.asyncio
+async def test_warm_up_fills_cache_for_first_requests():
+    genres = [make_genre(f"g{i:02}") for i in range(12)]
+    persons = [make_person("p1"), make_person("p2")]
+    cache = FakeCache()
+    film_storage = FakeStorage([make_film(f"f{i:02}", genres=genres[:2], actors=persons) for i in range(25)])
+    genre_storage, person_storage = FakeStorage(genres), FakeStorage(persons)
+    films = FilmService(Film, cache, film_storage, 60)
+    genre_service = GenreService(Genre, cache, genre_storage, film_storage, 60, 60)
+    person_service = PersonService(Person, cache, person_storage, film_storage)
+
+    report = await warm_up(films, genre_service, person_service, pages=2, sorts=(None, "-imdb_rating"),
+                           film_ids=["f01", "f02"], person_ids=["p1"], concurrency=4)
+
+    # 2 genre pages, 12 genres, 12 popularity counters, 2 sorts * 13 genre filters * 2 pages, 2 films, 1 person
+    assert report["keys"] == 2 + 12 + 12 + 52 + 2 + 1
+    assert report["genres"] == 12
+    assert film_storage.calls["aggregate"] == 1
+    # Film pages and roles of the person.
+    assert film_storage.calls["multi_search"] == 2
+    assert genre_storage.calls["get_many"] == 1
+
+    searches = film_storage.calls["search"]
+    await films.get_by_search(page=2, sort="-imdb_rating", genre="g05")
+    await genre_service.get_genres_popularity([genre.id for genre in genres])
+    await person_service.get_by_id("p1")
+    assert film_storage.calls["search"] == searches
+    assert film_storage.calls["aggregate"] == 1
+    assert person_storage.calls["get"] == 0
+
+
+@pytest.mark.asyncio
+async def test_slow_warm_up_does_not_block_startup(monkeypatch):
+    stopped = []
+
+    async def slow_warm_up(*services):
+        try:
+            await asyncio.sleep(10)
+        finally:
+            stopped.append(True)
+
+    monkeypatch.setattr(warmup, "create_services", lambda: ())
+    monkeypatch.setattr(warmup, "warm_up", slow_warm_up)
+    monkeypatch.setattr(warmup, "last_report", None)
+
+    await asyncio.wait_for(warmup.warm_up_on_startup(timeout=0.05), 1)
+
+    assert stopped == [True]
+    assert warmup.last_report is None